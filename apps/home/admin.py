@@ -1,8 +1,11 @@
 from django.contrib import admin
+from django.utils.html import format_html
 from .models import (Customer, Trip, Ticket, Station, Route, Train, 
     Crew_In_Charge, Maintenance_Log, Train_Model, Task,
     L_Station, I_Station, L_Route, I_Route, 
-    S_Series, A_Series, L_Trip, I_Trip, Log_Task
+    S_Series, A_Series, L_Trip, I_Trip, Log_Task, Booking_Request,
+    Service_Pattern, Service_Exception, Maintenance_Due, Waitlist_Entry,
+    Ticket_Trip, Trip_Price, Job_Run, Request_Profile, Schedule_Change
 )
 
 # ------------------------------------------------------------------
@@ -81,34 +84,106 @@ class TrainAdmin(admin.ModelAdmin):
 # ------------------------------------------------------------------
 # TRIPS & TICKETS
 # ------------------------------------------------------------------
+class TripPriceInline(admin.TabularInline):
+    model = Trip_Price
+    fields = ('priced_at', 'price', 'base_cost', 'load_factor', 'days_to_departure')
+    readonly_fields = fields
+    ordering = ('-priced_at',)
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 class TripAdmin(admin.ModelAdmin):
     list_display = ('trip_id', 'route', 'train', 'schedule_day', 'departure_time', 'arrival_time', 'trip_cost', 'trip_type')
     list_filter = ('trip_type', 'is_archived')
     search_fields = ('trip_id', 'route__route_id', 'train__train_number')
+    raw_id_fields = ('service_pattern',)
     
     date_hierarchy = 'schedule_day' 
     
     fieldsets = (
         ('Trip Identification', {'fields': ('trip_id', 'trip_type', 'is_archived')}),
         ('Schedule details', {'fields': ('schedule_day', 'departure_time', 'arrival_time', 'duration')}),
-        ('Assignments', {'fields': ('route', 'train')}),
-        ('Pricing', {'fields': ('trip_cost',)}),
+        ('Assignments', {'fields': ('route', 'train', 'service_pattern')}),
+        ('Pricing', {'fields': ('trip_cost', 'base_cost')}),
     )
     readonly_fields = ('duration',) # Auto-calculated, so prevent manual edits
+    inlines = [TripPriceInline]
+
+    def save_model(self, request, obj, form, change):
+        # The form's full_clean() already checked the train's schedule
+        obj.save(check_conflicts=False)
+
+class ServiceExceptionInline(admin.TabularInline):
+    model = Service_Exception
+    extra = 1
+
+class ServicePatternAdmin(admin.ModelAdmin):
+    list_display = ('id', 'route', 'train', 'departure_time', 'arrival_time', 'days_display', 'valid_from', 'valid_until', 'trip_cost')
+    list_filter = ('trip_type',)
+    search_fields = ('route__route_id', 'train__train_number')
+
+    fieldsets = (
+        ('Service', {'fields': ('trip_type', 'route', 'train', 'trip_cost')}),
+        ('Timetable', {'fields': ('departure_time', 'arrival_time', 'days_of_week', 'valid_from', 'valid_until')}),
+    )
+    inlines = [ServiceExceptionInline]
+
+class TicketTripInline(admin.TabularInline):
+    model = Ticket_Trip
+    fields = ('trip', 'price')
+    raw_id_fields = ('trip',)
+    extra = 1
 
 class TicketAdmin(admin.ModelAdmin):
-    list_display = ('ticket_id', 'customer', 'purchase_date', 'trip_date', 'total_cost')
+    list_display = ('ticket_id', 'customer', 'purchase_date', 'trip_date', 'total_cost', 'cancelled_at')
     search_fields = ('ticket_id', 'customer__last_name', 'customer__customer_id')
-    list_filter = ('purchase_date', 'trip_date')
+    list_filter = ('purchase_date', 'trip_date', ('cancelled_at', admin.EmptyFieldListFilter))
     date_hierarchy = 'purchase_date'
-    filter_horizontal = ('trips',)
+    actions = ['cancel_tickets']
     
     fieldsets = (
-        ('Ticket Information', {'fields': ('ticket_id', 'customer', 'total_cost')}),
+        ('Ticket Information', {'fields': ('ticket_id', 'customer', 'total_cost', 'cancelled_at')}),
         ('Dates', {'fields': ('purchase_date', 'trip_date')}),
-        ('Itinerary', {'fields': ('trips',)}),
     )
-    readonly_fields = ('ticket_id', 'total_cost')
+    readonly_fields = ('ticket_id', 'total_cost', 'cancelled_at')
+    inlines = [TicketTripInline]
+
+    @admin.action(description="Cancel selected tickets (revokes their QR passes)")
+    def cancel_tickets(self, request, queryset):
+        tickets = list(queryset.filter(cancelled_at__isnull=True))
+        for ticket in tickets:
+            ticket.cancel()
+        self.message_user(request, f"Cancelled {len(tickets)} ticket(s).")
+
+class BookingRequestAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'customer', 'trip_date', 'status', 'ticket', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('idempotency_key', 'customer__customer_id', 'ticket__ticket_id')
+    readonly_fields = ('idempotency_key', 'customer', 'ticket', 'created_at', 'updated_at')
+
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'customer', 'status', 'created_at', 'expires_at', 'ticket')
+    list_filter = ('status',)
+    search_fields = ('trip__trip_id', 'customer__customer_id', 'ticket__ticket_id')
+    readonly_fields = ('created_at', 'promoted_at', 'ticket')
+    raw_id_fields = ('trip', 'customer')
+
+class ScheduleChangeAdmin(admin.ModelAdmin):
+    list_display = ('trip_id', 'kind', 'created_at', 'old_departure_time', 'new_departure_time', 'recipients', 'notified')
+    list_filter = ('kind',)
+    search_fields = ('trip_id',)
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    readonly_fields = (
+        'trip_id', 'kind', 'old_schedule_day', 'old_departure_time', 'old_arrival_time',
+        'new_schedule_day', 'new_departure_time', 'new_arrival_time', 'created_at', 'fanned_out_at', 'recipients', 'notified',
+    )
+
+    def has_add_permission(self, request):
+        return False
 
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('customer_id', 'last_name', 'given_name', 'user', 'gender')
@@ -147,6 +222,67 @@ class MaintenanceLogAdmin(admin.ModelAdmin):
     readonly_fields = ('log_id',)
     inlines = [LogTaskInline]
 
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('task_name', 'interval_days')
+    search_fields = ('task_name',)
+
+class MaintenanceDueAdmin(admin.ModelAdmin):
+    list_display = ('train', 'task', 'last_performed', 'due_date', 'is_overdue')
+    list_filter = ('task', 'due_date')
+    search_fields = ('train__train_number', 'task__task_name')
+    date_hierarchy = 'due_date'
+    list_select_related = ('train', 'task')
+    readonly_fields = ('train', 'task', 'last_performed', 'last_log', 'due_date')
+
+    @admin.display(boolean=True, description='Overdue')
+    def is_overdue(self, obj):
+        return obj.is_overdue
+
+# ------------------------------------------------------------------
+# BACKGROUND JOBS
+# ------------------------------------------------------------------
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ('task_name', 'started_at', 'state', 'duration', 'query_count', 'rows_affected', 'rss_growth_kb', 'profiled')
+    list_filter = ('state', 'task_name')
+    search_fields = ('task_name', 'task_id')
+    date_hierarchy = 'started_at'
+    ordering = ('-started_at',)
+    fields = (
+        'task_name', 'task_id', 'state', 'result', 'started_at', 'duration',
+        'query_count', 'rows_affected', 'max_rss_kb', 'rss_growth_kb', 'profile_report',
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(boolean=True, description='Profiled')
+    def profiled(self, obj):
+        return bool(obj.profile)
+
+    @admin.display(description='Profile')
+    def profile_report(self, obj):
+        return format_html('<pre style="white-space: pre">{}</pre>', obj.profile) if obj.profile else '-'
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration', 'query_count', 'trigger', 'mode', 'user')
+    list_filter = ('trigger', 'mode', 'status_code')
+    search_fields = ('path', 'user__username')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    fields = (
+        'created_at', 'method', 'path', 'user', 'status_code', 'duration', 'query_count',
+        'trigger', 'mode', 'profile_file', 'stacks_file', 'summary_report',
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Summary')
+    def summary_report(self, obj):
+        return format_html('<pre style="white-space: pre">{}</pre>', obj.summary) if obj.summary else '-'
+
 # ------------------------------------------------------------------
 # BASE ADMIN REGISTRATIONS
 # ------------------------------------------------------------------
@@ -166,11 +302,19 @@ admin.site.register(A_Series)
 admin.site.register(Trip, TripAdmin)
 admin.site.register(L_Trip)
 admin.site.register(I_Trip)
+admin.site.register(Service_Pattern, ServicePatternAdmin)
 
 admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Ticket, TicketAdmin)
+admin.site.register(Booking_Request, BookingRequestAdmin)
+admin.site.register(Waitlist_Entry, WaitlistEntryAdmin)
+admin.site.register(Schedule_Change, ScheduleChangeAdmin)
 
 admin.site.register(Crew_In_Charge, CrewInChargeAdmin)
-admin.site.register(Task)
+admin.site.register(Task, TaskAdmin)
 admin.site.register(Maintenance_Log, MaintenanceLogAdmin)
-admin.site.register(Log_Task)
\ No newline at end of file
+admin.site.register(Log_Task)
+admin.site.register(Maintenance_Due, MaintenanceDueAdmin)
+
+admin.site.register(Job_Run, JobRunAdmin)
+admin.site.register(Request_Profile, RequestProfileAdmin)
\ No newline at end of file
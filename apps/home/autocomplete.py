@@ -0,0 +1,167 @@
+import logging
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from .caching import get_schedule_version
+from .models import Station
+from .network import get_network, load_network_snapshot
+
+MAX_SUGGESTIONS = 10
+
+# Queries shorter than this only match prefixes; longer ones fall back to trigrams for typos
+MIN_FUZZY_LENGTH = 3
+
+# Minimum trigram (Jaccard) similarity for a fuzzy suggestion
+FUZZY_THRESHOLD = 0.3
+
+TYPE_LABELS = dict(Station.STATION_TYPES)
+
+logger = logging.getLogger(__name__)
+
+Suggestion = namedtuple('Suggestion', 'station_id station_name station_type label')
+
+
+def normalize(text):
+    """
+    Case-, accent- and punctuation-insensitive form used for matching.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefix_range(keys, prefix):
+    # keys are sorted, so every key starting with prefix sits in one run from here
+    i = bisect_left(keys, prefix)
+    while i < len(keys) and keys[i].startswith(prefix):
+        yield i
+        i += 1
+
+
+class StationIndex:
+    """
+    Station names in sorted prefix lists (whole names, then every later word, so
+    "par" finds "Cair Paravel") plus a trigram index for misspellings. Built from
+    the network snapshot, so it needs no queries of its own.
+    """
+    def __init__(self, stations, version):
+        self.version = version
+        self.stations = [
+            Suggestion(station_id, name, station_type, f'{name} ({TYPE_LABELS.get(station_type, station_type)})')
+            for station_id, name, station_type in stations
+        ]
+        names = [normalize(s.station_name) for s in self.stations]
+        self._names = names
+
+        by_name = sorted((name, i) for i, name in enumerate(names))
+        self._name_keys = [name for name, _ in by_name]
+        self._name_stations = [i for _, i in by_name]
+
+        by_word = sorted(
+            (' '.join(words[w:]), i)
+            for i, words in enumerate(name.split() for name in names) for w in range(1, len(words))
+        )
+        self._word_keys = [key for key, _ in by_word]
+        self._word_stations = [i for _, i in by_word]
+
+        by_id = sorted((s.station_id, i) for i, s in enumerate(self.stations))
+        self._id_keys = [station_id for station_id, _ in by_id]
+        self._id_stations = [i for _, i in by_id]
+
+        self._trigrams = {}
+        self._gram_counts = []
+        for i, name in enumerate(names):
+            grams = trigrams(name)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._trigrams.setdefault(gram, []).append(i)
+
+    @classmethod
+    def from_network(cls, network):
+        return cls([network.station(i) for i in range(network.station_count)], network.version)
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        """
+        Up to `limit` stations for a partial name or ID, best first: exact name,
+        names starting with the query, names with a later word starting with it
+        (each alphabetical), then close misspellings by trigram similarity.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        found = []
+        seen = set()
+
+        def take(indexes):
+            for i in indexes:
+                if len(found) >= limit:
+                    return
+                if i not in seen:
+                    seen.add(i)
+                    found.append(i)
+
+        if query.isdigit():
+            take(self._id_stations[j] for j in _prefix_range(self._id_keys, query))
+        take(self._name_stations[j] for j in _prefix_range(self._name_keys, query) if self._name_keys[j] == query)
+        take(self._name_stations[j] for j in _prefix_range(self._name_keys, query))
+        take(self._word_stations[j] for j in _prefix_range(self._word_keys, query))
+        if len(found) < limit and len(query) >= MIN_FUZZY_LENGTH:
+            take(self._fuzzy(query))
+        return [self.stations[i] for i in found]
+
+    def _fuzzy(self, query):
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        scored = []
+        for i, count in shared.items():
+            similarity = count / (len(grams) + self._gram_counts[i] - count)
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((-similarity, self._names[i], i))
+        return [i for _, _, i in sorted(scored)]
+
+
+_index = None
+
+
+def get_station_index(version=None):
+    """
+    This process's index for the current schedule version; station edits bump
+    the version, so the next call rebuilds it from the refreshed network snapshot.
+    """
+    global _index
+    version = get_schedule_version() if version is None else version
+    if _index is None or _index.version != version:
+        _index = StationIndex.from_network(get_network(version))
+    return _index
+
+
+def warm_station_index():
+    """
+    Builds the index when a server process starts (core/wsgi.py, core/asgi.py):
+    from the snapshot file alone when one exists, otherwise from the database.
+    Any failure (database or cache unreachable, unreadable snapshot) is logged
+    and the build left to the first request, so the process still boots.
+    """
+    global _index
+    try:
+        network = load_network_snapshot()
+        if network is not None:
+            _index = StationIndex.from_network(network)
+            return _index
+        return get_station_index()
+    except Exception:
+        logger.warning("Could not warm the station index; it will be built on first use", exc_info=True)
+        return None
+
+
+def suggest_stations(query, limit=MAX_SUGGESTIONS):
+    return get_station_index().suggest(query, limit)
@@ -0,0 +1,321 @@
+import bisect
+import datetime
+import itertools
+import json
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import Trip, Station, compute_durations
+
+# Key layout (same in Redis and the in-process stand-in):
+#   board:{station_id}:departures / :arrivals   sorted set, trip_id scored by timestamp
+#   board:trips                                 hash, trip_id -> JSON entry shown on the board
+#   board:stations                              hash, station_id -> station name
+#   board:pattern:{pk}                          set of trip_ids expanded from one service pattern
+TRIPS_KEY = 'board:trips'
+STATIONS_KEY = 'board:stations'
+BOARD_KINDS = ('departures', 'arrivals')
+
+# Departed trips stay on the board briefly so kiosks can show "departed"
+DEPARTED_GRACE_SECONDS = 5 * 60
+
+# Set while a full rebuild is queued, so a burst of network edits queues only one
+REBUILD_PENDING_KEY = 'board:rebuild-pending'
+
+
+def board_key(station_id, kind):
+    return f'board:{station_id}:{kind}'
+
+
+def pattern_key(pattern_pk):
+    return f'board:pattern:{pattern_pk}'
+
+
+class LocmemBoardStore:
+    """
+    In-process stand-in for the subset of redis-py used by the boards, for
+    development and tests. Like the locmem cache, it is not shared between processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zsets = {}
+        self._hashes = {}
+        self._sets = {}
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            members, scores = self._zsets.setdefault(name, ({}, []))
+            for member, score in mapping.items():
+                if member in members:
+                    scores.remove((members[member], member))
+                members[member] = score
+                bisect.insort(scores, (score, member))
+
+    def zrem(self, name, *values):
+        with self._lock:
+            members, scores = self._zsets.get(name, ({}, []))
+            for member in values:
+                if member in members:
+                    scores.remove((members.pop(member), member))
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        # Redis accepts '-inf' / '+inf' as bounds
+        min, max = float(min), float(max)
+        with self._lock:
+            _, scores = self._zsets.get(name, ({}, []))
+            lo = bisect.bisect_left(scores, (min,))
+            found = [member for _, member in itertools.takewhile(lambda pair: pair[0] <= max, scores[lo:])]
+        if start is not None:
+            found = found[start:start + num]
+        return found
+
+    def hset(self, name, mapping):
+        with self._lock:
+            self._hashes.setdefault(name, {}).update(mapping)
+
+    def hget(self, name, key):
+        return self._hashes.get(name, {}).get(key)
+
+    def hmget(self, name, keys):
+        values = self._hashes.get(name, {})
+        return [values.get(key) for key in keys]
+
+    def hkeys(self, name):
+        return list(self._hashes.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            for key in keys:
+                self._hashes.get(name, {}).pop(key, None)
+
+    def sadd(self, name, *values):
+        with self._lock:
+            self._sets.setdefault(name, set()).update(values)
+
+    def smembers(self, name):
+        return set(self._sets.get(name, set()))
+
+    def delete(self, *names):
+        with self._lock:
+            for name in names:
+                for store in (self._zsets, self._hashes, self._sets):
+                    store.pop(name, None)
+
+    def flush(self):
+        with self._lock:
+            self._zsets.clear()
+            self._hashes.clear()
+            self._sets.clear()
+
+
+_store = None
+
+
+def get_board_store():
+    """
+    Redis when DEPARTURE_BOARD_REDIS_URL is set, otherwise the in-process stand-in.
+    """
+    global _store
+    if _store is None:
+        url = getattr(settings, 'DEPARTURE_BOARD_REDIS_URL', '')
+        if url:
+            import redis
+            _store = redis.Redis.from_url(url, decode_responses=True)
+        else:
+            _store = LocmemBoardStore()
+    return _store
+
+
+def _timestamp(day, clock):
+    return datetime.datetime.combine(day, clock).timestamp()
+
+
+def board_entry(trip):
+    """
+    The JSON-ready entry for a trip, with both stations and the arrival time
+    resolved once at write time so kiosk reads need no joins.
+    """
+    origin = trip.route.origin if trip.route else None
+    destination = trip.route.destination if trip.route else None
+    duration = trip.duration or compute_durations([trip.departure_time], [trip.arrival_time])[0]
+    departs = _timestamp(trip.schedule_day, trip.departure_time)
+    return {
+        'trip_id': trip.trip_id,
+        'trip_type': trip.trip_type,
+        'train': trip.train.train_number if trip.train else None,
+        'origin_id': origin.station_id if origin else None,
+        'origin': origin.station_name if origin else None,
+        'destination_id': destination.station_id if destination else None,
+        'destination': destination.station_name if destination else None,
+        'departs': departs,
+        'arrives': departs + duration.total_seconds(),
+        'fare': trip.trip_cost,
+        'pattern': trip.service_pattern_id,
+    }
+
+
+def _unindex(store, trip_ids):
+    """
+    Removes trips from every board they were on, found via their stored entries.
+    """
+    trip_ids = list(trip_ids)
+    if not trip_ids:
+        return
+    for trip_id, raw in zip(trip_ids, store.hmget(TRIPS_KEY, trip_ids)):
+        if raw:
+            entry = json.loads(raw)
+            store.zrem(board_key(entry['origin_id'], 'departures'), trip_id)
+            store.zrem(board_key(entry['destination_id'], 'arrivals'), trip_id)
+    store.hdel(TRIPS_KEY, *trip_ids)
+
+
+def _index(store, trips):
+    """
+    Upserts trips onto their boards. Existing entries are overwritten in place (and only
+    moved when a trip's stations changed), so a refresh never empties a board kiosks are reading.
+    """
+    entries = {}
+    for trip in trips:
+        entry = board_entry(trip)
+        if entry['origin_id'] and entry['destination_id']:
+            entries[trip.trip_id] = entry
+    if not entries:
+        return
+
+    moved = []
+    for trip_id, raw in zip(entries, store.hmget(TRIPS_KEY, list(entries))):
+        if raw:
+            old = json.loads(raw)
+            if (old['origin_id'], old['destination_id']) != (entries[trip_id]['origin_id'], entries[trip_id]['destination_id']):
+                moved.append(trip_id)
+    _unindex(store, moved)
+
+    for trip_id, entry in entries.items():
+        store.zadd(board_key(entry['origin_id'], 'departures'), {trip_id: entry['departs']})
+        store.zadd(board_key(entry['destination_id'], 'arrivals'), {trip_id: entry['arrives']})
+        if entry['pattern']:
+            store.sadd(pattern_key(entry['pattern']), trip_id)
+    store.hset(TRIPS_KEY, mapping={trip_id: json.dumps(entry) for trip_id, entry in entries.items()})
+
+
+def index_trips(trip_ids):
+    """
+    Puts saved trips on their stations' boards, or takes them off once archived or deleted.
+    """
+    from .patterns import PATTERN_TRIP_SELECT_RELATED
+
+    trip_ids = list(trip_ids)
+    trips = list(Trip.objects.filter(pk__in=trip_ids, is_archived=False).select_related(*PATTERN_TRIP_SELECT_RELATED))
+    store = get_board_store()
+    found = {trip.trip_id for trip in trips}
+    _unindex(store, [trip_id for trip_id in trip_ids if trip_id not in found])
+    _index(store, trips)
+
+
+def remove_trips(trip_ids):
+    _unindex(get_board_store(), trip_ids)
+
+
+def _horizon():
+    hours = getattr(settings, 'DEPARTURE_BOARD_HOURS', 24)
+    now = datetime.datetime.now()
+    return now - datetime.timedelta(seconds=DEPARTED_GRACE_SECONDS), now + datetime.timedelta(hours=hours)
+
+
+def index_pattern(pattern_pk):
+    """
+    Replaces the not yet materialized departures of one service pattern, e.g. after
+    it or one of its exceptions changed (or it was deleted).
+    """
+    from .patterns import expand_patterns
+
+    store = get_board_store()
+    start, end = _horizon()
+    current = [t for t in expand_patterns(start.date(), end.date()) if t.service_pattern_id == pattern_pk]
+
+    # Materialized trips are indexed as ordinary trips; only drop virtual ones that no longer run
+    key = pattern_key(pattern_pk)
+    dropped = store.smembers(key) - {t.trip_id for t in current}
+    dropped -= set(Trip.objects.filter(pk__in=dropped).values_list('pk', flat=True))
+    _unindex(store, dropped)
+    store.delete(key)
+    _index(store, current)
+
+
+def rebuild_boards():
+    """
+    Refreshes every board from the database: station names, unarchived trips and
+    pattern departures inside DEPARTURE_BOARD_HOURS, then drops departed entries.
+    Returns the number of trips indexed.
+    """
+    from .patterns import expand_patterns, PATTERN_TRIP_SELECT_RELATED
+
+    store = get_board_store()
+    stations = dict(Station.objects.values_list('station_id', 'station_name'))
+    if stations:
+        store.hset(STATIONS_KEY, mapping=stations)
+    for station_id in set(store.hkeys(STATIONS_KEY)) - set(stations):
+        remove_station(station_id)
+
+    start, end = _horizon()
+    trips = Trip.objects.filter(
+        is_archived=False, schedule_day__range=(start.date() - datetime.timedelta(days=1), end.date())
+    ).select_related(*PATTERN_TRIP_SELECT_RELATED)
+    trips = list(trips) + list(expand_patterns(start.date(), end.date()))
+    _index(store, trips)
+    prune_boards()
+    return len(trips)
+
+
+def queue_rebuild():
+    """
+    Queues one full rebuild on a worker for a burst of network edits (call on commit).
+    """
+    from .tasks import refresh_departure_boards
+
+    if cache.add(REBUILD_PENDING_KEY, True, 60 * 60):
+        refresh_departure_boards.delay()  # type: ignore
+
+
+def index_station(station):
+    get_board_store().hset(STATIONS_KEY, mapping={station.station_id: station.station_name})
+
+
+def remove_station(station_id):
+    store = get_board_store()
+    store.hdel(STATIONS_KEY, station_id)
+    store.delete(*[board_key(station_id, kind) for kind in BOARD_KINDS])
+
+
+def station_board(station_id, kind='departures', limit=10, now=None):
+    """
+    Next departures (or arrivals) at a station, served entirely from the board store.
+    Returns None for an unknown station.
+    """
+    store = get_board_store()
+    name = store.hget(STATIONS_KEY, station_id)
+    if name is None:
+        return None
+
+    now = time.time() if now is None else now
+    trip_ids = store.zrangebyscore(board_key(station_id, kind), now - DEPARTED_GRACE_SECONDS, '+inf', start=0, num=limit)
+    entries = [json.loads(raw) for raw in store.hmget(TRIPS_KEY, trip_ids) if raw] if trip_ids else []
+    field = 'departs' if kind == 'departures' else 'arrives'
+    for entry in entries:
+        entry['time'] = datetime.datetime.fromtimestamp(entry[field]).strftime('%Y-%m-%d %H:%M')
+        entry['departed'] = entry[field] < now
+    return {'station_id': station_id, 'station': name, 'kind': kind, 'entries': entries}
+
+
+def prune_boards(before=None):
+    """
+    Drops entries that left more than the grace period ago. Returns how many trips were removed.
+    """
+    store = get_board_store()
+    cutoff = (time.time() if before is None else before) - DEPARTED_GRACE_SECONDS
+    stale = []
+    for station_id in store.hkeys(STATIONS_KEY):
+        stale += store.zrangebyscore(board_key(station_id, 'arrivals'), '-inf', cutoff)
+    _unindex(store, stale)
+    return len(stale)
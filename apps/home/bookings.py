@@ -0,0 +1,59 @@
+from django.db import transaction, IntegrityError
+from .metrics import observe_booking
+from .models import Booking_Request
+
+
+class IdempotencyConflict(Exception):
+    """
+    Raised when an idempotency key is reused with a different booking payload.
+    """
+
+
+def submit_booking(customer, idempotency_key, trip_date, trips):
+    """
+    Records a booking request and enqueues it on the booking queue.
+    Returns (booking, created). Re-submitting the same key returns the
+    original request instead of enqueueing a second purchase.
+    """
+    from .tasks import process_booking_request
+
+    trip_ids = sorted(trip.trip_id for trip in trips)
+
+    try:
+        with transaction.atomic():
+            booking, created = Booking_Request.objects.get_or_create(
+                customer=customer,
+                idempotency_key=idempotency_key,
+                defaults={'trip_date': trip_date}
+            )
+            if created:
+                booking.trips.set(trips)
+    except IntegrityError:
+        # Another request with the same key won the race; reuse its row
+        booking, created = Booking_Request.objects.get(customer=customer, idempotency_key=idempotency_key), False
+
+    if not created:
+        existing_ids = sorted(booking.trips.values_list('trip_id', flat=True))
+        if booking.trip_date != trip_date or existing_ids != trip_ids:
+            observe_booking('queued', 'conflict')
+            raise IdempotencyConflict(f"Idempotency key {idempotency_key} was already used for a different booking.")
+        observe_booking('queued', 'duplicate')
+        return booking, False
+
+    # Only hand the request to the worker once the row is visible to it
+    transaction.on_commit(lambda: process_booking_request.delay(booking.pk))  # type: ignore
+    observe_booking('queued', 'accepted')
+    return booking, True
+
+
+def booking_status(booking):
+    """
+    Serializable status payload used by the polling endpoint.
+    """
+    return {
+        'idempotency_key': booking.idempotency_key,
+        'status': booking.status,
+        'ticket_id': booking.ticket_id,
+        'total_cost': booking.ticket.total_cost if booking.ticket else None,
+        'error': booking.error or None,
+    }
@@ -0,0 +1,37 @@
+import time
+from django.core.cache import cache
+
+# Cached trip fragments live for a day; the version stamps below retire them sooner
+TRIP_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Read API responses are not versioned per trip, so they only live briefly
+READ_API_TIMEOUT = 30
+
+SCHEDULE_VERSION_KEY = 'home:schedule_version'
+
+
+def get_schedule_version():
+    """
+    Returns the network-wide version stamp used in trip fragment cache keys.
+    Station, route and train edits bump it, since trip cards render their names.
+    """
+    version = cache.get(SCHEDULE_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(SCHEDULE_VERSION_KEY, version, None)
+    return version
+
+
+async def aget_schedule_version():
+    """
+    get_schedule_version() for async views.
+    """
+    version = await cache.aget(SCHEDULE_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        await cache.aadd(SCHEDULE_VERSION_KEY, version, None)
+    return version
+
+
+def bump_schedule_version():
+    cache.set(SCHEDULE_VERSION_KEY, int(time.time() * 1000), None)
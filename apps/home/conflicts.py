@@ -0,0 +1,215 @@
+import bisect
+import datetime
+from collections import defaultdict, namedtuple
+from django.conf import settings
+from .models import Trip, compute_durations
+
+# One scheduled movement of a train
+TrainInterval = namedtuple('TrainInterval', 'trip_id train_id start end origin_id destination_id')
+
+# kind is one of 'overlap', 'turnaround' or 'discontinuity'
+Conflict = namedtuple('Conflict', 'kind train_id first second detail')
+
+# Days of a service pattern's timetable checked when it is validated
+PATTERN_CHECK_DAYS = 365
+
+
+def min_turnaround():
+    return datetime.timedelta(minutes=getattr(settings, 'TRAIN_MIN_TURNAROUND_MINUTES', 10))
+
+
+def make_interval(trip_id, train_id, day, departure, duration, origin_id, destination_id):
+    start = datetime.datetime.combine(day, departure)
+    return TrainInterval(trip_id, train_id, start, start + (duration or datetime.timedelta(0)), origin_id, destination_id)
+
+
+def intervals_from_queryset(trips):
+    """
+    Builds intervals straight from a Trip queryset with a single flat query
+    (no model instances, no per-row route lookups).
+    """
+    rows = trips.exclude(train__isnull=True).values_list(
+        'trip_id', 'train_id', 'schedule_day', 'departure_time', 'arrival_time',
+        'route__local_route_info__l_route_origin_id', 'route__intertown_route_info__i_route_origin_id',
+        'route__local_route_info__l_route_desti_id', 'route__intertown_route_info__i_route_desti_id',
+    ).order_by()
+    rows = list(rows)
+    durations = compute_durations([r[3] for r in rows], [r[4] for r in rows])
+    return [
+        make_interval(r[0], r[1], r[2], r[3], duration, r[5] or r[6], r[7] or r[8])
+        for r, duration in zip(rows, durations)
+    ]
+
+
+def interval_for_trip(trip):
+    """
+    Interval for a single (possibly unsaved) Trip instance.
+    """
+    duration = trip.duration or compute_durations([trip.departure_time], [trip.arrival_time])[0]
+    origin = trip.route.origin if trip.route else None
+    destination = trip.route.destination if trip.route else None
+    return make_interval(
+        trip.trip_id, trip.train_id, trip.schedule_day, trip.departure_time, duration,
+        origin.station_id if origin else None, destination.station_id if destination else None
+    )
+
+
+def _compare(prev, nxt, turnaround):
+    """
+    Checks a trip against the one the same train ran just before it.
+    """
+    if nxt.start < prev.end:
+        return Conflict('overlap', nxt.train_id, prev.trip_id, nxt.trip_id,
+                        f"departs {nxt.start:%Y-%m-%d %H:%M} before {prev.trip_id} arrives at {prev.end:%H:%M}")
+    if nxt.start - prev.end < turnaround:
+        return Conflict('turnaround', nxt.train_id, prev.trip_id, nxt.trip_id,
+                        f"only {int((nxt.start - prev.end).total_seconds() // 60)} min after {prev.trip_id} arrives")
+    if prev.destination_id and nxt.origin_id and prev.destination_id != nxt.origin_id:
+        return Conflict('discontinuity', nxt.train_id, prev.trip_id, nxt.trip_id,
+                        f"departs station {nxt.origin_id} but {prev.trip_id} left the train at {prev.destination_id}")
+    return None
+
+
+def detect_conflicts(intervals):
+    """
+    Sweeps every train's intervals in start order and reports overlaps, impossible
+    turnarounds and location jumps. O(n log n) overall: one sort per train, then a
+    linear sweep that compares each trip with the latest-ending trip before it.
+    """
+    turnaround = min_turnaround()
+    by_train = defaultdict(list)
+    for interval in intervals:
+        if interval.train_id:
+            by_train[interval.train_id].append(interval)
+
+    conflicts = []
+    for train_intervals in by_train.values():
+        train_intervals.sort(key=lambda i: (i.start, i.end))
+        latest = None
+        for interval in train_intervals:
+            if latest is not None:
+                conflict = _compare(latest, interval, turnaround)
+                if conflict:
+                    conflicts.append(conflict)
+            if latest is None or interval.end >= latest.end:
+                latest = interval
+    return conflicts
+
+
+class TrainTimeline:
+    """
+    Interval index for one train: intervals sorted by start with a bisect lookup,
+    used to check a single new trip against its neighbours without a full sweep.
+    """
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda i: (i.start, i.end))
+        self.starts = [i.start for i in self.intervals]
+
+    def conflicts_for(self, candidate):
+        turnaround = min_turnaround()
+        conflicts = []
+        pos = bisect.bisect_left(self.starts, candidate.start)
+
+        # Earlier trips still running (or too close) when the candidate departs;
+        # location continuity only applies to the immediately preceding trip
+        immediate = True
+        for prev in reversed(self.intervals[:pos]):
+            if prev.trip_id == candidate.trip_id:
+                continue
+            conflict = _compare(prev, candidate, turnaround)
+            if conflict and (immediate or conflict.kind != 'discontinuity'):
+                conflicts.append(conflict)
+            immediate = False
+            if prev.end + turnaround <= candidate.start:
+                break
+
+        # Later trips that start before the candidate is back, plus its immediate successor
+        for nxt in self.intervals[pos:]:
+            if nxt.trip_id == candidate.trip_id:
+                continue
+            conflict = _compare(candidate, nxt, turnaround)
+            if conflict:
+                conflicts.append(conflict)
+            if nxt.start >= candidate.end:
+                break
+        return conflicts
+
+
+def _pattern_leg(pattern):
+    """
+    (duration, origin_id, destination_id), shared by every departure of a pattern.
+    """
+    duration = compute_durations([pattern.departure_time], [pattern.arrival_time])[0]
+    origin = pattern.route.origin if pattern.route_id else None
+    destination = pattern.route.destination if pattern.route_id else None
+    return duration, origin.station_id if origin else None, destination.station_id if destination else None
+
+
+def pattern_intervals(start, end, train_ids, exclude_pattern=None):
+    """
+    Intervals for the not yet materialized service pattern departures of the given
+    trains between start and end (inclusive), without building Trip instances.
+    """
+    from .patterns import pattern_departures
+    legs = {}
+    intervals = []
+    for pattern, day in pattern_departures(start, end, train_ids=train_ids):
+        if pattern.pk == exclude_pattern:
+            continue
+        if pattern.pk not in legs:
+            legs[pattern.pk] = _pattern_leg(pattern)
+        intervals.append(make_interval(pattern.trip_id_for(day), pattern.train_id, day, pattern.departure_time, *legs[pattern.pk]))
+    return intervals
+
+
+def conflicts_for_trip(trip):
+    """
+    Conflicts between one trip and the rest of its train's schedule (the day
+    before through the day after, which covers overnight trips), including the
+    train's pattern departures.
+    """
+    if not trip.train_id or not trip.schedule_day or not trip.departure_time or not trip.arrival_time:
+        return []
+    window = (trip.schedule_day - datetime.timedelta(days=1), trip.schedule_day + datetime.timedelta(days=1))
+    neighbours = Trip.objects.filter(train_id=trip.train_id, schedule_day__range=window).exclude(pk=trip.pk)
+    timeline = TrainTimeline(intervals_from_queryset(neighbours) + pattern_intervals(*window, [trip.train_id]))
+    return timeline.conflicts_for(interval_for_trip(trip))
+
+
+def conflicts_for_pattern(pattern, start=None):
+    """
+    Conflicts between a (possibly unsaved) service pattern's departures over
+    PATTERN_CHECK_DAYS from start (default: today, or valid_from if later) and
+    the rest of its train's schedule: trips and the train's other patterns.
+    """
+    from .patterns import _daterange
+    if not pattern.train_id or not pattern.departure_time or not pattern.arrival_time or not pattern.valid_from:
+        return []
+    start = max(start or datetime.date.today(), pattern.valid_from)
+    end = start + datetime.timedelta(days=PATTERN_CHECK_DAYS)
+    if pattern.valid_until:
+        end = min(end, pattern.valid_until)
+    if end < start:
+        return []
+
+    exceptions = {}
+    if pattern.pk:
+        exceptions = dict(pattern.exceptions.filter(date__range=(start, end)).values_list('date', 'exception_type'))
+    leg = _pattern_leg(pattern)
+    departures = [
+        make_interval(
+            pattern.trip_id_for(day) if pattern.pk else f"{day:%Y%m%d}P(new)", pattern.train_id, day, pattern.departure_time, *leg
+        )
+        for day in _daterange(start, end) if pattern.runs_on(day, exceptions.get(day))
+    ]
+    if not departures:
+        return []
+
+    window = (start - datetime.timedelta(days=1), end + datetime.timedelta(days=1))
+    trips = Trip.objects.filter(train_id=pattern.train_id, schedule_day__range=window)
+    if pattern.pk:
+        # Its own materialized departures are already in the list above
+        trips = trips.exclude(service_pattern=pattern)
+    intervals = intervals_from_queryset(trips) + pattern_intervals(*window, [pattern.train_id], exclude_pattern=pattern.pk)
+    own = {d.trip_id for d in departures}
+    return [c for c in detect_conflicts(intervals + departures) if c.first in own or c.second in own]
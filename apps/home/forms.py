@@ -1,7 +1,31 @@
 from django import forms
-from .models import Ticket, Customer
+from django.core.files.uploadedfile import UploadedFile
+from .models import Ticket, Customer, Station, Trip
+from .search import TripQuery
+from .patterns import pattern_departure
+from .images import validate_avatar_upload, attach_profile_picture
 from django.contrib.auth.models import User
 
+class TripIdsField(forms.ModelMultipleChoiceField):
+    """
+    Trips by ID, including pattern departures inside the booking horizon that
+    have no Trip row yet. Cleans to the list of IDs without creating anything;
+    the purchase materializes them in its own transaction (materialize_trips).
+    """
+    def clean(self, value):
+        if not value:
+            if self.required:
+                raise forms.ValidationError(self.error_messages['required'], code='required')
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise forms.ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+        trip_ids = list(dict.fromkeys(str(v) for v in value))
+        existing = set(self.queryset.filter(pk__in=trip_ids).values_list('pk', flat=True))
+        for trip_id in trip_ids:
+            if trip_id not in existing and not pattern_departure(trip_id):
+                raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': trip_id})
+        return trip_ids
+
 class TicketForm(forms.ModelForm):
     class Meta:
         model = Ticket
@@ -11,6 +35,37 @@ class TicketForm(forms.ModelForm):
             'trip_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'trips': forms.CheckboxSelectMultiple(),
         }
+        field_classes = {
+            'trips': TripIdsField,
+        }
+
+class TripSearchForm(forms.Form):
+    """
+    GET form for the schedule and ticket pages: one travel date, optionally
+    narrowed by stations, a departure time window and trip type.
+    """
+    origin = forms.ModelChoiceField(queryset=Station.objects.order_by('station_name'), to_field_name='station_id', required=False, empty_label='Any station', widget=forms.Select(attrs={'class': 'form-select'}))
+    destination = forms.ModelChoiceField(queryset=Station.objects.order_by('station_name'), to_field_name='station_id', required=False, empty_label='Any station', widget=forms.Select(attrs={'class': 'form-select'}))
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    after = forms.TimeField(required=False, label='Departing after', widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}))
+    before = forms.TimeField(required=False, label='Departing before', widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}))
+    trip_type = forms.ChoiceField(choices=[('', 'Any')] + Trip.TRIP_TYPES, required=False, widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        after, before = cleaned_data.get('after'), cleaned_data.get('before')
+        if after and before and after > before:
+            raise forms.ValidationError("The departure window must end after it starts.")
+        return cleaned_data
+
+    def query(self):
+        data = self.cleaned_data
+        return TripQuery(
+            origin=data['origin'].station_id if data['origin'] else None,
+            destination=data['destination'].station_id if data['destination'] else None,
+            date=data['date'], until=data['date'], after=data['after'], before=data['before'],
+            trip_type=data['trip_type'] or None,
+        )
 
 class SignUpForm(forms.Form):
     """
@@ -22,8 +77,8 @@ class SignUpForm(forms.Form):
     birth_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
     gender = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Gender'}))
     
-    # NEW: Accept an uploaded file
-    profile_picture = forms.ImageField(required=False, widget=forms.FileInput(attrs={'class': 'form-control'}))
+    # NEW: Accept an uploaded file (decoded later by the process_profile_picture task)
+    profile_picture = forms.FileField(required=False, validators=[validate_avatar_upload], widget=forms.FileInput(attrs={'class': 'form-control', 'accept': 'image/*'}))
     
     password = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control', 'placeholder': 'Password'}))
     
@@ -68,14 +123,22 @@ class SignUpForm(forms.Form):
             middle_initial=data.get('middle_initial'),
             birth_date=data['birth_date'],
             gender=data['gender'],
-            profile_picture=data.get('profile_picture') # Save the picture
         )
+
+        if data.get('profile_picture'):
+            attach_profile_picture(customer, data['profile_picture']) # Save the picture
         return customer
 
 class ProfileUpdateForm(forms.ModelForm):
+    # Plain FileField: skips decoding the image inside the request
+    profile_picture = forms.FileField(required=False, validators=[validate_avatar_upload], widget=forms.FileInput(attrs={'class': 'form-control form-control-sm', 'accept': 'image/*'}))
+
     class Meta:
         model = Customer
         fields = ['profile_picture']
-        widgets = {
-            'profile_picture': forms.FileInput(attrs={'class': 'form-control form-control-sm'})
-        }
\ No newline at end of file
+
+    def save(self, commit=True):
+        upload = self.cleaned_data.get('profile_picture')
+        if isinstance(upload, UploadedFile):
+            return attach_profile_picture(self.instance, upload)
+        return self.instance
\ No newline at end of file
@@ -0,0 +1,80 @@
+import datetime
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Ticket, Trip
+from .search import with_station_names
+
+TICKETS_PER_PAGE = 20
+
+# Trip columns the ticket history page and the ticket API render
+TICKET_TRIP_FIELDS = (
+    'trip_id', 'route', 'trip_type', 'schedule_day', 'departure_time', 'arrival_time', 'duration', 'trip_cost',
+    'train__train_number',
+)
+
+HISTORY_VIEWS = ('upcoming', 'past')
+
+
+def customer_tickets(customer, query='', when=None, today=None):
+    """
+    A customer's tickets, optionally filtered by ticket ID or origin station name.
+    when='upcoming' keeps trip dates from today on, soonest first; when='past'
+    keeps earlier ones, latest first. Both read ticket_customer_trip_date_idx.
+    """
+    if customer is None:
+        return Ticket.objects.none()
+
+    today = today or datetime.date.today()
+    tickets = Ticket.objects.filter(customer=customer)
+    if when == 'upcoming':
+        tickets = tickets.filter(trip_date__gte=today).order_by('trip_date', 'ticket_id')
+    elif when == 'past':
+        tickets = tickets.filter(trip_date__lt=today).order_by('-trip_date', '-ticket_id')
+    else:
+        tickets = tickets.order_by('-purchase_date', '-ticket_id')
+
+    if query:
+        tickets = tickets.filter(
+            Q(ticket_id__icontains=query) |
+            Q(trips__route__local_route_info__l_route_origin__l_station_id__station_name__icontains=query) |
+            Q(trips__route__intertown_route_info__i_route_origin__i_station_id__station_name__icontains=query)
+        ).distinct()
+    return tickets
+
+
+def with_trips(tickets):
+    """
+    Prefetches each ticket's trips: only TICKET_TRIP_FIELDS, the train number and
+    the station names, in one query for whichever tickets are evaluated.
+    """
+    trips = with_station_names(Trip.objects.only(*TICKET_TRIP_FIELDS))
+    return tickets.prefetch_related(Prefetch('trips', queryset=trips))
+
+
+def ticket_page(tickets, number, per_page=TICKETS_PER_PAGE):
+    """
+    One page of tickets with their trips: a count, the page and its trips, so a
+    page costs the same three queries however long the history is.
+    """
+    page = Paginator(with_trips(tickets), per_page).get_page(number)
+    page.object_list = list(page.object_list)
+    return page
+
+
+def ticket_stats(customer, today=None):
+    """
+    History counters in one aggregate query: tickets bought, how many are still
+    to travel, and the total spent on tickets that were not cancelled.
+    """
+    if customer is None:
+        return {'tickets': 0, 'upcoming': 0, 'past': 0, 'spend': 0}
+
+    today = today or datetime.date.today()
+    stats = Ticket.objects.filter(customer=customer).aggregate(
+        tickets=Count('pk'),
+        upcoming=Count('pk', filter=Q(trip_date__gte=today)),
+        spend=Coalesce(Sum('total_cost', filter=Q(cancelled_at__isnull=True)), Value(0)),
+    )
+    stats['past'] = stats['tickets'] - stats['upcoming']
+    return stats
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+# Thumbnail variants generated for every profile picture (longest edge in px)
+AVATAR_SIZES = {
+    'small': 48,
+    'medium': 128,
+    'large': 256,
+}
+
+ALLOWED_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+ORIGINALS_DIR = 'avatars/originals'
+
+
+def max_upload_size():
+    return getattr(settings, 'AVATAR_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+
+
+def validate_avatar_upload(uploaded_file):
+    """
+    Cheap request-time checks only (extension and size), run by the forms'
+    field validation so a bad upload is a form error, never a failed save.
+    The size is counted over the streamed chunks rather than taken from the
+    reported size. Decoding happens later in the process_profile_picture task.
+    """
+    ext = os.path.splitext(uploaded_file.name)[1].lower().lstrip('.')
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValidationError(f"Unsupported image type '.{ext}'. Allowed: {', '.join(ALLOWED_EXTENSIONS)}.")
+    size = 0
+    for chunk in uploaded_file.chunks():
+        size += len(chunk)
+        if size > max_upload_size():
+            raise ValidationError(f"Image is too large (max {max_upload_size() // (1024 * 1024)} MB).")
+
+
+def store_upload(uploaded_file):
+    """
+    Streams a validated upload (validate_avatar_upload) to disk chunk by chunk
+    while hashing it, then stores it under its SHA-256 so identical uploads
+    share one file. Returns the storage name of the original.
+    """
+    ext = os.path.splitext(uploaded_file.name)[1].lower().lstrip('.')
+    if ext == 'jpeg':
+        ext = 'jpg'
+
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            tmp.write(chunk)
+
+    content_hash = digest.hexdigest()
+    name = f"{ORIGINALS_DIR}/{content_hash[:2]}/{content_hash}.{ext}"
+    try:
+        # Already stored by an earlier (or another customer's) upload
+        if not default_storage.exists(name):
+            with open(tmp.name, 'rb') as fh:
+                saved = default_storage.save(name, File(fh))
+            if saved != name:
+                # A concurrent identical upload stored it between the check and the save, and the
+                # storage renamed this copy; the contents match, so keep the content-addressed name
+                default_storage.delete(saved)
+    finally:
+        os.unlink(tmp.name)
+    return name
+
+
+def content_hash_of(name):
+    """
+    Returns the content hash encoded in a stored original's name.
+    """
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def variant_name(name, size):
+    content_hash = content_hash_of(name)
+    return f"avatars/{size}/{content_hash[:2]}/{content_hash}.jpg"
+
+
+def generate_thumbnails(name):
+    """
+    Decodes a stored original, drops its EXIF data (after applying the
+    orientation tag) and writes one JPEG per AVATAR_SIZES entry.
+    Variants that already exist are skipped, so re-uploads are free.
+    """
+    from PIL import Image, ImageOps
+
+    pending = {size: variant_name(name, size) for size in AVATAR_SIZES}
+    pending = {size: path for size, path in pending.items() if not default_storage.exists(path)}
+    if not pending:
+        return []
+
+    with default_storage.open(name, 'rb') as fh:
+        with Image.open(fh) as img:
+            img = ImageOps.exif_transpose(img)
+            # Re-encoding from raw pixels leaves EXIF/GPS metadata behind
+            img = img.convert('RGB')
+
+            written = []
+            for size, path in pending.items():
+                edge = AVATAR_SIZES[size]
+                thumb = ImageOps.fit(img, (edge, edge), Image.LANCZOS)
+                with tempfile.TemporaryFile() as out:
+                    thumb.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+                    out.seek(0)
+                    written.append(default_storage.save(path, File(out)))
+    return written
+
+
+def attach_profile_picture(customer, uploaded_file):
+    """
+    Stores an upload as the customer's profile picture and queues thumbnail generation.
+    """
+    from django.db import transaction
+    from .tasks import process_profile_picture
+
+    customer.profile_picture = store_upload(uploaded_file)
+    customer.profile_picture_ready = False
+    customer.save()
+    transaction.on_commit(lambda: process_profile_picture.delay(customer.customer_id))  # type: ignore
+    return customer
+
+
+def avatar_url(customer, size='medium'):
+    """
+    URL of the requested thumbnail, or the original while the
+    thumbnails are still being generated.
+    """
+    if not customer or not customer.profile_picture:
+        return None
+    if customer.profile_picture_ready and size in AVATAR_SIZES:
+        return default_storage.url(variant_name(customer.profile_picture.name, size))
+    return customer.profile_picture.url
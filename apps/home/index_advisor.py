@@ -0,0 +1,295 @@
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test.runner import DiscoverRunner
+
+# Only statements EXPLAIN can plan are recorded (no DDL from migrations or test setup)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+# A plan step worth fixing: kind is 'seq_scan' or 'sort'
+Finding = namedtuple('Finding', 'kind table rows shape detail')
+
+# model is the model class; fields may carry a '-' prefix for descending order
+Suggestion = namedtuple('Suggestion', 'model fields condition')
+
+COLUMN = r'"(\w+)"\."(\w+)"'
+EQUALITY = re.compile(COLUMN + r' (?:= %s|IN \(%s)')
+RANGE = re.compile(COLUMN + r' (?:[<>]=? %s|BETWEEN %s)')
+BOOLEAN = re.compile(r'(NOT )?' + COLUMN + r'(?= AND | OR |\)|$)')
+ORDER = re.compile(COLUMN + r' (ASC|DESC)')
+
+
+class WorkloadRecorder:
+    """
+    connection.execute_wrapper hook that groups executed SQL by shape. Django sends
+    SQL with %s placeholders, so the statement text is the shape; one sample of
+    parameters is kept for EXPLAIN.
+    """
+    def __init__(self):
+        self.shapes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not many and sql.lstrip().upper().startswith(EXPLAINABLE):
+                shape = self.shapes.get(sql)
+                if shape is None:
+                    shape = self.shapes[sql] = {'sql': sql, 'params': list(params or ()), 'count': 0, 'time': 0.0}
+                shape['count'] += 1
+                shape['time'] += time.perf_counter() - started_at
+
+
+@contextmanager
+def record_workload(using='default'):
+    """
+    Records every query run inside the block, e.g. around a test run or a benchmark.
+    """
+    recorder = WorkloadRecorder()
+    with connections[using].execute_wrapper(recorder):
+        yield recorder
+
+
+class AnalysingTestRunner(DiscoverRunner):
+    """
+    Test runner used by `advise_indexes --run test`: the recorded queries ran on the
+    test databases, so before_teardown() analyses them there, before they are destroyed.
+    """
+    before_teardown = None
+
+    def teardown_databases(self, old_config, **kwargs):
+        try:
+            if AnalysingTestRunner.before_teardown is not None:
+                AnalysingTestRunner.before_teardown()
+        finally:
+            super().teardown_databases(old_config, **kwargs)
+
+
+def save_workload(shapes, path):
+    with open(path, 'w') as f:
+        for shape in shapes:
+            f.write(json.dumps(shape, cls=DjangoJSONEncoder) + '\n')
+
+
+def load_workload(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def table_rows(connection, table):
+    """
+    Planner row estimate on PostgreSQL (no table scan); an exact count elsewhere.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+        row = cursor.fetchone()
+    return max(int(row[0]), 0) if row and row[0] is not None else 0
+
+
+def explain(connection, sql, params):
+    """
+    Returns (kind, table, detail) tuples for the sequential scans and explicit sorts
+    in a statement's plan. Sort steps carry no table; the caller attributes them.
+    """
+    steps = []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            nodes = [plan[0]['Plan']]
+            while nodes:
+                node = nodes.pop()
+                if node['Node Type'] == 'Seq Scan':
+                    steps.append(('seq_scan', node['Relation Name'], node.get('Filter', '')))
+                elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                    steps.append(('sort', None, ', '.join(node.get('Sort Key', []))))
+                nodes.extend(node.get('Plans', []))
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                scan = re.match(r'SCAN (?:TABLE )?(\w+)(.*)', detail)
+                if scan and 'USING' not in scan.group(2):
+                    steps.append(('seq_scan', scan.group(1), detail))
+                elif 'TEMP B-TREE FOR ORDER BY' in detail:
+                    steps.append(('sort', None, detail))
+    return steps
+
+
+def _where_and_order(sql):
+    where = sql.split(' WHERE ', 1)[1] if ' WHERE ' in sql else ''
+    where, _, order = where.partition(' ORDER BY ')
+    if not where:
+        order = sql.split(' ORDER BY ', 1)[1] if ' ORDER BY ' in sql else ''
+    return where.split(' GROUP BY ')[0], order.split(' LIMIT ')[0]
+
+
+def suggest_columns(sql, table):
+    """
+    Index columns for one table from a statement's predicates: equality columns
+    first, then at most one range column, then ORDER BY columns when they can still
+    be read in index order. Plain boolean filters become the partial index condition.
+    Returns (columns, condition) where columns are (column, descending) pairs.
+    """
+    where, order = _where_and_order(sql)
+    equality = [col for tbl, col in EQUALITY.findall(where) if tbl == table]
+    ranges = [col for tbl, col in RANGE.findall(where) if tbl == table and col not in equality]
+    booleans = {col: not negated for negated, tbl, col in BOOLEAN.findall(where) if tbl == table}
+    ordering = [(col, direction == 'DESC') for tbl, col, direction in ORDER.findall(order) if tbl == table]
+
+    columns = [(col, False) for col in dict.fromkeys(equality)]
+    if ranges:
+        columns.append((ranges[0], False))
+        # Past a range column the index is only ordered if the sort starts with that column
+        if ordering and ordering[0][0] == ranges[0]:
+            columns += [o for o in ordering[1:] if o[0] not in dict(columns)]
+    else:
+        columns += [o for o in ordering if o[0] not in dict(columns)]
+    return columns, booleans
+
+
+def _model_for_table(table):
+    for model in apps.get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def _field_name(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column:
+            return field.name
+    return None
+
+
+def _existing_indexes(connection, table):
+    """
+    Column tuples of the table's current indexes, and the columns that are unique on their own.
+    """
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    indexed = [c for c in constraints.values() if c['columns'] and (c['index'] or c['unique'] or c['primary_key'])]
+    unique = {c['columns'][0] for c in indexed if len(c['columns']) == 1 and (c['unique'] or c['primary_key'])}
+    return [tuple(c['columns']) for c in indexed], unique
+
+
+def analyse(shapes, using='default', min_rows=10000):
+    """
+    EXPLAINs every recorded shape against the database and returns (findings,
+    suggestions): sequential scans and sorts on model tables of at least min_rows
+    rows, plus the deduplicated indexes that would serve them.
+    """
+    connection = connections[using]
+    row_counts = {}
+    existing = {}
+    findings = []
+    suggestions = {}
+
+    def rows_in(table):
+        if table not in row_counts:
+            row_counts[table] = table_rows(connection, table)
+        return row_counts[table]
+
+    for shape in shapes:
+        sql = shape['sql']
+        try:
+            steps = explain(connection, sql, shape['params'])
+        except Exception:
+            # Shapes whose sample parameters no longer apply (e.g. a dropped table)
+            continue
+
+        flagged = set()
+        for kind, table, detail in steps:
+            tables = [table] if table else list(dict.fromkeys(tbl for tbl, _, _ in ORDER.findall(_where_and_order(sql)[1])))
+            for tbl in tables:
+                if _model_for_table(tbl) is not None and rows_in(tbl) >= min_rows:
+                    findings.append(Finding(kind, tbl, row_counts[tbl], shape, detail))
+                    flagged.add(tbl)
+
+        for table in flagged:
+            model = _model_for_table(table)
+            columns, booleans = suggest_columns(sql, table)
+            if table not in existing:
+                existing[table] = _existing_indexes(connection, table)
+            indexes, unique = existing[table]
+
+            names = tuple(col for col, _ in columns)
+            where = _where_and_order(sql)[0]
+            filtered = any(tbl == table for tbl, _ in EQUALITY.findall(where) + RANGE.findall(where))
+            if not columns or set(names) & unique:
+                # Nothing to index on, or already a primary key / unique lookup
+                continue
+            if not filtered and ' LIMIT ' not in sql:
+                # Sorting a whole unfiltered table: an index only pays off with a LIMIT
+                continue
+            if not booleans and any(index[:len(names)] == names for index in indexes):
+                continue
+
+            fields = tuple(('-' if desc else '') + _field_name(model, col) for col, desc in columns)
+            condition = tuple(sorted((_field_name(model, col), value) for col, value in booleans.items()))
+            suggestions[(model, fields, condition)] = Suggestion(model, list(fields), condition)
+
+    # Drop suggestions already covered by a wider index on the same leading fields,
+    # either with the same partial condition or with none (a full index serves both)
+    kept = []
+    for (model, fields, condition), suggestion in suggestions.items():
+        covered = any(
+            m is model and (m, f, c) != (model, fields, condition) and f[:len(fields)] == fields and (c == condition or not c)
+            and (len(f) > len(fields) or not c)
+            for m, f, c in suggestions
+        )
+        if not covered:
+            kept.append(suggestion)
+    return findings, kept
+
+
+def build_index(suggestion):
+    model = suggestion.model
+    digest = hashlib.md5(repr((suggestion.fields, suggestion.condition)).encode()).hexdigest()[:6]
+    name = '_'.join([model._meta.model_name] + [f.lstrip('-')[:8] for f in suggestion.fields])[:19].rstrip('_')
+    condition = models.Q(**dict(suggestion.condition)) if suggestion.condition else None
+    return models.Index(fields=suggestion.fields, name=f'{name}_{digest}_idx', condition=condition)
+
+
+def write_migration(suggestions, app_label='home', concurrently=False):
+    """
+    Writes an AddIndex migration for the suggestions on app_label's models and returns
+    its path. With concurrently=True (PostgreSQL) the indexes are built without locking writes.
+    """
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaves = loader.graph.leaf_nodes(app_label)
+    number = max(int(name.split('_', 1)[0]) for _, name in leaves) + 1 if leaves else 1
+
+    if concurrently:
+        from django.contrib.postgres.operations import AddIndexConcurrently as add_index
+    else:
+        add_index = migrations.AddIndex
+
+    migration = migrations.Migration(f'{number:04d}_advised_indexes', app_label)
+    migration.dependencies = leaves
+    migration.operations = [
+        add_index(model_name=s.model._meta.model_name, index=build_index(s))
+        for s in suggestions if s.model._meta.app_label == app_label
+    ]
+
+    writer = MigrationWriter(migration)
+    source = writer.as_string()
+    if concurrently:
+        # CREATE INDEX CONCURRENTLY cannot run in a transaction; the writer has no option for this
+        source = source.replace('class Migration(migrations.Migration):\n', 'class Migration(migrations.Migration):\n\n    atomic = False\n', 1)
+    with open(writer.path, 'w') as f:
+        f.write(source)
+    return writer.path
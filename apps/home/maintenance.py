@@ -0,0 +1,156 @@
+import datetime
+from collections import defaultdict
+from django.db import transaction
+from .models import Trip, Log_Task, Maintenance_Due
+from .conflicts import intervals_from_queryset, interval_for_trip
+from .patterns import expand_patterns
+
+
+def _due_date(last_performed, task):
+    if task.interval_days is None or last_performed is None:
+        return None
+    return last_performed + datetime.timedelta(days=task.interval_days)
+
+
+def record_task_performed(log, task):
+    """
+    Incremental update for one new Log_Task: only moves the (train, task)
+    entry forward, so it never needs to look at older logs.
+    """
+    if not log.train_id:
+        return
+    entry = Maintenance_Due.objects.filter(train_id=log.train_id, task=task).first()
+    if entry is None:
+        Maintenance_Due.objects.create(
+            train_id=log.train_id, task=task, last_performed=log.date,
+            last_log=log, due_date=_due_date(log.date, task)
+        )
+    elif log.date >= entry.last_performed:
+        entry.last_performed = log.date
+        entry.last_log = log
+        entry.due_date = _due_date(log.date, task)
+        entry.save(update_fields=['last_performed', 'last_log', 'due_date'])
+
+
+def refresh_due_entry(train_id, task_id):
+    """
+    Recomputes one (train, task) entry from its log history, e.g. after a log entry
+    was removed. Uses the (log, task) unique index plus the log's date.
+    """
+    latest = Log_Task.objects.filter(log__train_id=train_id, task_id=task_id).select_related('log', 'task').order_by('-log__date', '-log__log_id').first()
+    if latest is None:
+        Maintenance_Due.objects.filter(train_id=train_id, task_id=task_id).delete()
+        return
+    Maintenance_Due.objects.update_or_create(
+        train_id=train_id, task_id=task_id,
+        defaults={
+            'last_performed': latest.log.date,
+            'last_log': latest.log,
+            'due_date': _due_date(latest.log.date, latest.task),
+        }
+    )
+
+
+def refresh_log_entries(log):
+    """
+    Re-derives every entry a log contributes to, including entries of the train
+    it was previously attached to.
+    """
+    pairs = set(Maintenance_Due.objects.filter(last_log=log).values_list('train_id', 'task_id'))
+    if log.train_id:
+        pairs |= {(log.train_id, task_id) for task_id in log.log_tasks.values_list('task_id', flat=True)}
+    for train_id, task_id in pairs:
+        refresh_due_entry(train_id, task_id)
+
+
+def recompute_due_dates(task):
+    """
+    Applies a changed interval to every train's entry for the task.
+    """
+    entries = list(Maintenance_Due.objects.filter(task=task))
+    for entry in entries:
+        entry.due_date = _due_date(entry.last_performed, task)
+    Maintenance_Due.objects.bulk_update(entries, ['due_date'], batch_size=1000)
+
+
+def rebuild_index():
+    """
+    Full rebuild from Log_Task in a single streamed pass. Returns the number of entries.
+    """
+    from .models import Task
+
+    intervals = dict(Task.objects.values_list('task_name', 'interval_days'))
+
+    # Ordered oldest first, so the last row seen for each pair is its latest run
+    latest = {}
+    rows = Log_Task.objects.filter(log__train__isnull=False).values_list(
+        'log__train_id', 'task_id', 'log__date', 'log_id'
+    ).order_by('log__date', 'log_id')
+    for train_id, task_id, log_date, log_id in rows.iterator(chunk_size=5000):
+        latest[(train_id, task_id)] = (log_date, log_id)
+
+    entries = []
+    for (train_id, task_id), (log_date, log_id) in latest.items():
+        interval = intervals.get(task_id)
+        entries.append(Maintenance_Due(
+            train_id=train_id, task_id=task_id, last_performed=log_date, last_log_id=log_id,
+            due_date=log_date + datetime.timedelta(days=interval) if interval is not None else None,
+        ))
+
+    with transaction.atomic():
+        Maintenance_Due.objects.all().delete()
+        Maintenance_Due.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def due_by(end):
+    """
+    Everything due (or overdue) on or before the given date, served by the due_date index.
+    """
+    return Maintenance_Due.objects.filter(due_date__lte=end).select_related('train', 'task', 'last_log').order_by('due_date', 'train_id')
+
+
+def fleet_maintenance_windows(train_ids, start, end, min_hours=4):
+    """
+    Gaps of at least min_hours between each train's scheduled trips from start to
+    end (dates, inclusive), as {train_id: [(window_start, window_end) datetimes]}.
+    One trip query and one pattern expansion cover every train.
+    """
+    train_ids = set(train_ids)
+    range_start = datetime.datetime.combine(start, datetime.time.min)
+    range_end = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)
+    min_gap = datetime.timedelta(hours=min_hours)
+
+    # Concrete trips plus service pattern departures the trains are rostered on
+    window = (start - datetime.timedelta(days=1), end)
+    busy = defaultdict(list)
+    for interval in intervals_from_queryset(Trip.objects.filter(train_id__in=train_ids, schedule_day__range=window)):
+        busy[interval.train_id].append((interval.start, interval.end))
+    for trip in expand_patterns(*window):
+        if trip.train_id in train_ids:
+            interval = interval_for_trip(trip)
+            busy[trip.train_id].append((interval.start, interval.end))
+
+    fleet = {}
+    for train_id in train_ids:
+        windows = []
+        cursor = range_start
+        for trip_start, trip_end in sorted(busy[train_id]):
+            if trip_end <= cursor:
+                continue
+            if trip_start - cursor >= min_gap:
+                windows.append((cursor, min(trip_start, range_end)))
+            cursor = max(cursor, trip_end)
+            if cursor >= range_end:
+                break
+        if range_end - cursor >= min_gap:
+            windows.append((cursor, range_end))
+        fleet[train_id] = windows
+    return fleet
+
+
+def maintenance_windows(train_id, start, end, min_hours=4):
+    """
+    fleet_maintenance_windows() for a single train.
+    """
+    return fleet_maintenance_windows([train_id], start, end, min_hours)[train_id]
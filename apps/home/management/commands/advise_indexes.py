@@ -0,0 +1,89 @@
+import shlex
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.migrations.writer import MigrationWriter
+from apps.home.index_advisor import (
+    record_workload, save_workload, load_workload, analyse, build_index, write_migration, AnalysingTestRunner
+)
+
+
+class Command(BaseCommand):
+    help = 'Records a query workload, EXPLAINs each query shape and suggests indexes for sequential scans and sorts on large tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', action='append', default=[], help='Command whose queries are recorded, e.g. --run "test apps.home" (repeatable)')
+        parser.add_argument('--workload', help='Analyse a previously saved workload (JSONL) instead of / in addition to --run')
+        parser.add_argument('--save-workload', help='Write the recorded query shapes to this JSONL file')
+        parser.add_argument('--min-rows', type=int, default=10000, help='Only flag tables with at least this many rows')
+        parser.add_argument('--emit-migration', action='store_true', help='Write an AddIndex migration for the suggestions')
+        parser.add_argument('--concurrently', action='store_true', help='Use AddIndexConcurrently in the migration (PostgreSQL)')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        runs = [shlex.split(command) for command in options['run']]
+        if any(run[:1] == ['test'] for run in runs):
+            # A test run's queries hit its own test databases, so they are analysed there,
+            # inside the run; mixing in shapes from other databases would EXPLAIN them out of place
+            if len(runs) > 1 or options['workload']:
+                raise CommandError('--run "test ..." cannot be combined with other --run commands or --workload.')
+            analysed = []
+
+            def analyse_in_run(shapes):
+                analysed.append(shapes)
+                self.report(shapes, options)
+
+            self.record(runs[0], options, before_teardown=analyse_in_run)
+            if not analysed:
+                raise CommandError('The test run ended before its databases could be analysed.')
+            return
+
+        shapes = load_workload(options['workload']) if options['workload'] else []
+        for run in runs:
+            shapes += self.record(run, options)
+        self.report(shapes, options)
+
+    def record(self, run, options, before_teardown=None):
+        """
+        Runs one command under the recorder. With before_teardown (test runs), the
+        runner calls it with the recorded shapes while the test databases still exist.
+        """
+        extra = {}
+        with record_workload(options['database']) as recorder:
+            if before_teardown is not None:
+                # Snapshot the shapes first: the analysis's own EXPLAINs are recorded too
+                AnalysingTestRunner.before_teardown = lambda: before_teardown(list(recorder.shapes.values()))
+                extra['testrunner'] = 'apps.home.index_advisor.AnalysingTestRunner'
+            try:
+                call_command(*run, **extra)
+            except SystemExit:
+                # The test command exits non-zero on failures; the workload is still usable
+                self.stderr.write(self.style.WARNING(f"'{shlex.join(run)}' exited with an error."))
+            finally:
+                AnalysingTestRunner.before_teardown = None
+        return list(recorder.shapes.values())
+
+    def report(self, shapes, options):
+        if not shapes:
+            raise CommandError('Nothing to analyse: pass --run and/or --workload.')
+
+        if options['save_workload']:
+            save_workload(shapes, options['save_workload'])
+        self.stdout.write(f"{len(shapes)} query shapes, {sum(s['count'] for s in shapes)} executions")
+
+        findings, suggestions = analyse(shapes, options['database'], options['min_rows'])
+        for f in sorted(findings, key=lambda f: -f.shape['count']):
+            self.stdout.write(self.style.WARNING(f"[{f.kind.upper().replace('_', ' ')}] {f.table} (~{f.rows} rows), {f.shape['count']} calls: {f.detail}"))
+            self.stdout.write(f"    {f.shape['sql'][:200]}")
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS('No index suggestions.'))
+            return
+
+        self.stdout.write('Suggested indexes (add them to each model\'s Meta.indexes):')
+        for suggestion in suggestions:
+            index_source, _ = MigrationWriter.serialize(build_index(suggestion))
+            self.stdout.write(f"  {suggestion.model.__name__}: {index_source}")
+
+        if options['emit_migration']:
+            path = write_migration(suggestions, concurrently=options['concurrently'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {path}. Copy the indexes into Meta.indexes too, or makemigrations will drop them."))
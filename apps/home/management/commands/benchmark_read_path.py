@@ -0,0 +1,70 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Load-tests a running server (WSGI or ASGI) with many concurrent GET requests and reports throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://127.0.0.1:8000/api/schedule/')
+        parser.add_argument('--requests', type=int, default=1000, help='Total number of requests')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once')
+        parser.add_argument('--session', help='sessionid cookie of a signed-in user (the read APIs require login)')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+
+    def handle(self, *args, **options):
+        parts = urlsplit(options['url'])
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError('Only plain http:// URLs are supported.')
+
+        results = asyncio.run(self._run(parts, options))
+        latencies = sorted(elapsed for ok, elapsed in results if ok)
+        failures = len(results) - len(latencies)
+        wall = self._wall
+
+        self.stdout.write(f"{len(results)} requests, concurrency {options['concurrency']}, {wall:.2f}s wall time")
+        if latencies:
+            self.stdout.write(
+                f"  {len(latencies) / wall:.1f} req/s | latency ms: "
+                f"p50 {self._pct(latencies, 50):.1f}  p95 {self._pct(latencies, 95):.1f}  "
+                f"p99 {self._pct(latencies, 99):.1f}  mean {statistics.mean(latencies) * 1000:.1f}"
+            )
+        style = self.style.WARNING if failures else self.style.SUCCESS
+        self.stdout.write(style(f"  {failures} failed (non-200, timeout or connection error)"))
+
+    async def _run(self, parts, options):
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        headers = [f"GET {path} HTTP/1.1", f"Host: {parts.netloc}", "Connection: close"]
+        if options['session']:
+            headers.append(f"Cookie: sessionid={options['session']}")
+        request = ("\r\n".join(headers) + "\r\n\r\n").encode()
+
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        started_at = time.monotonic()
+        results = await asyncio.gather(*[
+            self._fetch(parts.hostname, parts.port or 80, request, semaphore, options['timeout'])
+            for _ in range(options['requests'])
+        ])
+        self._wall = time.monotonic() - started_at
+        return results
+
+    async def _fetch(self, host, port, request, semaphore, timeout):
+        # Raw sockets keep the client cheap, so it is never the bottleneck at high concurrency
+        async with semaphore:
+            started_at = time.monotonic()
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                writer.write(request)
+                status_line = await asyncio.wait_for(reader.readline(), timeout)
+                await asyncio.wait_for(reader.read(), timeout)
+                writer.close()
+                ok = status_line.split()[1:2] == [b'200']
+            except (OSError, asyncio.TimeoutError):
+                ok = False
+            return ok, time.monotonic() - started_at
+
+    def _pct(self, values, pct):
+        return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
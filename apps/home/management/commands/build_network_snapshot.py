@@ -0,0 +1,16 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.home.network import load_network_snapshot, snapshot_path, write_network_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the memory-mapped station/route network snapshot shared by every worker'
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        write_network_snapshot()
+        network = load_network_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {network.station_count} stations, {network.route_count} routes and {network.train_count} trains "
+            f"to {snapshot_path()} in {time.monotonic() - started_at:.2f}s"
+        ))
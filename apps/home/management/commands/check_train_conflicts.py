@@ -0,0 +1,49 @@
+import datetime
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from apps.home.models import Trip
+from apps.home.conflicts import detect_conflicts, intervals_from_queryset, interval_for_trip
+from apps.home.patterns import expand_patterns
+
+
+class Command(BaseCommand):
+    help = 'Reports train double-bookings, impossible turnarounds and location discontinuities across the fleet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help='First day to check (YYYY-MM-DD, default: today)')
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help='Last day to check (YYYY-MM-DD, default: start + 365 days)')
+        parser.add_argument('--train', help='Only check this train_id')
+        parser.add_argument('--no-patterns', action='store_true', help='Skip departures expanded from service patterns')
+        parser.add_argument('--fail-on-conflict', action='store_true', help='Exit with an error if any conflict is found')
+
+    def handle(self, *args, **options):
+        start = options['start'] or datetime.date.today()
+        end = options['end'] or start + datetime.timedelta(days=365)
+        started_at = time.monotonic()
+
+        trips = Trip.objects.filter(schedule_day__range=(start, end))
+        if options['train']:
+            trips = trips.filter(train_id=options['train'])
+        intervals = intervals_from_queryset(trips)
+
+        if not options['no_patterns']:
+            for trip in expand_patterns(start, end):
+                if not options['train'] or trip.train_id == options['train']:
+                    intervals.append(interval_for_trip(trip))
+
+        conflicts = detect_conflicts(intervals)
+        elapsed = time.monotonic() - started_at
+
+        for c in sorted(conflicts, key=lambda c: (c.train_id, c.second)):
+            self.stdout.write(f"[{c.kind.upper()}] Train {c.train_id}: {c.second} {c.detail}")
+
+        counts = Counter(c.kind for c in conflicts)
+        summary = f"Checked {len(intervals)} trips from {start} to {end} in {elapsed:.2f}s: " + \
+            ", ".join(f"{counts.get(kind, 0)} {kind}" for kind in ('overlap', 'turnaround', 'discontinuity'))
+        if conflicts:
+            self.stdout.write(self.style.WARNING(summary))
+            if options['fail_on_conflict']:
+                raise CommandError(f"{len(conflicts)} train conflicts found.")
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.home.travel_matrix import matrix_dir, refresh_travel_matrix
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the all-pairs travel time / fare / hop matrix (changed rows only unless --full)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every row instead of only those routes changes affect')
+
+    def handle(self, *args, **options):
+        result = refresh_travel_matrix(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {result.recomputed_rows} of {result.stations} stations' rows over {result.edges} links "
+            f"in {result.seconds:.2f}s ({matrix_dir()})"
+        ))
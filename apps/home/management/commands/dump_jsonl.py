@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.home.snapshots import open_snapshot, snapshot_models, dump, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Streams every apps.home table (and users) to a UTF-8 JSONL snapshot, gzipped if the path ends in .gz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='e.g. snapshot.jsonl.gz')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows fetched per database round trip')
+        parser.add_argument('--no-users', action='store_true', help='Leave out auth.User (Customer.user must then be empty or already present)')
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        with open_snapshot(options['path'], 'w') as stream:
+            counts = dump(stream, snapshot_models(not options['no_users']), options['chunk_size'], self._progress)
+        self.stdout.write(self.style.SUCCESS(f"Dumped {sum(counts.values())} objects to {options['path']} in {time.monotonic() - started_at:.1f}s"))
+
+    def _progress(self, label, count):
+        self.stdout.write(f"  {label}: {count}")
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.home.snapshots import open_snapshot, load, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Loads a dump_jsonl snapshot with batched bulk_create in constant memory (into an empty database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Objects per INSERT')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        with open_snapshot(options['path'], 'r') as stream:
+            counts = load(stream, options['batch_size'], options['database'], self._progress)
+        for label, count in counts.items():
+            self.stdout.write(f"  {label}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {sum(counts.values())} objects in {time.monotonic() - started_at:.1f}s"))
+        self.stdout.write("Run rebuild_departure_boards to index the loaded trips for the station kiosks.")
+
+    def _progress(self, label, count):
+        self.stdout.write(f"  {label}: {count}...", ending='\r')
@@ -0,0 +1,31 @@
+import csv
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from apps.home.scheduling import bulk_schedule_trips, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Bulk loads a timetable CSV (trip_id, trip_type, route_id, train_id, schedule_day, departure_time, arrival_time, trip_cost)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='Path to the timetable CSV file')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per INSERT batch')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8') as fh:
+                rows = list(csv.DictReader(fh))
+        except OSError as e:
+            raise CommandError(f"Could not read timetable: {e}")
+
+        self.stdout.write(f"Loading {len(rows)} trips...")
+        try:
+            created = bulk_schedule_trips(rows, batch_size=options['batch_size'])
+        except ValidationError as e:
+            for message in e.messages[:50]:
+                self.stdout.write(self.style.ERROR(message))
+            if len(e.messages) > 50:
+                self.stdout.write(self.style.ERROR(f"...and {len(e.messages) - 50} more errors."))
+            raise CommandError("Timetable rejected; no trips were created.")
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully scheduled {created} Trips!"))
@@ -0,0 +1,37 @@
+import datetime
+from django.core.management.base import BaseCommand
+from apps.home.maintenance import due_by, fleet_maintenance_windows, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Lists maintenance tasks due in the coming days and the free windows on each train to do them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Look-ahead in days (default: 7)')
+        parser.add_argument('--min-hours', type=int, default=4, help='Shortest usable maintenance window in hours (default: 4)')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the maintenance index from the full log history first')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_index()
+            self.stdout.write(f"Rebuilt maintenance index with {count} entries.")
+
+        today = datetime.date.today()
+        end = today + datetime.timedelta(days=options['days'])
+        entries = list(due_by(end))
+        if not entries:
+            self.stdout.write(self.style.SUCCESS(f"Nothing due before {end}."))
+            return
+
+        # Every train's windows from one pass over the schedule
+        windows = fleet_maintenance_windows({entry.train_id for entry in entries}, today, end, options['min_hours'])
+        for entry in entries:
+            status = self.style.ERROR('OVERDUE') if entry.is_overdue else 'due'
+            self.stdout.write(f"Train {entry.train.train_number}: {entry.task} {status} {entry.due_date} (last done {entry.last_performed})")
+
+            train_windows = windows[entry.train_id]
+            if train_windows:
+                first_start, first_end = train_windows[0]
+                self.stdout.write(f"    next window: {first_start:%Y-%m-%d %H:%M} - {first_end:%Y-%m-%d %H:%M}")
+            else:
+                self.stdout.write(self.style.WARNING("    no free window in range"))
@@ -0,0 +1,12 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.home.boards import rebuild_boards
+
+
+class Command(BaseCommand):
+    help = 'Refreshes every station departure/arrival board from the database'
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        count = rebuild_boards()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} trips on the departure boards in {time.monotonic() - started_at:.2f}s"))
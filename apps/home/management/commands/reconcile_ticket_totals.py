@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.home.ticket_totals import reconcile_totals, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Finds tickets whose total_cost no longer matches their trips and fixes them in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Tickets checked per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only count drifted tickets')
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+
+        def progress(checked, drifted):
+            self.stdout.write(f"  {checked} checked, {drifted} drifted", ending='\r')
+
+        checked, drifted = reconcile_totals(options['chunk_size'], options['dry_run'], progress)
+        verb = 'found' if options['dry_run'] else 'fixed'
+        summary = f"Checked {checked} tickets in {time.monotonic() - started_at:.2f}s: {drifted} drifted totals {verb}."
+        self.stdout.write(self.style.WARNING(summary) if drifted else self.style.SUCCESS(summary))
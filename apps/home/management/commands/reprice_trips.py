@@ -0,0 +1,20 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.home.pricing import reprice_trips
+
+
+class Command(BaseCommand):
+    help = 'Reprices upcoming trips from demand (load factor, days to departure, trip type, route history)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PRICING_HORIZON_DAYS, help='Reprice trips departing within this many days')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the fares that would change')
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        result = reprice_trips(days=options['days'], dry_run=options['dry_run'])
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Priced {result.priced} trips in {time.monotonic() - started_at:.2f}s: {result.changed} fares {verb}."
+        ))
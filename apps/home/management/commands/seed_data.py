@@ -1,13 +1,20 @@
 import random
 import datetime
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.home.conflicts import conflicts_for_pattern, min_turnaround
 from apps.home.models import (
     Station, L_Station, I_Station,
     Route, L_Route, I_Route,
     Train_Model, Train, S_Series, A_Series,
-    Trip, L_Trip, I_Trip
+    Service_Pattern
 )
 
+
+class _TrainBusy(Exception):
+    pass
+
+
 class Command(BaseCommand):
     help = 'Seeds the database with comprehensive Narnia-themed Tirian Trains data'
 
@@ -32,19 +39,11 @@ class Command(BaseCommand):
             self.stdout.write("Creating Trains...")
             s_trains = []
             for i in range(1, 4):
-                train, _ = Train.objects.get_or_create(
-                    train_id=f"10000{i}", defaults={'train_number': f"S100{i}", 'train_series': 'S', 'train_model': model_s}
-                )
-                s_series, _ = S_Series.objects.get_or_create(train=train)
-                s_trains.append(s_series)
+                s_trains.append(self.get_train('S', i, model_s))
 
             a_trains = []
             for i in range(1, 4):
-                train, _ = Train.objects.get_or_create(
-                    train_id=f"20000{i}", defaults={'train_number': f"A200{i}", 'train_series': 'A', 'train_model': model_a, 'has_food_service': True}
-                )
-                a_series, _ = A_Series.objects.get_or_create(train=train)
-                a_trains.append(a_series)
+                a_trains.append(self.get_train('A', i, model_a))
 
             # ---------------------------------------------------------
             # 3. STATIONS
@@ -99,63 +98,82 @@ class Command(BaseCommand):
                 route_id_counter += 1
 
             # ---------------------------------------------------------
-            # 5. TRIPS
+            # 5. SERVICE PATTERNS
+            # Daily departures are stored once as recurring patterns and
+            # only become Trip rows when a ticket is booked on them.
+            # Each departure is an out-and-back pair, so its train ends
+            # the day where it started, on a train that is free for both legs.
             # ---------------------------------------------------------
-            self.stdout.write("Creating Scheduled Trips...")
+            self.stdout.write("Creating Service Patterns...")
             today = datetime.date.today()
-            trip_counter = 1
-
-            # Generate trips for today and the next 2 days
-            for day_offset in range(3):
-                current_date = today + datetime.timedelta(days=day_offset)
-
-                # Local Trips (45 mins duration)
-                for l_route in l_routes:
-                    for _ in range(2): # 2 trips per route, per day
-                        hour = random.randint(6, 20)
-                        minute = random.choice([0, 15, 30, 45])
-                        dep_time = datetime.time(hour, minute)
-                        arr_dt = datetime.datetime.combine(current_date, dep_time) + datetime.timedelta(minutes=45)
-                        
-                        train = random.choice(s_trains)
-                        trip_id_str = f"{current_date.strftime('%Y%m%d')}L{trip_counter:03d}"
-                        
-                        trip, _ = Trip.objects.get_or_create(
-                            trip_id=trip_id_str,
-                            defaults={
-                                'route': l_route.l_route_id, 'train': train.train,
-                                'departure_time': dep_time, 'arrival_time': arr_dt.time(),
-                                'schedule_day': current_date, 'trip_cost': random.choice([15, 20, 25]),
-                                'trip_type': 'L'
-                            }
-                        )
-                        L_Trip.objects.get_or_create(l_trip_id=trip, defaults={'s_train': train, 'l_route': l_route})
-                        trip_counter += 1
-
-                # Inter-town Trips (2 hours duration)
-                for i_route in i_routes:
-                    for _ in range(2): # 2 trips per route, per day
-                        hour = random.randint(5, 21)
-                        minute = random.choice([0, 30])
-                        dep_time = datetime.time(hour, minute)
-                        arr_dt = datetime.datetime.combine(current_date, dep_time) + datetime.timedelta(hours=2)
-                        
-                        train = random.choice(a_trains)
-                        trip_id_str = f"{current_date.strftime('%Y%m%d')}I{trip_counter:03d}"
-                        
-                        trip, _ = Trip.objects.get_or_create(
-                            trip_id=trip_id_str,
-                            defaults={
-                                'route': i_route.i_route_id, 'train': train.train,
-                                'departure_time': dep_time, 'arrival_time': arr_dt.time(),
-                                'schedule_day': current_date, 'trip_cost': random.choice([50, 75, 100]),
-                                'trip_type': 'I'
-                            }
-                        )
-                        I_Trip.objects.get_or_create(i_trip_id=trip, defaults={'a_train': train, 'i_route': i_route})
-                        trip_counter += 1
+            pattern_count = 0
+
+            # Local Services (45 mins each way); l_routes alternates forward and backward
+            for i in range(0, len(l_routes), 2):
+                for _ in range(2): # 2 round trips per route pair, per day
+                    dep_time = datetime.time(random.randint(6, 19), random.choice([0, 15, 30, 45]))
+                    pattern_count += self.schedule_round_trip(
+                        l_routes[i].l_route_id, l_routes[i + 1].l_route_id, 'L', dep_time,
+                        datetime.timedelta(minutes=45), random.choice([15, 20, 25]), s_trains, model_s, today
+                    )
 
-            self.stdout.write(self.style.SUCCESS(f"Successfully seeded Database with {trip_counter-1} Scheduled Trips!"))
+            # Inter-town Services (2 hours each way)
+            for i in range(0, len(i_routes), 2):
+                for _ in range(2): # 2 round trips per route pair, per day
+                    dep_time = datetime.time(random.randint(5, 17), random.choice([0, 30]))
+                    pattern_count += self.schedule_round_trip(
+                        i_routes[i].i_route_id, i_routes[i + 1].i_route_id, 'I', dep_time,
+                        datetime.timedelta(hours=2), random.choice([50, 75, 100]), a_trains, model_a, today
+                    )
+
+            self.stdout.write(self.style.SUCCESS(f"Successfully seeded Database with {pattern_count} Service Patterns!"))
 
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error seeding data: {e}"))
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f"Error seeding data: {e}"))
+
+    def get_train(self, series, number, train_model):
+        """
+        Train number `number` of a series ('S' trains are 10000N/S100N, 'A' trains 20000N/A200N).
+        """
+        prefix, digit = {'S': ('S', 1), 'A': ('A', 2)}[series]
+        train, _ = Train.objects.get_or_create(
+            train_id=str(digit * 100000 + number),
+            defaults={
+                'train_number': f"{prefix}{digit * 1000 + number}", 'train_series': series,
+                'train_model': train_model, 'has_food_service': series == 'A',
+            }
+        )
+        subtype = S_Series if series == 'S' else A_Series
+        return subtype.objects.get_or_create(train=train)[0]
+
+    def schedule_round_trip(self, outbound, inbound, trip_type, dep_time, leg, fare, trains, train_model, today):
+        """
+        Creates an out-and-back pair of daily patterns on the first train that is free
+        for both legs (the conflict check Service_Pattern.clean runs), adding a train
+        to the series when every one is busy. Returns the number of patterns created.
+        """
+        if Service_Pattern.objects.filter(route=outbound, departure_time=dep_time).exists():
+            return 0
+        out_at = datetime.datetime.combine(today, dep_time)
+        legs = [(outbound, out_at), (inbound, out_at + leg + min_turnaround())]
+
+        for series_train in random.sample(trains, len(trains)) + [None]:
+            if series_train is None:
+                # Every train is busy or elsewhere then; a new one has nothing to conflict with
+                series_train = self.get_train('S' if trip_type == 'L' else 'A', len(trains) + 1, train_model)
+                trains.append(series_train)
+            try:
+                with transaction.atomic():
+                    patterns = [
+                        Service_Pattern.objects.create(
+                            route=route, train=series_train.train, departure_time=start.time(), arrival_time=(start + leg).time(),
+                            trip_cost=fare, trip_type=trip_type, days_of_week=Service_Pattern.EVERY_DAY, valid_from=today,
+                        )
+                        for route, start in legs
+                    ]
+                    if any(conflicts_for_pattern(pattern) for pattern in patterns):
+                        raise _TrainBusy
+                return len(patterns)
+            except _TrainBusy:
+                continue
+        return 0
@@ -0,0 +1,144 @@
+import glob
+import os
+import time
+from django.conf import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, disable_created_metrics, generate_latest, multiprocess
+)
+from prometheus_client.metrics_core import Metric
+
+# Histogram buckets (seconds) for request-scale work; task histograms use TASK_BUCKETS
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# Seconds a scrape waits for the broker when reading queue depths
+BROKER_TIMEOUT = 1
+
+# Every metric this app defines. With METRICS_DIR set (core/settings.py exports it as
+# PROMETHEUS_MULTIPROC_DIR before prometheus_client is imported), each process writes
+# its values to its own files there and a scrape merges them instead.
+REGISTRY = CollectorRegistry()
+
+# Multiprocess mode has no _created series; leave them out in memory as well so both serve the same
+disable_created_metrics()
+
+# Callables run at scrape time, each yielding (name, kind, documentation, [(labels dict, value)])
+COLLECTORS = []
+
+
+def register_collector(collector):
+    COLLECTORS.append(collector)
+    return collector
+
+
+class _ScrapeCollector:
+    """
+    Serves the register_collector() callables through prometheus_client's collector API.
+    """
+    def collect(self):
+        for collector in COLLECTORS:
+            for name, kind, documentation, samples in collector():
+                metric = Metric(name, documentation, kind)
+                for labels, value in samples:
+                    metric.add_sample(name, labels, value)
+                yield metric
+
+
+SCRAPE_COLLECTOR = _ScrapeCollector()
+REGISTRY.register(SCRAPE_COLLECTOR)
+
+
+def exposition():
+    """
+    Every metric in the Prometheus text format, merged over all processes' files in
+    multiprocess mode, followed by the scrape-time collectors.
+    """
+    if not settings.METRICS_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=settings.METRICS_DIR)
+    registry.register(SCRAPE_COLLECTOR)
+    return generate_latest(registry)
+
+
+def reset():
+    """
+    Clears every labelled series and, in multiprocess mode, every process's files
+    (tests; deployments empty METRICS_DIR before the server starts instead).
+    """
+    for metric in (BOOKINGS, BOOKING_SECONDS, ID_ALLOCATION_RETRIES, TASK_RUNS, TASK_SECONDS):
+        metric.clear()
+    if settings.METRICS_DIR:
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.db')):
+            os.remove(path)
+
+
+BOOKINGS = Counter(
+    'tirian_bookings_total', 'Ticket purchases by path (sync, queued, worker) and outcome.', ['path', 'outcome'],
+    registry=REGISTRY
+)
+BOOKING_SECONDS = Histogram(
+    'tirian_booking_seconds', 'Time to issue a ticket, by path.', ['path'], buckets=DEFAULT_BUCKETS, registry=REGISTRY
+)
+BOOKING_QUEUE_WAIT = Histogram(
+    'tirian_booking_queue_wait_seconds', 'Time booking requests waited on the bookings queue.', buckets=TASK_BUCKETS,
+    registry=REGISTRY
+)
+ID_ALLOCATION_RETRIES = Counter(
+    'tirian_id_allocation_retries_total', 'Generated-ID collisions retried under concurrent inserts.', ['model'],
+    registry=REGISTRY
+)
+TASK_RUNS = Counter('tirian_task_runs_total', 'Celery task runs by final state.', ['task', 'state'], registry=REGISTRY)
+TASK_SECONDS = Histogram(
+    'tirian_task_duration_seconds', 'Celery task run time.', ['task'], buckets=TASK_BUCKETS, registry=REGISTRY
+)
+
+
+def observe_booking(path, outcome, seconds=None):
+    BOOKINGS.labels(path, outcome).inc()
+    if seconds is not None:
+        BOOKING_SECONDS.labels(path).observe(seconds)
+
+
+# Task start times by task ID, between task_prerun and task_postrun in a worker process
+_task_started = {}
+
+
+def task_started(task_id):
+    _task_started[task_id] = time.perf_counter()
+
+
+def task_finished(task_id, task_name, state):
+    started_at = _task_started.pop(task_id, None)
+    TASK_RUNS.labels(task_name, state or 'UNKNOWN').inc()
+    if started_at is not None:
+        TASK_SECONDS.labels(task_name).observe(time.perf_counter() - started_at)
+
+
+def _queue_names():
+    queues = {'celery'}
+    queues.update(route['queue'] for route in getattr(settings, 'CELERY_TASK_ROUTES', {}).values() if 'queue' in route)
+    return sorted(queues)
+
+
+@register_collector
+def queue_depth():
+    """
+    Messages waiting per Celery queue, read from the broker at scrape time so
+    every worker and web process reports the same number.
+    """
+    from core.celery import app
+
+    depths = []
+    try:
+        with app.connection_for_read(connect_timeout=BROKER_TIMEOUT) as connection:
+            # One quick attempt: a scrape must not hang on a broker that is down
+            connection.ensure_connection(max_retries=1, interval_start=0, interval_step=0)
+            channel = connection.default_channel
+            for queue in _queue_names():
+                depths.append(({'queue': queue}, channel.queue_declare(queue=queue, passive=True).message_count))
+        up = 1
+    except Exception:
+        up = 0
+    yield 'tirian_broker_up', 'gauge', 'Whether the Celery broker answered the last scrape.', [({}, up)]
+    yield 'tirian_queue_depth', 'gauge', 'Messages waiting per Celery queue.', depths
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_customer_profile_picture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Booking_Request',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(help_text='Client-supplied, unique per customer', max_length=64)),
+                ('trip_date', models.DateField()),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=10)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booking_requests', to='home.customer')),
+                ('ticket', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='booking_request', to='home.ticket')),
+                ('trips', models.ManyToManyField(related_name='booking_requests', to='home.trip')),
+            ],
+            options={
+                'unique_together': {('customer', 'idempotency_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_booking_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='profile_picture_ready',
+            field=models.BooleanField(default=False, help_text='True once thumbnails have been generated'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_trip_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Service_Pattern',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('departure_time', models.TimeField()),
+                ('arrival_time', models.TimeField()),
+                ('trip_cost', models.IntegerField(default=0)),
+                ('trip_type', models.CharField(choices=[('L', 'Local'), ('I', 'Inter-town')], max_length=1)),
+                ('days_of_week', models.PositiveSmallIntegerField(default=127, help_text='Bitmask: Mon=1, Tue=2, Wed=4, Thu=8, Fri=16, Sat=32, Sun=64')),
+                ('valid_from', models.DateField()),
+                ('valid_until', models.DateField(blank=True, help_text='Leave blank to run indefinitely', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_patterns', to='home.route')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_patterns', to='home.train')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='service_pattern',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='materialized_trips', to='home.service_pattern'),
+        ),
+        migrations.CreateModel(
+            name='Service_Exception',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('exception_type', models.CharField(choices=[('Cancelled', 'Cancelled'), ('Extra', 'Extra')], max_length=10)),
+                ('service_pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='home.service_pattern')),
+            ],
+            options={
+                'unique_together': {('service_pattern', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_service_patterns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='interval_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Days between repeats. Leave blank if not recurring.', null=True),
+        ),
+        migrations.CreateModel(
+            name='Maintenance_Due',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_performed', models.DateField()),
+                ('due_date', models.DateField(blank=True, null=True)),
+                ('last_log', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='home.maintenance_log')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='maintenance_due', to='home.task')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='maintenance_due', to='home.train')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['due_date'], name='maintenance_due_date_idx')],
+                'unique_together': {('train', 'task')},
+            },
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+# PostgreSQL only: statement-level triggers (with transition tables, so a bulk insert
+# or a repricing of thousands of trips costs one UPDATE) keep home_ticket.total_cost
+# equal to the sum of its trips' costs, whatever wrote the rows. Other databases rely
+# on the app-side updates in apps/home/ticket_totals.py.
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION home_refresh_ticket_totals(ids varchar[]) RETURNS void AS $$
+    UPDATE home_ticket t SET total_cost = s.total
+    FROM (
+        SELECT tk.ticket_id, COALESCE(SUM(tr.trip_cost), 0) AS total
+        FROM home_ticket tk
+        LEFT JOIN home_ticket_trips tt ON tt.ticket_id = tk.ticket_id
+        LEFT JOIN home_trip tr ON tr.trip_id = tt.trip_id
+        WHERE tk.ticket_id = ANY(ids)
+        GROUP BY tk.ticket_id
+    ) s
+    WHERE t.ticket_id = s.ticket_id AND t.total_cost <> s.total;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION home_ticket_trips_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM home_refresh_ticket_totals(ARRAY(SELECT DISTINCT ticket_id FROM changed));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION home_trip_cost_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM home_refresh_ticket_totals(ARRAY(
+        SELECT DISTINCT tt.ticket_id
+        FROM new_rows n
+        JOIN old_rows o ON o.trip_id = n.trip_id
+        JOIN home_ticket_trips tt ON tt.trip_id = n.trip_id
+        WHERE n.trip_cost <> o.trip_cost
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER home_ticket_trips_insert AFTER INSERT ON home_ticket_trips
+    REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION home_ticket_trips_changed();
+CREATE TRIGGER home_ticket_trips_delete AFTER DELETE ON home_ticket_trips
+    REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION home_ticket_trips_changed();
+CREATE TRIGGER home_trip_cost_update AFTER UPDATE ON home_trip
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION home_trip_cost_changed();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS home_trip_cost_update ON home_trip;
+DROP TRIGGER IF EXISTS home_ticket_trips_delete ON home_ticket_trips;
+DROP TRIGGER IF EXISTS home_ticket_trips_insert ON home_ticket_trips;
+DROP FUNCTION IF EXISTS home_trip_cost_changed();
+DROP FUNCTION IF EXISTS home_ticket_trips_changed();
+DROP FUNCTION IF EXISTS home_refresh_ticket_totals(varchar[]);
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGERS)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGERS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0009_maintenance_due'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_ticket_total_triggers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='cancelled_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
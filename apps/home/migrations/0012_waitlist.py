@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_ticket_cancelled_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Waitlist_Entry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('Waiting', 'Waiting'), ('Promoted', 'Promoted'), ('Expired', 'Expired'), ('Left', 'Left')], default='Waiting', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='home.customer')),
+                ('ticket', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entry', to='home.ticket')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='home.trip')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'Waiting')), fields=['trip', 'id'], name='waitlist_queue_idx'), models.Index(condition=models.Q(('status', 'Waiting')), fields=['expires_at'], name='waitlist_expiry_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='waitlist_entry',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'Waiting')), fields=('trip', 'customer'), name='waitlist_one_entry_per_customer'),
+        ),
+    ]
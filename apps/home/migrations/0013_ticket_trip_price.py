@@ -0,0 +1,154 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# PostgreSQL only: new ticket/trip links are stamped with the trip's current fare,
+# totals sum those stamped prices, and repricing a trip no longer touches tickets
+# already sold (the trip cost trigger from 0010 is dropped).
+PRICE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION home_refresh_ticket_totals(ids varchar[]) RETURNS void AS $$
+    UPDATE home_ticket t SET total_cost = s.total
+    FROM (
+        SELECT tk.ticket_id, COALESCE(SUM(COALESCE(tt.price, tr.trip_cost)), 0) AS total
+        FROM home_ticket tk
+        LEFT JOIN home_ticket_trips tt ON tt.ticket_id = tk.ticket_id
+        LEFT JOIN home_trip tr ON tr.trip_id = tt.trip_id
+        WHERE tk.ticket_id = ANY(ids)
+        GROUP BY tk.ticket_id
+    ) s
+    WHERE t.ticket_id = s.ticket_id AND t.total_cost <> s.total;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION home_ticket_trips_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE home_ticket_trips tt SET price = tr.trip_cost
+        FROM changed c JOIN home_trip tr ON tr.trip_id = c.trip_id
+        WHERE tt.id = c.id AND tt.price IS NULL;
+    END IF;
+    PERFORM home_refresh_ticket_totals(ARRAY(SELECT DISTINCT ticket_id FROM changed));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS home_trip_cost_update ON home_trip;
+DROP FUNCTION IF EXISTS home_trip_cost_changed();
+"""
+
+RESTORE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION home_refresh_ticket_totals(ids varchar[]) RETURNS void AS $$
+    UPDATE home_ticket t SET total_cost = s.total
+    FROM (
+        SELECT tk.ticket_id, COALESCE(SUM(tr.trip_cost), 0) AS total
+        FROM home_ticket tk
+        LEFT JOIN home_ticket_trips tt ON tt.ticket_id = tk.ticket_id
+        LEFT JOIN home_trip tr ON tr.trip_id = tt.trip_id
+        WHERE tk.ticket_id = ANY(ids)
+        GROUP BY tk.ticket_id
+    ) s
+    WHERE t.ticket_id = s.ticket_id AND t.total_cost <> s.total;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION home_ticket_trips_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM home_refresh_ticket_totals(ARRAY(SELECT DISTINCT ticket_id FROM changed));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION home_trip_cost_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM home_refresh_ticket_totals(ARRAY(
+        SELECT DISTINCT tt.ticket_id
+        FROM new_rows n
+        JOIN old_rows o ON o.trip_id = n.trip_id
+        JOIN home_ticket_trips tt ON tt.trip_id = n.trip_id
+        WHERE n.trip_cost <> o.trip_cost
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER home_trip_cost_update AFTER UPDATE ON home_trip
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION home_trip_cost_changed();
+"""
+
+
+def price_existing_links(apps, schema_editor):
+    """
+    Tickets sold so far were charged the trips' current fares.
+    """
+    Ticket_Trip = apps.get_model('home', 'Ticket_Trip')
+    Trip = apps.get_model('home', 'Trip')
+    trip_cost = Trip.objects.filter(pk=models.OuterRef('trip_id')).values('trip_cost')[:1]
+    Ticket_Trip.objects.filter(price__isnull=True).update(price=models.Subquery(trip_cost))
+    Trip.objects.filter(base_cost__isnull=True).update(base_cost=models.F('trip_cost'))
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(PRICE_TRIGGERS)
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(RESTORE_TRIGGERS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_waitlist'),
+    ]
+
+    operations = [
+        # The auto-created home_ticket_trips table becomes an explicit model; no schema change
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Ticket_Trip',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.ticket')),
+                        ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.trip')),
+                    ],
+                    options={
+                        'db_table': 'home_ticket_trips',
+                        'unique_together': {('ticket', 'trip')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='ticket',
+                    name='trips',
+                    field=models.ManyToManyField(related_name='tickets', through='home.Ticket_Trip', to='home.trip'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ticket_trip',
+            name='price',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='base_cost',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Trip_Price',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.IntegerField()),
+                ('base_cost', models.IntegerField()),
+                ('load_factor', models.FloatField(blank=True, help_text='Seats sold / capacity when priced', null=True)),
+                ('days_to_departure', models.IntegerField()),
+                ('priced_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='home.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', '-priced_at'], name='trip_price_history_idx')],
+            },
+        ),
+        migrations.RunPython(price_existing_links, migrations.RunPython.noop),
+        migrations.RunPython(create_triggers, restore_triggers),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_ticket_trip_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['route', 'schedule_day', 'departure_time'], name='trip_route_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['schedule_day', 'departure_time'], name='trip_day_departure_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_trip_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['customer', 'trip_date', 'ticket_id'], name='ticket_customer_trip_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_ticket_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job_Run',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=64)),
+                ('task_name', models.CharField(max_length=200)),
+                ('state', models.CharField(choices=[('SUCCESS', 'Success'), ('FAILURE', 'Failure'), ('RETRY', 'Retry')], max_length=10)),
+                ('result', models.CharField(blank=True, default='', help_text='Return value or exception, truncated', max_length=255)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField(help_text='Seconds')),
+                ('query_count', models.IntegerField(default=0)),
+                ('rows_affected', models.IntegerField(default=0, help_text='Rows inserted, updated or deleted')),
+                ('max_rss_kb', models.IntegerField(default=0, help_text='Worker peak resident memory after the run')),
+                ('rss_growth_kb', models.IntegerField(default=0, help_text="How far the run raised the worker's peak memory")),
+                ('profile', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['task_name', '-started_at'], name='job_run_task_idx'), models.Index(fields=['-duration'], name='job_run_duration_idx')],
+            },
+        ),
+    ]
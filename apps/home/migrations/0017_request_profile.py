@@ -0,0 +1,37 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('home', '0016_job_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Request_Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status_code', models.IntegerField()),
+                ('duration', models.FloatField(help_text='Seconds, including profiling overhead')),
+                ('query_count', models.IntegerField(default=0)),
+                ('trigger', models.CharField(choices=[('header', 'Header'), ('param', 'Query parameter'), ('sample', 'Random sample')], max_length=10)),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile + stack sampler'), ('sample', 'Stack sampler')], max_length=10)),
+                ('profile_file', models.CharField(blank=True, default='', help_text='cProfile dump (pstats / snakeviz)', max_length=500)),
+                ('stacks_file', models.CharField(help_text='Collapsed stacks (flamegraph.pl / speedscope)', max_length=500)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-created_at'], name='request_profile_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Schedule_Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trip_id', models.CharField(max_length=20)),
+                ('kind', models.CharField(choices=[('Delayed', 'Delayed'), ('Retimed', 'Retimed'), ('Cancelled', 'Cancelled')], max_length=10)),
+                ('old_schedule_day', models.DateField()),
+                ('old_departure_time', models.TimeField()),
+                ('old_arrival_time', models.TimeField()),
+                ('new_schedule_day', models.DateField(blank=True, null=True)),
+                ('new_departure_time', models.TimeField(blank=True, null=True)),
+                ('new_arrival_time', models.TimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer_ids', models.JSONField(blank=True, editable=False, null=True)),
+                ('fanned_out_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('recipients', models.IntegerField(default=0, editable=False, help_text='Customers queued for a notice')),
+                ('notified', models.IntegerField(default=0, editable=False, help_text='Customers sent a notice')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip_id', '-created_at'], name='schedule_change_trip_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_cancelled_holders(apps, schema_editor):
+    """
+    Cancellations recorded so far kept their holders' IDs on the change itself.
+    """
+    Schedule_Change = apps.get_model('home', 'Schedule_Change')
+    Schedule_Change_Recipient = apps.get_model('home', 'Schedule_Change_Recipient')
+    Customer = apps.get_model('home', 'Customer')
+    db = schema_editor.connection.alias
+    for change in Schedule_Change.objects.using(db).filter(customer_ids__isnull=False).iterator():
+        existing = Customer.objects.using(db).filter(pk__in=change.customer_ids).values_list('pk', flat=True)
+        Schedule_Change_Recipient.objects.using(db).bulk_create(
+            [Schedule_Change_Recipient(change_id=change.pk, customer_id=customer_id) for customer_id in existing]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_schedule_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule_change',
+            name='queued_through',
+            field=models.CharField(blank=True, editable=False, max_length=4),
+        ),
+        migrations.CreateModel(
+            name='Schedule_Change_Recipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notice_recipients', to='home.schedule_change')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.customer')),
+            ],
+            options={
+                'unique_together': {('change', 'customer')},
+            },
+        ),
+        migrations.RunPython(copy_cancelled_holders, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='schedule_change',
+            name='customer_ids',
+        ),
+    ]
@@ -1,8 +1,13 @@
 import datetime
+import numpy as np
 from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from django.db.models.signals import m2m_changed
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from django.db.models.signals import m2m_changed, pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
+from .caching import bump_schedule_version
+from .metrics import ID_ALLOCATION_RETRIES
 
 class Station(models.Model):
     """
@@ -194,6 +199,67 @@ class A_Series(models.Model):
         return f"A-Series: {self.train.train_number}"
 
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _seconds_of_day(times):
+    # -1 marks a missing time
+    return np.fromiter(
+        (t.hour * 3600 + t.minute * 60 + t.second if t is not None else -1 for t in times), dtype=np.int64, count=len(times)
+    )
+
+
+def compute_durations(departure_times, arrival_times):
+    """
+    Computes trip durations for whole columns of departure/arrival times as numpy
+    arrays of seconds-of-day, so the overnight wrap (e.g. 23:00 -> 01:00) is a
+    single vectorized modulo. None where either time is missing.
+    """
+    departures = _seconds_of_day(departure_times)
+    arrivals = _seconds_of_day(arrival_times)
+    durations = ((arrivals - departures) % SECONDS_PER_DAY).astype('timedelta64[s]').astype(object)
+    durations[(departures < 0) | (arrivals < 0)] = None
+    return durations.tolist()
+
+
+class TripQuerySet(models.QuerySet):
+    """
+    Keeps Trip.duration correct for bulk writes, which bypass Trip.save().
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        durations = compute_durations([t.departure_time for t in objs], [t.arrival_time for t in objs])
+        for trip, duration in zip(objs, durations):
+            trip.duration = duration
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        from .boards import index_trips
+
+        if 'departure_time' not in kwargs and 'arrival_time' not in kwargs:
+            return super().update(**kwargs)
+
+        # Retimed trips render differently, so retire their cached fragments too
+        kwargs.setdefault('updated_at', timezone.now())
+
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            count = super().update(**kwargs)
+
+            # Re-read the new times and write the matching durations back in batches
+            manager = self.model._default_manager.db_manager(self.db)
+            for start in range(0, len(pks), 1000):
+                trips = list(manager.filter(pk__in=pks[start:start + 1000]).only('pk', 'departure_time', 'arrival_time'))
+                durations = compute_durations([t.departure_time for t in trips], [t.arrival_time for t in trips])
+                for trip, duration in zip(trips, durations):
+                    trip.duration = duration
+                manager.bulk_update(trips, ['duration'])
+
+            # No post_save either, so move the retimed trips on the boards as index_trip_on_boards would
+            transaction.on_commit(lambda: index_trips(pks), using=self.db)
+        return count
+
+
 class Trip(models.Model):
     """
     Represents a scheduled train trip from one train station to an adjacent train station.
@@ -210,6 +276,9 @@ class Trip(models.Model):
 
     # Link Trip to the specific Train assigned
     train = models.ForeignKey('Train', on_delete=models.CASCADE, related_name='trips', null=True)
+
+    # Set when the trip was materialized from a recurring Service_Pattern
+    service_pattern = models.ForeignKey('Service_Pattern', on_delete=models.SET_NULL, null=True, blank=True, related_name='materialized_trips')
     
     departure_time = models.TimeField()
     arrival_time = models.TimeField()
@@ -217,6 +286,9 @@ class Trip(models.Model):
     
     # Cost in Lion Coins
     trip_cost = models.IntegerField(default=0)
+
+    # List fare the pricing engine scales by demand to set trip_cost; blank = the first trip_cost it saw
+    base_cost = models.IntegerField(null=True, blank=True)
     
     # Trip Type: Local ('L') or Inter-town ('I')
     TRIP_TYPES = [
@@ -238,10 +310,43 @@ class Trip(models.Model):
         help_text="True if trip has concluded"
     )
 
+    # Version stamp for cached trip fragments (queryset .update() calls must set it explicitly)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TripQuerySet.as_manager()
+
     class Meta:
         ordering = ['departure_time']
+        indexes = [
+            # Trip search: stations resolve to route IDs, then one range scan per route
+            models.Index(fields=['route', 'schedule_day', 'departure_time'], name='trip_route_day_idx'),
+            # Searches by date and time alone, and the day-ordered schedule pages
+            models.Index(fields=['schedule_day', 'departure_time'], name='trip_day_departure_idx'),
+        ]
+
+    # Fields whose change can make the train's schedule conflict
+    CONFLICT_FIELDS = ('train', 'route', 'schedule_day', 'departure_time', 'arrival_time')
+
+    def clean(self):
+        """
+        Rejects train assignments that overlap another trip, leave too little
+        turnaround time, or start somewhere other than where the train last arrived.
+        """
+        from .conflicts import conflicts_for_trip
+        conflicts = conflicts_for_trip(self)
+        if conflicts:
+            raise ValidationError({'train': [f"{c.kind.title()}: {c.second} {c.detail}" for c in conflicts]})
+
+    def save(self, *args, check_conflicts=True, **kwargs):
+        """
+        Saves the trip after checking its train's schedule (clean()), so code paths
+        that skip form validation cannot double-book a train. Callers that already
+        validated the trip, or swept a whole batch, pass check_conflicts=False.
+        """
+        update_fields = kwargs.get('update_fields')
+        if check_conflicts and (update_fields is None or set(update_fields) & set(self.CONFLICT_FIELDS)):
+            self.clean()
 
-    def save(self, *args, **kwargs):
         # Calculate duration if times are present
         if self.departure_time and self.arrival_time:
             # Create dummy dates to allow subtraction
@@ -273,6 +378,9 @@ class Trip(models.Model):
         """
         Helper to get the origin station name regardless of trip type.
         """
+        # Trip search annotates the name instead of loading the route chain
+        if getattr(self, 'origin_station_name', None):
+            return self.origin_station_name
         if self.route:
             return self.route.origin.station_name if self.route.origin else "Unknown"
         return "No Route"
@@ -282,10 +390,19 @@ class Trip(models.Model):
         """
         Helper to get the destination station name regardless of trip type.
         """
+        if getattr(self, 'destination_station_name', None):
+            return self.destination_station_name
         if self.route:
             return self.route.destination.station_name if self.route.destination else "Unknown"
         return "No Route"
 
+    @property
+    def cache_version(self):
+        """
+        Changes whenever the trip is saved; used in fragment cache keys.
+        """
+        return self.updated_at.timestamp() if self.updated_at else 0
+
     def __str__(self):
         return f"Trip {self.trip_id} ({self.get_trip_type_display()})"  # type: ignore
 
@@ -313,6 +430,117 @@ class I_Trip(models.Model):
         return f"Inter-town Trip {self.i_trip_id.trip_id}"
 
 
+class Trip_Price(models.Model):
+    """
+    Price history: one row each time the pricing engine changes a trip's fare,
+    with the demand inputs that produced it.
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='price_history')
+    price = models.IntegerField()
+    base_cost = models.IntegerField()
+    load_factor = models.FloatField(null=True, blank=True, help_text="Seats sold / capacity when priced")
+    days_to_departure = models.IntegerField()
+    priced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', '-priced_at'], name='trip_price_history_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.trip_id}: {self.price} at {self.priced_at:%Y-%m-%d %H:%M}"
+
+
+class Service_Pattern(models.Model):
+    """
+    Represents a recurring departure (e.g. every weekday at 08:00) that is expanded
+    into dated trips on demand instead of storing one Trip row per day.
+    """
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='service_patterns')
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='service_patterns')
+
+    departure_time = models.TimeField()
+    arrival_time = models.TimeField()
+
+    # Cost in Lion Coins
+    trip_cost = models.IntegerField(default=0)
+    trip_type = models.CharField(max_length=1, choices=Trip.TRIP_TYPES)
+
+    # Days of week bitmask: Monday = 1, Tuesday = 2, ... Sunday = 64
+    DAY_BITS = [('Mon', 1), ('Tue', 2), ('Wed', 4), ('Thu', 8), ('Fri', 16), ('Sat', 32), ('Sun', 64)]
+    EVERY_DAY = 127
+    WEEKDAYS = 31
+    days_of_week = models.PositiveSmallIntegerField(default=EVERY_DAY, help_text="Bitmask: Mon=1, Tue=2, Wed=4, Thu=8, Fri=16, Sat=32, Sun=64")
+
+    valid_from = models.DateField()
+    valid_until = models.DateField(null=True, blank=True, help_text="Leave blank to run indefinitely")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        # Materialized trips need an L_Trip/I_Trip row, so the route and train must match the trip type
+        series = {'L': 'S', 'I': 'A'}.get(self.trip_type)
+        if self.route_id and self.route.route_type != self.trip_type:
+            raise ValidationError({'route': "Route type must match the trip type."})
+        if self.train_id and self.train.train_series != series:
+            raise ValidationError({'train': "Local trips need an S-Series train; inter-town trips need an A-Series train."})
+
+        # Every departure over the coming year must fit the train's trips and other patterns
+        from .conflicts import conflicts_for_pattern
+        conflicts = conflicts_for_pattern(self)
+        if conflicts:
+            messages = [f"{c.kind.title()}: {c.second} {c.detail}" for c in conflicts[:5]]
+            if len(conflicts) > 5:
+                messages.append(f"... and {len(conflicts) - 5} more conflicts.")
+            raise ValidationError({'train': messages})
+
+    def runs_on(self, day, exception_type=None):
+        """
+        True if the pattern operates on the given date, after applying an exception
+        ('Cancelled' or 'Extra') for that date if there is one.
+        """
+        if exception_type == 'Cancelled':
+            return False
+        if exception_type == 'Extra':
+            return True
+        if day < self.valid_from or (self.valid_until and day > self.valid_until):
+            return False
+        return bool(self.days_of_week & (1 << day.weekday()))
+
+    def trip_id_for(self, day):
+        """
+        Deterministic Trip ID for this pattern on a date: YYYYMMDD + 'P' + pattern number.
+        """
+        return f"{day.strftime('%Y%m%d')}P{self.pk:04d}"
+
+    @property
+    def days_display(self):
+        return ", ".join(name for name, bit in self.DAY_BITS if self.days_of_week & bit) or "-"
+
+    def __str__(self):
+        return f"Pattern {self.pk}: Route {self.route_id} at {self.departure_time:%H:%M} ({self.days_display})"
+
+
+class Service_Exception(models.Model):
+    """
+    Represents a one-off change to a Service_Pattern on a single date.
+    """
+    service_pattern = models.ForeignKey(Service_Pattern, on_delete=models.CASCADE, related_name='exceptions')
+    date = models.DateField()
+
+    EXCEPTION_TYPES = [
+        ('Cancelled', 'Cancelled'),
+        ('Extra', 'Extra'),
+    ]
+    exception_type = models.CharField(max_length=10, choices=EXCEPTION_TYPES)
+
+    class Meta:
+        unique_together = ('service_pattern', 'date')
+
+    def __str__(self):
+        return f"{self.service_pattern} - {self.exception_type} on {self.date}"
+
+
 class Customer(models.Model):
     """
     Stores information about the customers of Tirian Trains who purchase the tickets.
@@ -340,8 +568,9 @@ class Customer(models.Model):
     birth_date = models.DateField()
     gender = models.CharField(max_length=20, null=True, blank=True)
 
-    # Profile picture field
+    # Profile picture field (content-addressed original, see apps/home/images.py)
     profile_picture = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    profile_picture_ready = models.BooleanField(default=False, help_text="True once thumbnails have been generated")
 
     def save(self, *args, **kwargs):
         """
@@ -373,6 +602,7 @@ class Customer(models.Model):
                     break # Break out of loop if save is successful
                 except IntegrityError:
                     # ID collision occurred, increment and try again
+                    ID_ALLOCATION_RETRIES.labels('Customer').inc()
                     new_seq += 1
         else:
             # Standard save if ID already exists
@@ -398,8 +628,17 @@ class Ticket(models.Model):
     trip_date = models.DateField()
     total_cost = models.IntegerField(default=0, editable=False)
 
-    # Relationship: Ticket includes Trip (Many-to-Many)
-    trips = models.ManyToManyField(Trip, related_name='tickets')
+    # Set by cancel(); gates reject the ticket's token from then on
+    cancelled_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Relationship: Ticket includes Trip (Many-to-Many), at the fare each trip was sold for
+    trips = models.ManyToManyField(Trip, related_name='tickets', through='Ticket_Trip')
+
+    class Meta:
+        indexes = [
+            # Ticket history: a customer's upcoming or past tickets, in trip date order
+            models.Index(fields=['customer', 'trip_date', 'ticket_id'], name='ticket_customer_trip_date_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.ticket_id:
@@ -407,16 +646,7 @@ class Ticket(models.Model):
                 self.purchase_date = datetime.date.today()
 
             today_str = self.purchase_date.strftime('%Y%m%d')
-            last_ticket = Ticket.objects.filter(ticket_id__startswith=today_str).order_by('ticket_id').last()
-            
-            if last_ticket:
-                try:
-                    last_seq = int(last_ticket.ticket_id[-4:])
-                    new_seq = last_seq + 1
-                except ValueError:
-                    new_seq = 1
-            else:
-                new_seq = 1
+            new_seq = Ticket.next_sequence(self.purchase_date)
             
             # Retry loop for concurrent ticket purchases
             while True:
@@ -427,29 +657,218 @@ class Ticket(models.Model):
                     break # Break out of loop if save is successful
                 except IntegrityError:
                     # ID collision occurred, increment and try again
+                    ID_ALLOCATION_RETRIES.labels('Ticket').inc()
                     new_seq += 1
         else:
             # Standard save if ID already exists
             super(Ticket, self).save(*args, **kwargs)
 
+    @staticmethod
+    def next_sequence(purchase_date):
+        """
+        The next free ticket sequence number for tickets bought on purchase_date.
+        """
+        last_ticket = Ticket.objects.filter(ticket_id__startswith=purchase_date.strftime('%Y%m%d')).order_by('ticket_id').last()
+        if last_ticket:
+            try:
+                return int(last_ticket.ticket_id[-4:]) + 1
+            except ValueError:
+                pass
+        return 1
+
     def calculate_total_cost(self):
         """
-        Sums the cost of all associated trips and updates the total_cost field.
+        Recomputes total_cost in the database (one aggregate UPDATE, or the PostgreSQL
+        trigger already did it) and reloads it onto this instance.
+        """
+        from .ticket_totals import refresh_totals, totals_maintained_by_database
+        if not totals_maintained_by_database(self._state.db or 'default'):
+            refresh_totals(Ticket.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['total_cost'])
+
+    @property
+    def token(self):
+        """
+        The signed token shown as the ticket's QR code (see ticket_tokens.py).
+        """
+        from .ticket_tokens import issue_token
+        return issue_token(self)
+
+    def cancel(self):
+        """
+        Cancels the ticket, then (once committed) republishes the gates' revocation
+        filter and offers the freed seats to the waitlists.
         """
-        current_total = sum(trip.trip_cost for trip in self.trips.all())
-        self.total_cost = current_total
-        self.save()
+        from .ticket_tokens import publish_revocations
+        from .tasks import promote_waitlisted_customers
+        if self.cancelled_at is None:
+            self.cancelled_at = timezone.now()
+            self.save(update_fields=['cancelled_at'])
+            transaction.on_commit(publish_revocations)
+            # The freed seats go to the trips' waitlists
+            transaction.on_commit(lambda: promote_waitlisted_customers.delay())  # type: ignore
 
     def __str__(self):
         return f"Ticket {self.ticket_id} for {self.customer.last_name}"
 
 
+class Ticket_Trip(models.Model):
+    """
+    A trip on a ticket. Price is the trip's fare when it was added, so repricing
+    a trip never changes tickets already sold; total_cost is the sum of these prices.
+    """
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
+    # Filled from trip_cost when the link is created (by a trigger on PostgreSQL)
+    price = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'home_ticket_trips'
+        unique_together = ('ticket', 'trip')
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price = self.trip.trip_cost
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.ticket_id} - {self.trip_id} ({self.price})"
+
+
+class Booking_Request(models.Model):
+    """
+    Represents a queued ticket purchase. The client-supplied idempotency key
+    always maps to the same request (and therefore the same ticket), so retried
+    POSTs never create duplicate tickets.
+    """
+    idempotency_key = models.CharField(max_length=64, help_text="Client-supplied, unique per customer")
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='booking_requests')
+
+    trip_date = models.DateField()
+    trips = models.ManyToManyField(Trip, related_name='booking_requests')
+
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Completed', 'Completed'),
+        ('Failed', 'Failed'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+
+    # Filled in by the booking worker once the ticket exists
+    ticket = models.OneToOneField(Ticket, on_delete=models.SET_NULL, null=True, blank=True, related_name='booking_request')
+    error = models.CharField(max_length=255, blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('customer', 'idempotency_key')
+
+    def __str__(self):
+        return f"Booking {self.idempotency_key} ({self.status})"
+
+
+class Waitlist_Entry(models.Model):
+    """
+    A customer queued for a sold-out trip. Each trip's queue is served first come,
+    first served (by id) as seats free up; see waitlist.py.
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='waitlist_entries')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='waitlist_entries')
+
+    STATUS_CHOICES = [
+        ('Waiting', 'Waiting'),
+        ('Promoted', 'Promoted'),
+        ('Expired', 'Expired'),
+        ('Left', 'Left'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Waiting')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Entries lapse after WAITLIST_EXPIRY_HOURS, and at departure at the latest
+    expires_at = models.DateTimeField()
+
+    # Filled in when a seat is issued
+    ticket = models.OneToOneField(Ticket, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry')
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Only waiting entries are ever scanned, so the indexes skip the (growing) history
+        indexes = [
+            models.Index(fields=['trip', 'id'], condition=models.Q(status='Waiting'), name='waitlist_queue_idx'),
+            models.Index(fields=['expires_at'], condition=models.Q(status='Waiting'), name='waitlist_expiry_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'customer'], condition=models.Q(status='Waiting'), name='waitlist_one_entry_per_customer'),
+        ]
+
+    def __str__(self):
+        return f"Waitlist {self.trip_id} for {self.customer_id} ({self.status})"
+
+
+class Schedule_Change(models.Model):
+    """
+    A delay, retiming or cancellation of an upcoming trip with tickets sold on it,
+    recorded by the Trip signals and fanned out to the ticket holders by
+    notify_schedule_change (see apps/home/notifications.py).
+    """
+    # Not a foreign key: cancelling a trip deletes it, and the record outlives it
+    trip_id = models.CharField(max_length=20)
+
+    KIND_CHOICES = [
+        ('Delayed', 'Delayed'),
+        ('Retimed', 'Retimed'),
+        ('Cancelled', 'Cancelled'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+
+    old_schedule_day = models.DateField()
+    old_departure_time = models.TimeField()
+    old_arrival_time = models.TimeField()
+    # Blank for cancellations
+    new_schedule_day = models.DateField(null=True, blank=True)
+    new_departure_time = models.TimeField(null=True, blank=True)
+    new_arrival_time = models.TimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # The fan-out walks recipients in customer ID order and resumes after this one
+    queued_through = models.CharField(max_length=4, blank=True, editable=False)
+    fanned_out_at = models.DateTimeField(null=True, blank=True, editable=False)
+    recipients = models.IntegerField(default=0, editable=False, help_text="Customers queued for a notice")
+    notified = models.IntegerField(default=0, editable=False, help_text="Customers sent a notice")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip_id', '-created_at'], name='schedule_change_trip_idx'),
+        ]
+
+    def __str__(self):
+        return f"Trip {self.trip_id} {self.kind.lower()} ({self.created_at:%Y-%m-%d %H:%M})"
+
+
+class Schedule_Change_Recipient(models.Model):
+    """
+    A customer to notify of a schedule change, copied from the trip's ticket holders
+    in one INSERT ... SELECT: when the fan-out starts, or for a cancellation before
+    the trip's ticket links are deleted with it.
+    """
+    change = models.ForeignKey(Schedule_Change, on_delete=models.CASCADE, related_name='notice_recipients')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('change', 'customer')
+
+
 class Task(models.Model):
     """
     Represents individual tasks performed during maintenance.
     """
     task_name = models.CharField(max_length=50, primary_key=True)
 
+    # How often the task must be repeated on each train; blank = not scheduled
+    interval_days = models.PositiveIntegerField(null=True, blank=True, help_text="Days between repeats. Leave blank if not recurring.")
+
     def __str__(self):
         return self.task_name
 
@@ -528,6 +947,7 @@ class Maintenance_Log(models.Model):
                     break # Break out of loop if save is successful
                 except IntegrityError:
                     # ID collision occurred, increment and try again
+                    ID_ALLOCATION_RETRIES.labels('Maintenance_Log').inc()
                     new_seq += 1
         else:
             # Standard save if ID already exists
@@ -553,14 +973,275 @@ class Log_Task(models.Model):
         return f"{self.log} - {self.task}"
 
 
+class Maintenance_Due(models.Model):
+    """
+    Precomputed index of when each task was last performed on each train and
+    when it is next due. Kept up to date incrementally from Log_Task saves.
+    """
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='maintenance_due')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='maintenance_due')
+
+    last_performed = models.DateField()
+    last_log = models.ForeignKey(Maintenance_Log, on_delete=models.SET_NULL, null=True, related_name='+')
+
+    # last_performed + task.interval_days; null for non-recurring tasks
+    due_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('train', 'task')
+        indexes = [
+            models.Index(fields=['due_date'], name='maintenance_due_date_idx'),
+        ]
+
+    @property
+    def is_overdue(self):
+        return self.due_date is not None and self.due_date < datetime.date.today()
+
+    def __str__(self):
+        return f"{self.task} on {self.train} due {self.due_date or '-'}"
+
+
+class Job_Run(models.Model):
+    """
+    One run of a Celery task, recorded by the task signals in profiling.py: how
+    long it took, the queries it issued, the rows they changed and the memory it
+    grew by, with a cProfile report when the run was slow.
+    """
+    task_id = models.CharField(max_length=64)
+    task_name = models.CharField(max_length=200)
+
+    STATE_CHOICES = [
+        ('SUCCESS', 'Success'),
+        ('FAILURE', 'Failure'),
+        ('RETRY', 'Retry'),
+    ]
+    state = models.CharField(max_length=10, choices=STATE_CHOICES)
+    result = models.CharField(max_length=255, blank=True, default='', help_text="Return value or exception, truncated")
+
+    started_at = models.DateTimeField()
+    duration = models.FloatField(help_text="Seconds")
+    query_count = models.IntegerField(default=0)
+    rows_affected = models.IntegerField(default=0, help_text="Rows inserted, updated or deleted")
+    max_rss_kb = models.IntegerField(default=0, help_text="Worker peak resident memory after the run")
+    rss_growth_kb = models.IntegerField(default=0, help_text="How far the run raised the worker's peak memory")
+
+    # pstats report, kept only for runs slower than TASK_PROFILE_SECONDS
+    profile = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task_name', '-started_at'], name='job_run_task_idx'),
+            models.Index(fields=['-duration'], name='job_run_duration_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name} at {self.started_at:%Y-%m-%d %H:%M} ({self.duration:.2f}s)"
+
+
+class Request_Profile(models.Model):
+    """
+    A profiled web request (see RequestProfilerMiddleware): where its profile and
+    collapsed stacks were written, and a readable summary of the hot functions.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status_code = models.IntegerField()
+    duration = models.FloatField(help_text="Seconds, including profiling overhead")
+    query_count = models.IntegerField(default=0)
+
+    TRIGGER_CHOICES = [
+        ('header', 'Header'),
+        ('param', 'Query parameter'),
+        ('sample', 'Random sample'),
+    ]
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+
+    MODE_CHOICES = [
+        ('cprofile', 'cProfile + stack sampler'),
+        ('sample', 'Stack sampler'),
+    ]
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+
+    profile_file = models.CharField(max_length=500, blank=True, default='', help_text="cProfile dump (pstats / snakeviz)")
+    stacks_file = models.CharField(max_length=500, help_text="Collapsed stacks (flamegraph.pl / speedscope)")
+    summary = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='request_profile_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} at {self.created_at:%Y-%m-%d %H:%M} ({self.duration:.2f}s)"
+
+
 # ------------------------------------------------------------------
 # DJANGO SIGNALS
 # ------------------------------------------------------------------
 @receiver(m2m_changed, sender=Ticket.trips.through)
-def update_ticket_cost(sender, instance, action, **kwargs):
+def update_ticket_cost(sender, instance, action, reverse, pk_set, **kwargs):
     """
     Listens for any trips being added to or removed from a Ticket.
-    Automatically recalculates the total cost when a change is detected.
+    Stamps added trips with their current fare, then recalculates the total cost.
+    """
+    from .ticket_totals import price_links, refresh_totals, totals_maintained_by_database
+    maintained = totals_maintained_by_database(instance._state.db or 'default')
+
+    if not reverse:
+        if action == 'post_add' and not maintained:
+            price_links(Ticket_Trip.objects.filter(ticket=instance, trip_id__in=pk_set))
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            instance.calculate_total_cost()
+        return
+
+    # trip.tickets.add()/remove()/clear(): instance is the Trip
+    if maintained:
+        return
+    if action == 'pre_clear':
+        instance._cleared_ticket_ids = list(instance.tickets.values_list('pk', flat=True))
+    elif action == 'post_add':
+        price_links(Ticket_Trip.objects.filter(trip=instance, ticket_id__in=pk_set))
+        refresh_totals(Ticket.objects.filter(pk__in=pk_set))
+    elif action == 'post_remove':
+        refresh_totals(Ticket.objects.filter(pk__in=pk_set))
+    elif action == 'post_clear':
+        refresh_totals(Ticket.objects.filter(pk__in=getattr(instance, '_cleared_ticket_ids', [])))
+
+
+@receiver([post_save, post_delete], sender=Ticket_Trip)
+def update_ticket_cost_for_link(sender, instance, **kwargs):
+    """
+    Links saved one at a time (the ticket admin's inline) bypass m2m_changed.
+    """
+    from .ticket_totals import refresh_totals, totals_maintained_by_database
+    if not totals_maintained_by_database(kwargs.get('using') or 'default'):
+        refresh_totals(Ticket.objects.filter(pk=instance.ticket_id))
+
+
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=Route)
+@receiver([post_save, post_delete], sender=L_Route)
+@receiver([post_save, post_delete], sender=I_Route)
+@receiver([post_save, post_delete], sender=Train)
+@receiver([post_save, post_delete], sender=Service_Pattern)
+@receiver([post_save, post_delete], sender=Service_Exception)
+def invalidate_trip_fragments(sender, **kwargs):
+    """
+    Trip cards render station names and train numbers, so edits to those
+    tables retire every cached trip fragment (and the network snapshot) at once.
+    Bumped again on commit, so anything rebuilt from the uncommitted rows in
+    between is retired too.
+    """
+    bump_schedule_version()
+    transaction.on_commit(bump_schedule_version)
+
+
+@receiver(pre_save, sender=Trip)
+def remember_trip_schedule(sender, instance, raw=False, update_fields=None, using=None, **kwargs):
+    """
+    Loads the stored day and times of an edited trip, for record_schedule_change.
     """
-    if action in ['post_add', 'post_remove', 'post_clear']:
-        instance.calculate_total_cost()
\ No newline at end of file
+    from .notifications import SCHEDULE_FIELDS
+    instance._stored_schedule = None
+    if raw or instance._state.adding or (update_fields is not None and not set(update_fields) & set(SCHEDULE_FIELDS)):
+        return
+    instance._stored_schedule = Trip.objects.using(using).filter(pk=instance.pk).values_list(*SCHEDULE_FIELDS).first()
+
+
+@receiver(post_save, sender=Trip)
+def record_schedule_change(sender, instance, created, **kwargs):
+    """
+    Delays and retimings of upcoming trips are recorded and fanned out to the
+    ticket holders on commit; the save itself only pays two small queries.
+    """
+    from .notifications import record_change
+    stored = getattr(instance, '_stored_schedule', None)
+    instance._stored_schedule = None
+    if stored is not None and not created:
+        record_change(instance, stored)
+
+
+@receiver(pre_delete, sender=Trip)
+def record_trip_cancellation(sender, instance, **kwargs):
+    from .notifications import record_cancellation
+    record_cancellation(instance)
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def index_trip_on_boards(sender, instance, **kwargs):
+    """
+    Keeps the station departure boards (apps/home/boards.py) in step with trip edits.
+    """
+    from .boards import index_trips
+    trip_id = instance.trip_id
+    transaction.on_commit(lambda: index_trips([trip_id]))
+
+
+@receiver([post_save, post_delete], sender=Service_Pattern)
+@receiver([post_save, post_delete], sender=Service_Exception)
+def index_pattern_on_boards(sender, instance, **kwargs):
+    from .boards import index_pattern
+    pattern_pk = instance.service_pattern_id if sender is Service_Exception else instance.pk
+    transaction.on_commit(lambda: index_pattern(pattern_pk))
+
+
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=L_Route)
+@receiver([post_save, post_delete], sender=I_Route)
+@receiver([post_save, post_delete], sender=Train)
+def refresh_boards_on_network_change(sender, **kwargs):
+    """
+    Board entries carry station names and train numbers, so network edits refresh every
+    board: once per burst, on a worker.
+    """
+    from .boards import queue_rebuild
+    transaction.on_commit(queue_rebuild)
+
+
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=L_Route)
+@receiver([post_save, post_delete], sender=I_Route)
+@receiver([post_save, post_delete], sender=Service_Pattern)
+def refresh_travel_matrix_on_network_change(sender, **kwargs):
+    """
+    Queues one incremental travel matrix refresh per burst of topology edits.
+    """
+    from .travel_matrix import queue_refresh
+    transaction.on_commit(queue_refresh)
+
+
+@receiver(post_save, sender=Log_Task)
+def index_log_task(sender, instance, **kwargs):
+    """
+    A task was recorded on a log: move that (train, task) pair forward if this is its latest run.
+    """
+    from .maintenance import record_task_performed
+    record_task_performed(instance.log, instance.task)
+
+
+@receiver(post_delete, sender=Log_Task)
+def unindex_log_task(sender, instance, **kwargs):
+    from .maintenance import refresh_due_entry
+    log = Maintenance_Log.objects.filter(pk=instance.log_id).first()
+    if log and log.train_id:
+        refresh_due_entry(log.train_id, instance.task_id)
+
+
+@receiver(post_save, sender=Maintenance_Log)
+def reindex_maintenance_log(sender, instance, created, **kwargs):
+    """
+    Editing an existing log's date or train can change which run is the latest.
+    """
+    if created:
+        return
+    from .maintenance import refresh_log_entries
+    refresh_log_entries(instance)
+
+
+@receiver(post_save, sender=Task)
+def reschedule_task(sender, instance, **kwargs):
+    from .maintenance import recompute_due_dates
+    recompute_due_dates(instance)
@@ -0,0 +1,243 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from .caching import get_schedule_version
+
+MAGIC = b'TNET'
+FORMAT_VERSION = 1
+
+# magic, format, schedule version, stations, routes, trains, route-train assignments, strings
+_HEADER = struct.Struct('<4sIqIIIII')
+
+# int32 arrays in file order, with their lengths in terms of the header counts
+# (s: stations, r: routes, t: trains, a: assignments, n: strings)
+_ARRAYS = (
+    ('station_id', 's'), ('station_name', 's'), ('station_type', 's'), ('station_by_name', 's'),
+    ('out_offsets', 's+1'), ('out_routes', 'r'), ('out_targets', 'r'),
+    ('in_offsets', 's+1'), ('in_routes', 'r'), ('in_sources', 'r'),
+    ('route_id', 'r'), ('route_type', 'r'), ('route_origin', 'r'), ('route_desti', 'r'),
+    ('train_offsets', 'r+1'), ('train_list', 'a'),
+    ('train_id', 't'), ('train_number', 't'),
+    ('string_offsets', 'n+1'),
+)
+
+
+def _length(spec, counts):
+    return counts[spec[0]] + (1 if spec.endswith('+1') else 0)
+
+
+def _csr(count, pairs):
+    """
+    Compressed sparse rows: offsets[i]..offsets[i + 1] index the values of row i.
+    pairs are (row, value) in the order the values should appear.
+    """
+    rows = [[] for _ in range(count)]
+    for row, value in pairs:
+        rows[row].append(value)
+    offsets = array('i', [0])
+    values = array('i')
+    for row in rows:
+        values.extend(row)
+        offsets.append(len(values))
+    return offsets, values
+
+
+def build_network(version):
+    """
+    The topology as a snapshot file's bytes: stations, L_Route / I_Route adjacency
+    in both directions and each route's trains (from its service patterns), with
+    every ID and name stored once in a shared string table. Six queries.
+    """
+    from .models import I_Route, L_Route, Route, Service_Pattern, Station, Train
+
+    strings = {}
+
+    def intern(value):
+        return strings.setdefault(value, len(strings))
+
+    stations = sorted(Station.objects.values_list('station_id', 'station_name', 'station_type'))
+    station_index = {station_id: i for i, (station_id, _, _) in enumerate(stations)}
+    routes = sorted(Route.objects.values_list('route_id', 'route_type'))
+    route_index = {route_id: i for i, (route_id, _) in enumerate(routes)}
+    trains = sorted(Train.objects.values_list('train_id', 'train_number'))
+    train_index = {train_id: i for i, (train_id, _) in enumerate(trains)}
+
+    ends = dict.fromkeys(route_index, (-1, -1))
+    for model, prefix in ((L_Route, 'l_route'), (I_Route, 'i_route')):
+        for route_id, origin, desti in model.objects.values_list(f'{prefix}_id', f'{prefix}_origin', f'{prefix}_desti'):
+            ends[route_id] = (station_index[origin], station_index[desti])
+
+    data = {
+        'station_id': array('i', (intern(station_id) for station_id, _, _ in stations)),
+        'station_name': array('i', (intern(name) for _, name, _ in stations)),
+        'station_type': array('i', (ord(station_type or ' ') for _, _, station_type in stations)),
+        'station_by_name': array('i', sorted(range(len(stations)), key=lambda i: (stations[i][1].casefold(), i))),
+        'route_id': array('i', (intern(route_id) for route_id, _ in routes)),
+        'route_type': array('i', (ord(route_type or ' ') for _, route_type in routes)),
+        'route_origin': array('i', (ends[route_id][0] for route_id, _ in routes)),
+        'route_desti': array('i', (ends[route_id][1] for route_id, _ in routes)),
+        'train_id': array('i', (intern(train_id) for train_id, _ in trains)),
+        'train_number': array('i', (intern(number) for _, number in trains)),
+    }
+
+    linked = [(route, ends[route_id]) for route, (route_id, _) in enumerate(routes) if ends[route_id][0] >= 0]
+    data['out_offsets'], data['out_routes'] = _csr(len(stations), ((origin, route) for route, (origin, _) in linked))
+    data['out_targets'] = array('i', (data['route_desti'][route] for route in data['out_routes']))
+    data['in_offsets'], data['in_routes'] = _csr(len(stations), sorted((desti, route) for route, (_, desti) in linked))
+    data['in_sources'] = array('i', (data['route_origin'][route] for route in data['in_routes']))
+
+    assignments = sorted({
+        (route_index[route_id], train_index[train_id])
+        for route_id, train_id in Service_Pattern.objects.values_list('route_id', 'train_id').distinct()
+    })
+    data['train_offsets'], data['train_list'] = _csr(len(routes), assignments)
+
+    blob = bytearray()
+    data['string_offsets'] = array('i', [0])
+    for value in strings:
+        blob += value.encode()
+        data['string_offsets'].append(len(blob))
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, version, len(stations), len(routes), len(trains), len(data['train_list']), len(strings)
+    )
+    return b''.join([header] + [data[name].tobytes() for name, _ in _ARRAYS] + [bytes(blob)])
+
+
+class NetworkSnapshot:
+    """
+    Read-only view of a snapshot buffer (normally a shared memory map). Stations,
+    routes and trains are integer indexes into int32 arrays read in place, so
+    every process on the host shares one copy in the page cache.
+    """
+    def __init__(self, buffer):
+        magic, file_format, self.version, s, r, t, a, n = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError("Not a network snapshot")
+        self._buffer = buffer
+        counts = {'s': s, 'r': r, 't': t, 'a': a, 'n': n}
+        view = memoryview(buffer)
+        position = _HEADER.size
+        for name, spec in _ARRAYS:
+            length = _length(spec, counts)
+            setattr(self, name, view[position:position + 4 * length].cast('i'))
+            position += 4 * length
+        self._strings = view[position:]
+        self.station_count, self.route_count, self.train_count = s, r, t
+
+    def string(self, i):
+        return str(self._strings[self.string_offsets[i]:self.string_offsets[i + 1]], 'utf-8')
+
+    def station_index(self, station_id):
+        i = bisect_left(range(self.station_count), station_id, key=lambda i: self.string(self.station_id[i]))
+        if i < self.station_count and self.string(self.station_id[i]) == station_id:
+            return i
+        return None
+
+    def stations_named(self, name):
+        """
+        Indexes of the stations with this name, ignoring case.
+        """
+        key = lambda j: self.string(self.station_name[self.station_by_name[j]]).casefold()  # noqa: E731
+        name = name.casefold()
+        lo = bisect_left(range(self.station_count), name, key=key)
+        hi = bisect_right(range(self.station_count), name, lo=lo, key=key)
+        return [self.station_by_name[j] for j in range(lo, hi)]
+
+    def find_stations(self, value):
+        """
+        Indexes of the stations matching a station ID or name (any case).
+        """
+        i = self.station_index(value)
+        return ([i] if i is not None else []) + [j for j in self.stations_named(value) if j != i]
+
+    def station(self, i):
+        return self.string(self.station_id[i]), self.string(self.station_name[i]), chr(self.station_type[i])
+
+    def routes_from(self, i):
+        return self.out_routes[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def routes_to(self, i):
+        return self.in_routes[self.in_offsets[i]:self.in_offsets[i + 1]]
+
+    def neighbours(self, i):
+        return self.out_targets[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def route(self, i):
+        return self.string(self.route_id[i]), chr(self.route_type[i]), self.route_origin[i], self.route_desti[i]
+
+    def route_trains(self, i):
+        """
+        Train numbers running route i on its service patterns.
+        """
+        return [self.string(self.train_number[t]) for t in self.train_list[self.train_offsets[i]:self.train_offsets[i + 1]]]
+
+    def station_route_ids(self, value, end):
+        """
+        IDs of the routes starting (end='origin') or ending (end='destination') at
+        the stations matching value; search.station_routes() without a query.
+        """
+        routes = self.routes_from if end == 'origin' else self.routes_to
+        return {self.string(self.route_id[route]) for i in self.find_stations(value) for route in routes(i)}
+
+
+def snapshot_path():
+    return settings.NETWORK_SNAPSHOT_PATH
+
+
+def write_network_snapshot(version=None, path=None):
+    """
+    Builds the snapshot and swaps it into place atomically: processes still
+    mapping the previous file keep reading it until they notice the new version.
+    """
+    version = get_schedule_version() if version is None else version
+    path = path or snapshot_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(build_network(version))
+    os.replace(temp_path, path)
+    return version
+
+
+def load_network_snapshot(path=None):
+    """
+    Maps the snapshot file read-only; None when it is missing or unreadable.
+    """
+    try:
+        with open(path or snapshot_path(), 'rb') as f:
+            return NetworkSnapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+_network = None
+
+
+def get_network(version=None):
+    """
+    This process's mapped snapshot for the current schedule version (pass it when
+    already known). A newer version remaps the file, which is rebuilt first if no
+    other process has written it yet; station, route, train and service pattern
+    edits bump the version.
+    """
+    global _network
+    version = get_schedule_version() if version is None else version
+    if _network is not None and _network.version == version:
+        return _network
+
+    network = load_network_snapshot()
+    if network is None or network.version != version:
+        try:
+            write_network_snapshot(version)
+            network = load_network_snapshot()
+        except OSError:
+            network = None
+        if network is None or network.version != version:
+            # Unwritable path: keep a private in-memory copy rather than fail the request
+            network = NetworkSnapshot(build_network(version))
+    _network = network
+    return _network
@@ -0,0 +1,162 @@
+import datetime
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Customer, Schedule_Change, Schedule_Change_Recipient, Ticket_Trip
+
+SCHEDULE_FIELDS = ('schedule_day', 'departure_time', 'arrival_time')
+
+# Customers per notice task
+NOTICE_BATCH_SIZE = 500
+
+
+def holders(trip_id):
+    """
+    Distinct customers holding a live ticket for the trip, deduplicated by the
+    database and read from the Ticket.trips through table.
+    """
+    return (
+        Ticket_Trip.objects.filter(trip_id=trip_id, ticket__cancelled_at__isnull=True)
+        .order_by('ticket__customer_id').values_list('ticket__customer_id', flat=True).distinct()
+    )
+
+
+def classify(stored, current):
+    """
+    'Delayed' when the trip now departs later, 'Retimed' for any other change of
+    day or times, None when nothing changed.
+    """
+    if tuple(stored) == tuple(current):
+        return None
+    before = datetime.datetime.combine(stored[0], stored[1])
+    after = datetime.datetime.combine(current[0], current[1])
+    return 'Delayed' if after > before else 'Retimed'
+
+
+def _queue_fan_out(change):
+    from .tasks import notify_schedule_change
+    change_pk = change.pk
+    transaction.on_commit(lambda: notify_schedule_change.delay(change_pk))  # type: ignore
+
+
+def record_change(trip, stored, today=None):
+    """
+    Records a delay or retiming of an upcoming trip that has ticket holders and
+    queues the fan-out once the edit commits.
+    """
+    current = tuple(getattr(trip, field) for field in SCHEDULE_FIELDS)
+    kind = classify(stored, current)
+    today = today or datetime.date.today()
+    if kind is None or trip.is_archived or max(stored[0], current[0]) < today:
+        return None
+    if not holders(trip.pk).exists():
+        return None
+    change = Schedule_Change.objects.create(
+        trip_id=trip.pk, kind=kind,
+        old_schedule_day=stored[0], old_departure_time=stored[1], old_arrival_time=stored[2],
+        new_schedule_day=current[0], new_departure_time=current[1], new_arrival_time=current[2],
+    )
+    _queue_fan_out(change)
+    return change
+
+
+def record_cancellation(trip, today=None):
+    """
+    Records the deletion of an upcoming trip. Its ticket links go with it, so the
+    holders are copied to Schedule_Change_Recipient first, inside the database.
+    """
+    today = today or datetime.date.today()
+    if trip.is_archived or trip.schedule_day < today:
+        return None
+    if not holders(trip.pk).exists():
+        return None
+    change = Schedule_Change.objects.create(
+        trip_id=trip.pk, kind='Cancelled',
+        old_schedule_day=trip.schedule_day, old_departure_time=trip.departure_time, old_arrival_time=trip.arrival_time,
+    )
+    snapshot_holders(change)
+    _queue_fan_out(change)
+    return change
+
+
+def snapshot_holders(change):
+    """
+    Copies the trip's current holders to the change's recipients in one
+    INSERT ... SELECT, so they never pass through Python.
+    """
+    sql, params = holders(change.trip_id).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Schedule_Change_Recipient._meta.db_table} (change_id, customer_id) "
+            f"SELECT %s, customer_id FROM ({sql}) holders",
+            [change.pk, *params]
+        )
+
+
+def fan_out(change_pk, batch_size=NOTICE_BATCH_SIZE):
+    """
+    Queues one notice task per batch_size recipients, paging through the change's
+    recipients by customer ID so memory stays flat however many tickets were sold.
+    Each batch is queued and the change's cursor (queued_through) advanced under a
+    lock on the change, so a crashed or redelivered fan-out resumes after the last
+    batch queued: at worst the batch in flight during a crash is sent twice, none
+    is lost. Returns the customers queued, or None if already fanned out.
+    """
+    from .tasks import send_schedule_change_notices
+
+    with transaction.atomic():
+        change = Schedule_Change.objects.select_for_update().get(pk=change_pk)
+        if change.fanned_out_at is not None:
+            return None
+        if change.kind != 'Cancelled' and not change.queued_through and not change.notice_recipients.exists():
+            # Delays and retimings go to whoever holds a ticket when the fan-out starts
+            snapshot_holders(change)
+
+    while True:
+        with transaction.atomic():
+            change = Schedule_Change.objects.select_for_update().get(pk=change_pk)
+            if change.fanned_out_at is not None:
+                return None
+            batch = list(
+                change.notice_recipients.filter(customer_id__gt=change.queued_through)
+                .order_by('customer_id').values_list('customer_id', flat=True)[:batch_size]
+            )
+            if batch:
+                send_schedule_change_notices.delay(change_pk, batch)  # type: ignore
+                change.queued_through = batch[-1]
+                change.recipients += len(batch)
+            if len(batch) < batch_size:
+                change.fanned_out_at = timezone.now()
+            change.save(update_fields=['queued_through', 'recipients', 'fanned_out_at'])
+        if change.fanned_out_at is not None:
+            return change.recipients
+
+
+def notice(change, customer):
+    """
+    (subject, message) telling one customer about the change.
+    """
+    was = f"{change.old_schedule_day:%d %b} at {change.old_departure_time:%H:%M}"
+    if change.kind == 'Cancelled':
+        subject = f"Tirian Trains: Trip {change.trip_id} is cancelled"
+        detail = f"Your trip {change.trip_id} departing {was} has been cancelled."
+    else:
+        subject = f"Tirian Trains: Trip {change.trip_id} is {change.kind.lower()}"
+        detail = (
+            f"Your trip {change.trip_id} departing {was} now departs {change.new_schedule_day:%d %b} at "
+            f"{change.new_departure_time:%H:%M} and arrives at {change.new_arrival_time:%H:%M}."
+        )
+    return subject, f"Hello {customer.given_name},\n\n{detail}\n\nWe apologise for the disruption."
+
+
+def send_notices(change_pk, customer_ids):
+    """
+    Builds one batch's notices in a single query and counts them as sent.
+    """
+    change = Schedule_Change.objects.get(pk=change_pk)
+    customers = Customer.objects.filter(customer_id__in=customer_ids).only('customer_id', 'given_name')
+    messages = [notice(change, customer) for customer in customers]
+    print(f"ASYNC ACTION: Dispatching {len(messages)} schedule change notices for Trip {change.trip_id}")
+    # send_mass_mail([(subject, message, settings.DEFAULT_FROM_EMAIL, [customer.user.email]) ...])
+    Schedule_Change.objects.filter(pk=change_pk).update(notified=F('notified') + len(messages))
+    return len(messages)
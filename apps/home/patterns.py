@@ -0,0 +1,191 @@
+import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .models import Trip, L_Trip, I_Trip, Service_Pattern, Service_Exception, compute_durations
+
+PATTERN_TRIP_SELECT_RELATED = (
+    'train',
+    'route__local_route_info__l_route_origin__l_station_id',
+    'route__local_route_info__l_route_desti__l_station_id',
+    'route__intertown_route_info__i_route_origin__i_station_id',
+    'route__intertown_route_info__i_route_desti__i_station_id',
+)
+
+
+def booking_horizon():
+    """
+    Number of days ahead that service patterns are offered for booking.
+    """
+    return getattr(settings, 'SERVICE_PATTERN_HORIZON_DAYS', 14)
+
+
+def _daterange(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def pattern_departures(start, end, trip_type=None, include_materialized=False, route_ids=None, train_ids=None):
+    """
+    Lazily yields (pattern, day) for every pattern departure between start and
+    end (inclusive), optionally only on the given routes or trains. Costs three
+    queries regardless of the window: patterns, their exceptions, and the trips
+    that already exist.
+    """
+    patterns = Service_Pattern.objects.select_related(*PATTERN_TRIP_SELECT_RELATED).filter(valid_from__lte=end)
+    patterns = patterns.exclude(valid_until__lt=start)
+    if trip_type:
+        patterns = patterns.filter(trip_type=trip_type)
+    if route_ids is not None:
+        patterns = patterns.filter(route_id__in=route_ids)
+    if train_ids is not None:
+        patterns = patterns.filter(train_id__in=train_ids)
+    patterns = list(patterns)
+    if not patterns:
+        return
+
+    exceptions = {
+        (e.service_pattern_id, e.date): e.exception_type
+        for e in Service_Exception.objects.filter(service_pattern__in=patterns, date__range=(start, end))
+    }
+    materialized = set()
+    if not include_materialized:
+        materialized = set(Trip.objects.filter(
+            service_pattern__in=patterns, schedule_day__range=(start, end)
+        ).values_list('trip_id', flat=True))
+
+    for day in _daterange(start, end):
+        for pattern in patterns:
+            if not pattern.runs_on(day, exceptions.get((pattern.pk, day))):
+                continue
+            if pattern.trip_id_for(day) in materialized:
+                continue
+            yield pattern, day
+
+
+def expand_patterns(start, end, **filters):
+    """
+    Lazily yields unsaved Trip instances for every pattern departure between
+    start and end (inclusive); takes pattern_departures()'s filters.
+    """
+    for pattern, day in pattern_departures(start, end, **filters):
+        yield _trip_from_pattern(pattern, day)
+
+
+def _trip_from_pattern(pattern, day):
+    trip = Trip(
+        trip_id=pattern.trip_id_for(day),
+        route=pattern.route,
+        train=pattern.train,
+        service_pattern=pattern,
+        departure_time=pattern.departure_time,
+        arrival_time=pattern.arrival_time,
+        schedule_day=day,
+        trip_cost=pattern.trip_cost,
+        trip_type=pattern.trip_type,
+    )
+    trip.duration = compute_durations([pattern.departure_time], [pattern.arrival_time])[0]
+    return trip
+
+
+def parse_pattern_trip_id(trip_id):
+    """
+    Splits a pattern trip ID (YYYYMMDDP####) into (date, pattern_pk), or None.
+    """
+    if len(trip_id) < 10 or trip_id[8] != 'P' or not trip_id[:8].isdigit() or not trip_id[9:].isdigit():
+        return None
+    try:
+        day = datetime.datetime.strptime(trip_id[:8], '%Y%m%d').date()
+    except ValueError:
+        return None
+    return day, int(trip_id[9:])
+
+
+def pattern_departure(trip_id, today=None):
+    """
+    (pattern, day) when trip_id is a pattern departure that runs on a day inside
+    the booking horizon, else None. Reads only; nothing is created.
+    """
+    parsed = parse_pattern_trip_id(trip_id)
+    if not parsed:
+        return None
+    day, pattern_pk = parsed
+    today = today or datetime.date.today()
+    if not today <= day <= today + datetime.timedelta(days=booking_horizon()):
+        return None
+
+    pattern = Service_Pattern.objects.select_related('route', 'train').filter(pk=pattern_pk).first()
+    if not pattern:
+        return None
+    exception = Service_Exception.objects.filter(service_pattern=pattern, date=day).values_list('exception_type', flat=True).first()
+    if not pattern.runs_on(day, exception):
+        return None
+    return pattern, day
+
+
+def materialize_trip(trip_id):
+    """
+    Creates the concrete Trip (and its L_Trip/I_Trip row) for a pattern departure
+    the first time it is booked. Returns the Trip, or None if the ID is neither an
+    existing trip nor a pattern departure inside the booking horizon, or if the
+    departure's train turns out to be busy (Trip.save checks its schedule).
+    """
+    existing = Trip.objects.filter(trip_id=trip_id).first()
+    if existing:
+        return existing
+
+    departure = pattern_departure(trip_id)
+    if not departure:
+        return None
+    pattern, day = departure
+
+    try:
+        with transaction.atomic():
+            trip, created = Trip.objects.get_or_create(
+                trip_id=trip_id,
+                defaults={
+                    'route': pattern.route, 'train': pattern.train, 'service_pattern': pattern,
+                    'departure_time': pattern.departure_time, 'arrival_time': pattern.arrival_time,
+                    'schedule_day': day, 'trip_cost': pattern.trip_cost, 'trip_type': pattern.trip_type,
+                }
+            )
+            if created:
+                if pattern.trip_type == 'L':
+                    L_Trip.objects.get_or_create(l_trip_id=trip, defaults={'s_train_id': pattern.train_id, 'l_route_id': pattern.route_id})
+                else:
+                    I_Trip.objects.get_or_create(i_trip_id=trip, defaults={'a_train_id': pattern.train_id, 'i_route_id': pattern.route_id})
+    except ValidationError:
+        # Conflicts with a trip scheduled after the pattern was validated: not sellable
+        # until the timetable is fixed (check_train_conflicts reports it)
+        return None
+    return trip
+
+
+def materialize_trips(trip_ids):
+    """
+    The Trips for a validated booking form's trip IDs, creating the rows of
+    pattern departures booked for the first time. Call it inside the purchase's
+    transaction, so a purchase that fails leaves no rows behind. None if a
+    departure stopped running after the form was validated.
+    """
+    trips = []
+    for trip_id in trip_ids:
+        trip = materialize_trip(trip_id)
+        if trip is None:
+            return None
+        trips.append(trip)
+    return trips
+
+
+def with_pattern_trips(trips, trip_type=None):
+    """
+    Merges a Trip queryset with the upcoming (not yet materialized) pattern
+    departures inside the booking horizon, ordered by day and departure time.
+    """
+    today = datetime.date.today()
+    virtual = list(expand_patterns(today, today + datetime.timedelta(days=booking_horizon()), trip_type=trip_type))
+    if not virtual:
+        return trips
+    return sorted(list(trips) + virtual, key=lambda t: (t.schedule_day, t.departure_time))
@@ -0,0 +1,163 @@
+import datetime
+from collections import defaultdict, namedtuple
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .boards import index_trips
+from .models import Ticket_Trip, Trip, Trip_Price
+
+# Fares move between these multiples of a trip's base_cost
+PRICE_FLOOR = 0.8
+PRICE_CEILING = 1.6
+
+# Load factor (seats sold / capacity) at which a trip sells at its base fare
+TARGET_LOAD_FACTOR = 0.6
+
+# Fare change per unit of load factor above or below the target, by trip type:
+# inter-town demand is less elastic than local, so it moves more
+LOAD_SENSITIVITY = {'L': 0.5, 'I': 1.0}
+
+# How busy the route's recent departures were, weighted less than the trip's own load
+ROUTE_HISTORY_DAYS = 28
+ROUTE_SENSITIVITY = 0.25
+
+# (max days to departure, multiplier), checked in order; later departures get the early-bird rate
+ADVANCE_PURCHASE = [(2, 1.15), (7, 1.05), (30, 1.0)]
+EARLY_BIRD = 0.9
+
+# Trips per UPDATE / INSERT, well inside every backend's bound parameter limit
+WRITE_CHUNK_SIZE = 500
+
+PricingResult = namedtuple('PricingResult', 'priced changed history')
+
+
+def _chunks(items, size=WRITE_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _seats_sold(trips):
+    """
+    Seats sold per trip ID (cancelled tickets excluded) in one grouped query.
+    """
+    return dict(
+        Ticket_Trip.objects.filter(trip__in=trips, ticket__cancelled_at__isnull=True)
+        .order_by().values('trip_id').annotate(n=Count('*')).values_list('trip_id', 'n')
+    )
+
+
+def route_load_factors(today, days=ROUTE_HISTORY_DAYS):
+    """
+    Mean load factor per route over the departures of the last `days` days,
+    counting only trips with a known capacity.
+    """
+    past = Trip.objects.filter(
+        schedule_day__gte=today - datetime.timedelta(days=days), schedule_day__lt=today, train__train_model__seat_capacity__gt=0
+    )
+    sold = _seats_sold(past)
+    loads = defaultdict(list)
+    for pk, route_id, capacity in past.values_list('pk', 'route_id', 'train__train_model__seat_capacity'):
+        loads[route_id].append(sold.get(pk, 0) / capacity)
+    return {route_id: sum(values) / len(values) for route_id, values in loads.items()}
+
+
+def advance_multipliers(days_to_departure):
+    """
+    The ADVANCE_PURCHASE multiplier for each entry of an array of days to departure.
+    """
+    days_to_departure = np.asarray(days_to_departure)
+    return np.select(
+        [days_to_departure <= max_days for max_days, _ in ADVANCE_PURCHASE],
+        [multiplier for _, multiplier in ADVANCE_PURCHASE], default=EARLY_BIRD,
+    )
+
+
+def demand_prices(base_costs, trip_types, load_factors, route_loads, days_to_departure):
+    """
+    Fares for a batch of trips as numpy column arithmetic: each base_cost scaled
+    by the trip's own load, its route's recent load and how soon it departs,
+    clamped to [PRICE_FLOOR, PRICE_CEILING] x base. Unknown loads are NaN.
+    """
+    load_factors = np.asarray(load_factors, dtype=float)
+    route_loads = np.asarray(route_loads, dtype=float)
+    sensitivity = np.array([LOAD_SENSITIVITY.get(trip_type, 1.0) for trip_type in trip_types], dtype=float)
+
+    multipliers = np.ones(len(load_factors))
+    multipliers += np.where(np.isnan(load_factors), 0.0, sensitivity * (load_factors - TARGET_LOAD_FACTOR))
+    multipliers += np.where(np.isnan(route_loads), 0.0, ROUTE_SENSITIVITY * (route_loads - TARGET_LOAD_FACTOR))
+    multipliers *= advance_multipliers(days_to_departure)
+    multipliers = np.clip(multipliers, PRICE_FLOOR, PRICE_CEILING)
+    return np.maximum(np.round(np.asarray(base_costs, dtype=float) * multipliers), 0).astype(np.int64)
+
+
+def reprice_trips(days=None, today=None, dry_run=False):
+    """
+    Reprices every upcoming, unarchived trip departing in the next `days` days
+    (PRICING_HORIZON_DAYS by default) in one pass: a column read of the trips,
+    one grouped count of seats sold, every fare computed at once by
+    demand_prices(), then one UPDATE per distinct new fare and
+    chunk, plus a bulk INSERT of Trip_Price history for the trips that changed.
+    Tickets keep the price they were sold at (Ticket_Trip.price).
+    Returns PricingResult(priced, changed, history rows).
+    """
+    today = today or datetime.date.today()
+    days = settings.PRICING_HORIZON_DAYS if days is None else days
+    upcoming = Trip.objects.filter(
+        is_archived=False, schedule_day__gte=today, schedule_day__lte=today + datetime.timedelta(days=days)
+    )
+
+    with transaction.atomic():
+        if not dry_run:
+            # Trips never priced before keep their current fare as the list price
+            upcoming.filter(base_cost__isnull=True).update(base_cost=F('trip_cost'))
+
+        route_loads = route_load_factors(today)
+        sold = _seats_sold(upcoming)
+        rows = upcoming.values_list(
+            'pk', 'trip_type', 'route_id', 'schedule_day', 'trip_cost', 'base_cost', 'train__train_model__seat_capacity'
+        )
+
+        columns = list(zip(*rows.iterator(chunk_size=5000)))
+        if not columns:
+            return PricingResult(0, 0, 0)
+        pks, trip_types, route_ids, schedule_days, trip_costs, base_costs, capacities = columns
+        priced = len(pks)
+
+        base_costs = np.array([trip if base is None else base for trip, base in zip(trip_costs, base_costs)], dtype=np.int64)
+        sold_seats = np.array([sold.get(pk, 0) for pk in pks], dtype=float)
+        capacities = np.array([capacity or 0 for capacity in capacities], dtype=float)
+        load_factors = np.divide(sold_seats, capacities, out=np.full(priced, np.nan), where=capacities > 0)
+        route_load = np.array([route_loads.get(route_id, np.nan) for route_id in route_ids], dtype=float)
+        days_to_departure = np.array([(day - today).days for day in schedule_days], dtype=np.int64)
+        prices = demand_prices(base_costs, trip_types, load_factors, route_load, days_to_departure)
+
+        # Only the trips whose fare moved are written
+        now = timezone.now()
+        by_price = defaultdict(list)
+        history = []
+        for i in np.flatnonzero(prices != np.array(trip_costs, dtype=np.int64)).tolist():
+            price = int(prices[i])
+            by_price[price].append(pks[i])
+            history.append(Trip_Price(
+                trip_id=pks[i], price=price, base_cost=int(base_costs[i]),
+                load_factor=None if np.isnan(load_factors[i]) else float(load_factors[i]),
+                days_to_departure=int(days_to_departure[i]), priced_at=now,
+            ))
+
+        if dry_run or not history:
+            return PricingResult(priced, len(history), 0)
+
+        # Fares cluster on a few values, so grouping by fare keeps each UPDATE a
+        # constant assignment; .update() skips auto_now, so bump the fragment stamp too.
+        # A fare is not topology: the schedule version stays put, and the read API
+        # caches catch up within READ_API_TIMEOUT
+        for price, trip_pks in by_price.items():
+            for ids in _chunks(trip_pks):
+                Trip.objects.filter(pk__in=ids).update(trip_cost=price, updated_at=now)
+        Trip_Price.objects.bulk_create(history, batch_size=WRITE_CHUNK_SIZE)
+        # Board entries show the fare; .update() sends no post_save to re-index them
+        repriced = [trip.trip_id for trip in history]
+        transaction.on_commit(lambda: index_trips(repriced))
+    return PricingResult(priced, len(history), len(history))
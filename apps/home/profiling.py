@@ -0,0 +1,306 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+from .models import Job_Run, Request_Profile
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, memory is recorded as 0
+    resource = None
+
+# Functions listed in a stored cProfile report, by cumulative time
+PROFILE_LINES = 40
+
+SQL_WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+# Staff trigger a request capture with this header or query parameter ('sample' = sampler only)
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries a run issues and the rows its
+    writes change (SELECT row counts are not reported consistently by drivers).
+    """
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip()[:6].upper() in SQL_WRITES:
+            rowcount = context['cursor'].rowcount
+            if rowcount and rowcount > 0:
+                self.rows += rowcount
+        return result
+
+    def install(self):
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+
+    def uninstall(self):
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def max_rss_kb():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def profile_report(profiler, lines=PROFILE_LINES):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats('cumulative').print_stats(lines)
+    return out.getvalue()
+
+
+class _JobState:
+    def __init__(self, profile):
+        self.started_at = timezone.now()
+        self.rss_kb = max_rss_kb()
+        self.counter = QueryCounter()
+        self.counter.install()
+        self.profiler = None
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+
+
+# Runs in progress in this worker process, by Celery task ID
+_jobs = {}
+
+
+def start_job(task_id):
+    """
+    task_prerun: starts counting queries and, when TASK_PROFILE_SECONDS is set,
+    profiling. Eager tasks queued from inside a profiled task are counted but not
+    profiled separately (only one profiler can be active at a time).
+    """
+    profile = bool(settings.TASK_PROFILE_SECONDS) and not any(job.profiler for job in _jobs.values())
+    _jobs[task_id] = _JobState(profile)
+
+
+def _result_text(retval):
+    if isinstance(retval, BaseException):
+        retval = f'{type(retval).__name__}: {retval}'
+    return '' if retval is None else str(retval)[:255]
+
+
+def finish_job(task_id, task_name, state, retval):
+    """
+    task_postrun: stops the counters and records the run as a Job_Run, keeping
+    the profile only when the run took at least TASK_PROFILE_SECONDS.
+    """
+    job = _jobs.pop(task_id, None)
+    if job is None:
+        return None
+
+    duration = time.perf_counter() - job.started
+    if job.profiler:
+        job.profiler.disable()
+    job.counter.uninstall()
+
+    rss_kb = max_rss_kb()
+    profile = ''
+    if job.profiler and duration >= settings.TASK_PROFILE_SECONDS:
+        profile = profile_report(job.profiler)
+    return Job_Run.objects.create(
+        task_id=task_id or '', task_name=task_name, state=state or '', result=_result_text(retval),
+        started_at=job.started_at, duration=duration,
+        query_count=job.counter.queries, rows_affected=job.counter.rows,
+        max_rss_kb=rss_kb, rss_growth_kb=rss_kb - job.rss_kb, profile=profile,
+    )
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds from a background
+    thread and counts each distinct stack, for flamegraph.pl / speedscope.
+    """
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{frame.f_globals.get("__name__", "?")}.{code.co_qualname}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self, lines=PROFILE_LINES):
+        """
+        The functions most often on top of the stack (self time), as a share of samples.
+        """
+        total = sum(self.stacks.values())
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        report = [f'{total} samples every {self.interval * 1000:g} ms']
+        report += [f'{count / total:6.1%}  {leaf}' for leaf, count in leaves.most_common(lines)]
+        return '\n'.join(report) + '\n'
+
+
+class _RequestCapture:
+    def __init__(self, request, trigger, mode):
+        self.request = request
+        self.trigger = trigger
+        self.mode = mode
+        self.counter = QueryCounter()
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else None
+
+    def start(self):
+        self.counter.install()
+        self.sampler = StackSampler(threading.get_ident()).start()
+        if self.profiler:
+            self.profiler.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        if self.profiler:
+            self.profiler.disable()
+        self.sampler.stop()
+        self.counter.uninstall()
+
+    def save(self, response):
+        """
+        Writes the collapsed stacks (and the cProfile dump) to REQUEST_PROFILE_DIR
+        and records the capture, dropping captures beyond REQUEST_PROFILE_KEEP.
+        """
+        directory = settings.REQUEST_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', self.request.path).strip('-')[:60] or 'root'
+        name = f'{timezone.now():%Y%m%d-%H%M%S}-{self.request.method.lower()}-{slug}-{uuid.uuid4().hex[:8]}'
+
+        stacks_file = os.path.join(directory, f'{name}.collapsed')
+        with open(stacks_file, 'w') as f:
+            f.write(self.sampler.collapsed())
+        profile_file = ''
+        if self.profiler:
+            profile_file = os.path.join(directory, f'{name}.prof')
+            self.profiler.dump_stats(profile_file)
+
+        user = getattr(self.request, 'user', None)
+        capture = Request_Profile.objects.create(
+            method=self.request.method, path=self.request.get_full_path()[:255],
+            user=user if user is not None and user.is_authenticated else None,
+            status_code=response.status_code, duration=self.duration, query_count=self.counter.queries,
+            trigger=self.trigger, mode=self.mode, profile_file=profile_file, stacks_file=stacks_file,
+            summary=profile_report(self.profiler) if self.profiler else self.sampler.summary(),
+        )
+        prune_request_profiles()
+        return capture
+
+
+def prune_request_profiles(keep=None):
+    """
+    Deletes all but the newest `keep` (REQUEST_PROFILE_KEEP) captures and their files.
+    """
+    keep = settings.REQUEST_PROFILE_KEEP if keep is None else keep
+    old = Request_Profile.objects.order_by('-created_at', '-pk')[keep:]
+    stale = list(old.values_list('pk', 'profile_file', 'stacks_file'))
+    for _, *paths in stale:
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+    Request_Profile.objects.filter(pk__in=[pk for pk, *_ in stale]).delete()
+
+
+class RequestProfilerMiddleware:
+    """
+    Profiles a request when a staff user sends an X-Profile header or a
+    ?_profile= parameter ('sample' for the stack sampler alone, anything else
+    for cProfile as well), or at random for REQUEST_PROFILE_SAMPLE_RATE of
+    requests (sampler only). Removed from the stack entirely unless
+    REQUEST_PROFILE_DIR is set, and untriggered requests pay one header lookup.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILE_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _capture(self, request, requested, is_staff):
+        if requested and is_staff:
+            trigger = 'header' if request.headers.get(PROFILE_HEADER) else 'param'
+            return _RequestCapture(request, trigger, 'sample' if requested == 'sample' else 'cprofile')
+        if self.sample_rate and random.random() < self.sample_rate:
+            return _RequestCapture(request, 'sample', 'sample')
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        requested = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        capture = self._capture(request, requested, requested and request.user.is_staff)
+        if capture is None:
+            return self.get_response(request)
+        capture.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.stop()
+        capture.save(response)
+        return response
+
+    async def __acall__(self, request):
+        requested = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        is_staff = requested and await sync_to_async(lambda: request.user.is_staff)()
+        capture = self._capture(request, requested, is_staff)
+        if capture is None:
+            return await self.get_response(request)
+        # Both profilers follow the event loop's thread: ORM calls made through
+        # sync_to_async run elsewhere and show up as time spent awaiting
+        capture.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.stop()
+        await sync_to_async(capture.save)(response)
+        return response
@@ -0,0 +1,144 @@
+import datetime
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .models import (
+    Trip, L_Trip, I_Trip, L_Route, I_Route, S_Series, A_Series, compute_durations
+)
+from .conflicts import detect_conflicts, intervals_from_queryset, make_interval, pattern_intervals
+from .boards import queue_rebuild
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _as_time(value):
+    if isinstance(value, datetime.time):
+        return value
+    return datetime.time.fromisoformat(str(value).strip())
+
+
+def _as_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value).strip())
+
+
+def bulk_schedule_trips(rows, batch_size=DEFAULT_BATCH_SIZE, check_conflicts=True):
+    """
+    Creates many trips at once, together with their L_Trip/I_Trip subtype rows.
+
+    Each row is a dict with trip_id, trip_type ('L' or 'I'), route_id, train_id,
+    schedule_day, departure_time, arrival_time and trip_cost.
+    Foreign keys are validated against in-memory sets (one query per table, not per row)
+    and durations for every row are computed in a single pass. Unless check_conflicts
+    is False, the new trips are swept together with each train's existing schedule.
+    Nothing is written unless every row is valid; returns the number of trips created.
+    """
+    rows = list(rows)
+
+    # One query per lookup table; routes map to their (origin, destination) station IDs
+    local_routes = {r[0]: r[1:] for r in L_Route.objects.values_list('l_route_id', 'l_route_origin_id', 'l_route_desti_id')}
+    inter_routes = {r[0]: r[1:] for r in I_Route.objects.values_list('i_route_id', 'i_route_origin_id', 'i_route_desti_id')}
+    s_trains = set(S_Series.objects.values_list('train_id', flat=True))
+    a_trains = set(A_Series.objects.values_list('train_id', flat=True))
+    valid_fks = {
+        'L': (local_routes, s_trains),
+        'I': (inter_routes, a_trains),
+    }
+
+    errors = []
+    parsed = []
+    seen_ids = set()
+    for line, row in enumerate(rows, start=1):
+        trip_id = str(row.get('trip_id', '')).strip()
+        trip_type = row.get('trip_type')
+        route_id = str(row.get('route_id', '')).strip()
+        train_id = str(row.get('train_id', '')).strip()
+
+        if not trip_id:
+            errors.append(f"Row {line}: missing trip_id.")
+            continue
+        if trip_id in seen_ids:
+            errors.append(f"Row {line}: duplicate trip_id {trip_id}.")
+            continue
+        seen_ids.add(trip_id)
+
+        if trip_type not in valid_fks:
+            errors.append(f"Row {line}: trip_type must be 'L' or 'I'.")
+            continue
+        routes, trains = valid_fks[trip_type]
+        if route_id not in routes:
+            errors.append(f"Row {line}: route {route_id} is not a {dict(Trip.TRIP_TYPES)[trip_type]} route.")
+        if train_id not in trains:
+            errors.append(f"Row {line}: train {train_id} cannot run {dict(Trip.TRIP_TYPES)[trip_type]} trips.")
+
+        try:
+            departure = _as_time(row['departure_time'])
+            arrival = _as_time(row['arrival_time'])
+            schedule_day = _as_date(row['schedule_day'])
+            trip_cost = int(row.get('trip_cost') or 0)
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append(f"Row {line}: {e}")
+            continue
+
+        parsed.append(Trip(
+            trip_id=trip_id,
+            trip_type=trip_type,
+            route_id=route_id,
+            train_id=train_id,
+            schedule_day=schedule_day,
+            departure_time=departure,
+            arrival_time=arrival,
+            trip_cost=trip_cost,
+        ))
+
+    # Existing IDs checked in chunks against the index rather than one query per row
+    ids = [trip.trip_id for trip in parsed]
+    for start in range(0, len(ids), batch_size):
+        for trip_id in Trip.objects.filter(trip_id__in=ids[start:start + batch_size]).values_list('trip_id', flat=True):
+            errors.append(f"Trip {trip_id} already exists.")
+
+    if errors:
+        raise ValidationError(errors)
+
+    durations = compute_durations([t.departure_time for t in parsed], [t.arrival_time for t in parsed])
+    for trip, duration in zip(parsed, durations):
+        trip.duration = duration
+
+    if check_conflicts and parsed:
+        errors = _train_conflicts(parsed, {**local_routes, **inter_routes})
+        if errors:
+            raise ValidationError(errors)
+
+    local_info = [L_Trip(l_trip_id_id=t.trip_id, s_train_id=t.train_id, l_route_id=t.route_id) for t in parsed if t.trip_type == 'L']
+    inter_info = [I_Trip(i_trip_id_id=t.trip_id, a_train_id=t.train_id, i_route_id=t.route_id) for t in parsed if t.trip_type == 'I']
+
+    with transaction.atomic():
+        Trip.objects.bulk_create(parsed, batch_size=batch_size)
+        L_Trip.objects.bulk_create(local_info, batch_size=batch_size)
+        I_Trip.objects.bulk_create(inter_info, batch_size=batch_size)
+        # bulk_create sends no post_save signals; one queued refresh covers every board
+        transaction.on_commit(queue_rebuild)
+
+    return len(parsed)
+
+
+def _train_conflicts(new_trips, route_stations):
+    """
+    Runs the fleet conflict sweep over the new trips plus the existing trips and
+    pattern departures of the same trains, and reports the conflicts that involve a new trip.
+    """
+    new_ids = {t.trip_id for t in new_trips}
+    days = [t.schedule_day for t in new_trips]
+    train_ids = {t.train_id for t in new_trips}
+    window = (min(days) - datetime.timedelta(days=1), max(days) + datetime.timedelta(days=1))
+    existing = Trip.objects.filter(train_id__in=train_ids, schedule_day__range=window)
+    intervals = intervals_from_queryset(existing) + pattern_intervals(*window, train_ids)
+    intervals += [
+        make_interval(t.trip_id, t.train_id, t.schedule_day, t.departure_time, t.duration, *route_stations[t.route_id])
+        for t in new_trips
+    ]
+    return [
+        f"Train {c.train_id} {c.kind}: {c.second} {c.detail}"
+        for c in detect_conflicts(intervals)
+        if c.first in new_ids or c.second in new_ids
+    ]
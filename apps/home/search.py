@@ -0,0 +1,175 @@
+import datetime
+import hashlib
+import heapq
+from collections import namedtuple
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from .caching import get_schedule_version, aget_schedule_version, READ_API_TIMEOUT
+from .models import Trip
+from .network import get_network
+from .patterns import booking_horizon, expand_patterns
+
+# Departures per search, earliest first
+MAX_RESULTS = 100
+
+# origin / destination: station ID or name (any case); date .. until: days to search
+# (until=None: every later day); after / before: departure time window
+TripQuery = namedtuple('TripQuery', 'origin destination date until after before trip_type', defaults=(None,) * 7)
+
+
+def station_routes(value, end):
+    """
+    IDs of the routes starting (end='origin') or ending (end='destination') at
+    the station, read from the shared network snapshot's adjacency arrays.
+    """
+    return get_network().station_route_ids(value, end)
+
+
+def with_station_names(trips):
+    """
+    Annotates origin_station_name / destination_station_name, which Trip's
+    origin_name / destination_name prefer: two objects per result (trip and
+    train) instead of the eight the route/station chains would build.
+    """
+    names = {}
+    for attr, prefix in (('origin_station_name', 'origin'), ('destination_station_name', 'desti')):
+        names[attr] = Coalesce(
+            F(f'route__local_route_info__l_route_{prefix}__l_station_id__station_name'),
+            F(f'route__intertown_route_info__i_route_{prefix}__i_station_id__station_name'),
+        )
+    return trips.annotate(**names).select_related('train')
+
+
+def _key_scans(trips, route_ids, limit):
+    """
+    One (day, time, pk) scan per route, each an index range scan of its first
+    `limit` departures; merging them avoids the database sorting every match of
+    a route IN (...) list.
+    """
+    scans = [trips] if route_ids is None else [trips.filter(route_id=route_id) for route_id in sorted(route_ids)]
+    return [scan.order_by('schedule_day', 'departure_time').values_list('schedule_day', 'departure_time', 'pk')[:limit] for scan in scans]
+
+
+def _merged_keys(scans, limit):
+    """
+    The primary keys of the first `limit` departures over the scans' rows, in (day, time) order.
+    """
+    return [pk for _, _, pk in islice(heapq.merge(*scans), limit)]
+
+
+def _route_ids(query):
+    """
+    IDs of the routes that serve both stations given (None: no station given).
+    """
+    route_ids = None
+    for value, end in ((query.origin, 'origin'), (query.destination, 'destination')):
+        if value:
+            routes = station_routes(value, end)
+            route_ids = routes if route_ids is None else route_ids & routes
+    return route_ids
+
+
+def _matching_trips(query):
+    day = query.date or datetime.date.today()
+    trips = Trip.objects.filter(is_archived=False, schedule_day__gte=day)
+    if query.until:
+        trips = trips.filter(schedule_day__lte=query.until)
+    if query.after:
+        trips = trips.filter(departure_time__gte=query.after)
+    if query.before:
+        trips = trips.filter(departure_time__lte=query.before)
+    if query.trip_type:
+        trips = trips.filter(trip_type=query.trip_type)
+    return trips
+
+
+def _with_pattern_departures(results, query, route_ids, limit):
+    """
+    Merges the matching pattern departures in the booking horizon into the results.
+    """
+    today = datetime.date.today()
+    start = max(query.date or today, today)
+    end = today + datetime.timedelta(days=booking_horizon())
+    if query.until:
+        end = min(end, query.until)
+    if start <= end:
+        virtual = [
+            trip for trip in expand_patterns(start, end, trip_type=query.trip_type, route_ids=route_ids)
+            if (not query.after or trip.departure_time >= query.after) and (not query.before or trip.departure_time <= query.before)
+        ]
+        if virtual:
+            results = sorted(results + virtual, key=lambda t: (t.schedule_day, t.departure_time))[:limit]
+    return results
+
+
+def find_trips(query, limit=MAX_RESULTS):
+    """
+    Unarchived trips matching the query, plus the pattern departures in the
+    booking horizon, ordered by day and departure time. Stations are resolved
+    to route IDs first, so the trip table is read through trip_route_day_idx
+    (or trip_day_departure_idx when no station is given), then the results are
+    fetched by primary key.
+    """
+    route_ids = _route_ids(query)
+    if route_ids is not None and not route_ids:
+        return []
+
+    pks = _merged_keys(_key_scans(_matching_trips(query), route_ids, limit), limit)
+    found = {trip.pk: trip for trip in with_station_names(Trip.objects.filter(pk__in=pks)).order_by()}
+    results = [found[pk] for pk in pks if pk in found]
+    return _with_pattern_departures(results, query, route_ids, limit)
+
+
+async def afind_trips(query, limit=MAX_RESULTS):
+    """
+    find_trips() for async views: the trip queries go through the async ORM. Station
+    resolution (which may rebuild the network snapshot) and pattern expansion still
+    run on a worker thread.
+    """
+    route_ids = await sync_to_async(_route_ids)(query)
+    if route_ids is not None and not route_ids:
+        return []
+
+    scans = []
+    for scan in _key_scans(_matching_trips(query), route_ids, limit):
+        scans.append([row async for row in scan])
+    pks = _merged_keys(scans, limit)
+    found = {trip.pk: trip async for trip in with_station_names(Trip.objects.filter(pk__in=pks)).order_by()}
+    results = [found[pk] for pk in pks if pk in found]
+    return await sync_to_async(_with_pattern_departures)(results, query, route_ids, limit)
+
+
+def _cache_key(query, limit, version):
+    normalized = query._replace(
+        origin=(query.origin or '').strip().lower(), destination=(query.destination or '').strip().lower()
+    )
+    digest = hashlib.md5(repr((tuple(normalized), limit)).encode()).hexdigest()
+    return f'home:trip_search:{digest}:{version}'
+
+
+def search_trips(query, limit=MAX_RESULTS):
+    """
+    find_trips() behind a short-lived per-query cache. Keys carry the schedule
+    version, so station and route edits retire the cached results at once.
+    """
+    key = _cache_key(query, limit, get_schedule_version())
+    trips = cache.get(key)
+    if trips is None:
+        trips = find_trips(query, limit)
+        cache.set(key, trips, READ_API_TIMEOUT)
+    return trips
+
+
+async def asearch_trips(query, limit=MAX_RESULTS):
+    """
+    search_trips() for async views, sharing its cache entries.
+    """
+    key = _cache_key(query, limit, await aget_schedule_version())
+    trips = await cache.aget(key)
+    if trips is None:
+        trips = await afind_trips(query, limit)
+        await cache.aset(key, trips, READ_API_TIMEOUT)
+    return trips
@@ -0,0 +1,143 @@
+import gzip
+from collections import Counter
+from contextlib import contextmanager
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+DEFAULT_BATCH_SIZE = 2000
+
+
+def open_snapshot(path, mode):
+    """
+    Text-mode UTF-8 file, gzip-compressed when the name ends in .gz.
+    """
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def dependency_order(models):
+    """
+    Stable topological sort: every model comes after the models its foreign keys
+    point to (serializers.sort_dependencies only follows natural keys).
+    """
+    remaining = list(models)
+    ordered = []
+    while remaining:
+        for model in remaining:
+            targets = {f.related_model for f in model._meta.concrete_fields if f.is_relation and f.related_model is not model}
+            if not targets & set(remaining):
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise ValueError(f"Circular foreign keys between {', '.join(m.__name__ for m in remaining)}")
+    return ordered
+
+
+def snapshot_models(with_users=True):
+    """
+    Every apps.home model in load order, plus auth.User (Customer.user points to it).
+    """
+    models = list(apps.get_app_config('home').get_models())
+    return dependency_order(([User] if with_users else []) + models)
+
+
+def _auto_m2m(model):
+    return [f for f in model._meta.many_to_many if f.remote_field.through._meta.auto_created]
+
+
+def dump(stream, models, chunk_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Writes one JSON object per line (Django's jsonl fixture format), reading each
+    table with a server-side iterator so memory stays flat. Auto-created M2M links
+    are inlined as primary key lists, as dumpdata does.
+    """
+    counts = Counter()
+    for model in models:
+        queryset = model._base_manager.order_by('pk')
+        m2m = [f.name for f in _auto_m2m(model)]
+        if m2m:
+            queryset = queryset.prefetch_related(*m2m)
+        # Users are cloned without groups/permissions, whose IDs differ between databases
+        fields = [f.name for f in model._meta.concrete_fields if not f.primary_key] if model is User else None
+
+        def counted(objects, label=model._meta.label):
+            for obj in objects:
+                counts[label] += 1
+                yield obj
+
+        serializers.serialize('jsonl', counted(queryset.iterator(chunk_size=chunk_size)), stream=stream, fields=fields)
+        if progress:
+            progress(model._meta.label, counts[model._meta.label])
+    return counts
+
+
+@contextmanager
+def _raw_timestamps(model):
+    """
+    Keeps dumped auto_now / auto_now_add values: bulk_create runs pre_save, which
+    would overwrite them with the load time (loaddata's raw save skips it).
+    """
+    fields = [f for f in model._meta.concrete_fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+@transaction.atomic
+def load(stream, batch_size=DEFAULT_BATCH_SIZE, using='default', progress=None):
+    """
+    Reads a dump line by line and bulk_creates each model's objects in batches,
+    followed by their M2M through rows. The dump's order is the load order.
+    Save() and signals are bypassed, like loaddata; sequences are reset at the end.
+    """
+    counts = Counter()
+    loaded = []
+    batch = []
+
+    def flush():
+        model = batch[0].object.__class__
+        with _raw_timestamps(model):
+            model._base_manager.using(using).bulk_create([d.object for d in batch], batch_size=batch_size)
+        for field in _auto_m2m(model):
+            through = field.remote_field.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            rows = [
+                through(**{source: d.object.pk, target: pk})
+                for d in batch for pk in d.m2m_data.get(field.name, [])
+            ]
+            through.objects.using(using).bulk_create(rows, batch_size=batch_size)
+            if through not in loaded:
+                loaded.append(through)
+        counts[model._meta.label] += len(batch)
+        if progress:
+            progress(model._meta.label, counts[model._meta.label])
+        batch.clear()
+
+    for deserialized in serializers.deserialize('jsonl', stream, using=using, ignorenonexistent=True):
+        model = deserialized.object.__class__
+        if batch and (batch[0].object.__class__ is not model or len(batch) >= batch_size):
+            flush()
+        if model not in loaded:
+            loaded.append(model)
+        batch.append(deserialized)
+    if batch:
+        flush()
+
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), loaded)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return counts
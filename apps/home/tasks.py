@@ -1,8 +1,20 @@
 import datetime
+import time
 from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import Train, Maintenance_Log, Trip, Ticket
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import Train, Maintenance_Log, Trip, Ticket, Booking_Request, Customer, Job_Run
+from .images import generate_thumbnails
+from .boards import rebuild_boards, remove_trips, REBUILD_PENDING_KEY
+from .ticket_tokens import publish_revocations
+from .waitlist import lock_trips, sold_out, promote_waitlists
+from .pricing import reprice_trips
+from .travel_matrix import refresh_travel_matrix, REFRESH_PENDING_KEY
+from .metrics import BOOKING_QUEUE_WAIT, observe_booking
+from .notifications import fan_out, send_notices
 
 @shared_task
 def send_ticket_confirmation_email(ticket_id):
@@ -25,7 +37,89 @@ def send_ticket_confirmation_email(ticket_id):
     except Ticket.DoesNotExist:
         return "Ticket not found"
 
+@shared_task(acks_late=True)
+def process_booking_request(booking_pk):
+    """
+    Booking queue worker: turns a pending Booking_Request into a Ticket.
+    Routed to the dedicated 'bookings' queue so peak purchase traffic is drained
+    at the worker's concurrency instead of contending inside web requests.
+    """
+    try:
+        with transaction.atomic():
+            try:
+                # Row lock makes redelivered messages wait, then see the finished request
+                booking = Booking_Request.objects.select_for_update().get(pk=booking_pk)
+            except Booking_Request.DoesNotExist:
+                return "Booking request not found"
+
+            if booking.status != 'Pending':
+                return f"Booking {booking.idempotency_key} already {booking.status.lower()}"
+            BOOKING_QUEUE_WAIT.observe((timezone.now() - booking.created_at).total_seconds())
+            started_at = time.perf_counter()
+
+            trips = list(booking.trips.all())
+            if not trips:
+                booking.status = 'Failed'
+                booking.error = "No trips selected."
+                booking.save(update_fields=['status', 'error', 'updated_at'])
+                observe_booking('worker', 'invalid')
+                return f"Booking {booking.idempotency_key} failed"
+
+            lock_trips([trip.pk for trip in trips])
+            full = sold_out(trips)
+            if full:
+                booking.status = 'Failed'
+                booking.error = f"Sold out: {', '.join(full)}. Join the waitlist to be issued a seat when one frees up."
+                booking.save(update_fields=['status', 'error', 'updated_at'])
+                observe_booking('worker', 'sold_out')
+                return f"Booking {booking.idempotency_key} failed"
+
+            ticket = Ticket(customer=booking.customer, trip_date=booking.trip_date)
+            ticket.save()
+            ticket.trips.set(trips)
+
+            booking.ticket = ticket
+            booking.status = 'Completed'
+            booking.save(update_fields=['ticket', 'status', 'updated_at'])
+            observe_booking('worker', 'issued', time.perf_counter() - started_at)
+    except Exception as e:
+        # Rolled back: record the failure outside the transaction so the client stops polling
+        Booking_Request.objects.filter(pk=booking_pk, status='Pending').update(
+            status='Failed', error=f"Could not issue the ticket: {e}"[:255], updated_at=timezone.now()
+        )
+        observe_booking('worker', 'error')
+        raise
+
+    send_ticket_confirmation_email.delay(ticket.ticket_id) # type: ignore
+    return f"Booking {booking.idempotency_key} created Ticket {ticket.ticket_id}"
+
 @shared_task
+def process_profile_picture(customer_id):
+    """
+    Async task: Decodes an uploaded profile picture, strips its EXIF data and writes
+    the thumbnail variants, keeping the CPU-heavy work off the web request.
+    """
+    try:
+        customer = Customer.objects.get(customer_id=customer_id)
+    except Customer.DoesNotExist:
+        return "Customer not found"
+
+    name = customer.profile_picture.name
+    if not name:
+        return "No profile picture"
+
+    try:
+        written = generate_thumbnails(name)
+    except Exception as e:
+        # Not a decodable image: drop the reference so pages fall back to the default avatar
+        Customer.objects.filter(customer_id=customer_id, profile_picture=name).update(profile_picture='', profile_picture_ready=False)
+        return f"Rejected profile picture for Customer {customer_id}: {e}"
+
+    # Guard against a newer upload having replaced the picture in the meantime
+    Customer.objects.filter(customer_id=customer_id, profile_picture=name).update(profile_picture_ready=True)
+    return f"Generated {len(written)} thumbnails for Customer {customer_id}"
+
+@shared_task(replica_reads=True)
 def update_train_conditions():
     """
     Cron Job: Updates all Train conditions based on their most recent Maintenance Log.
@@ -62,5 +156,103 @@ def archive_past_trips():
         schedule_day=current_date, arrival_time__gte=current_time
     )
     
-    count = past_trips.update(is_archived=True)
-    return f"Archived {count} past trips."
\ No newline at end of file
+    # .update() sends no signals, so take the trips off the station boards by hand
+    archived_ids = list(past_trips.values_list('trip_id', flat=True))
+
+    # .update() skips auto_now, so bump the fragment cache stamp by hand
+    count = past_trips.update(is_archived=True, updated_at=timezone.now())
+    remove_trips(archived_ids)
+    return f"Archived {count} past trips."
+
+@shared_task
+def refresh_departure_boards():
+    """
+    Cron Job: Rolls the station boards' pattern departures forward and drops departed trips.
+    Also queued after station, route and train edits and bulk trip imports.
+    """
+    cache.delete(REBUILD_PENDING_KEY)
+    count = rebuild_boards()
+    return f"Indexed {count} trips on the departure boards."
+
+@shared_task
+def publish_ticket_revocations():
+    """
+    Cron Job: Rebuilds the gates' revocation filter from the database, dropping tickets
+    whose travel date has passed and restoring it if the cache was flushed.
+    """
+    revocations = publish_revocations()
+    return f"Published {len(revocations)} revoked tickets."
+
+@shared_task
+def promote_waitlisted_customers():
+    """
+    Cron Job: Issues freed seats to the front of each sold-out trip's waitlist and
+    expires lapsed entries. Also queued whenever a ticket is cancelled.
+    """
+    expired, ticket_ids = promote_waitlists()
+    return f"Promoted {len(ticket_ids)} waitlisted customers, expired {expired} entries."
+
+@shared_task
+def reprice_upcoming_trips():
+    """
+    Cron Job: Sets upcoming trips' fares from demand and records the changes in the
+    price history. Tickets already sold keep their fares.
+    """
+    result = reprice_trips()
+    return f"Repriced {result.changed} of {result.priced} upcoming trips."
+
+@shared_task
+def update_travel_matrix(full=False):
+    """
+    Cron Job: Recomputes the all-pairs travel time / fare / hop matrix, only the
+    rows that route changes can affect unless full. Also queued after topology edits.
+    """
+    cache.delete(REFRESH_PENDING_KEY)
+    result = refresh_travel_matrix(full=full)
+    return f"Recomputed {result.recomputed_rows} of {result.stations} stations' rows in {result.seconds:.1f}s."
+
+@shared_task
+def prune_job_runs():
+    """
+    Cron Job: Deletes Job_Run records older than JOB_RUN_RETENTION_DAYS.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.JOB_RUN_RETENTION_DAYS)
+    count, _ = Job_Run.objects.filter(started_at__lt=cutoff).delete()
+    return f"Pruned {count} task run records."
+
+@shared_task
+def send_waitlist_promotion_emails(ticket_ids):
+    """
+    Async task: Tells promoted customers their waitlisted seat has been issued,
+    one task per promotion batch rather than one per ticket.
+    """
+    tickets = Ticket.objects.filter(ticket_id__in=ticket_ids).select_related('customer')
+    messages = [
+        (
+            f"Tirian Trains: A seat is yours! Ticket #{ticket.ticket_id}",
+            f"Hello {ticket.customer.given_name},\n\nA seat freed up and your waitlisted ticket for {ticket.trip_date} has been issued. Total cost: {ticket.total_cost} Lion Coins.\n\nSafe travels!",
+        )
+        for ticket in tickets
+    ]
+    print(f"ASYNC ACTION: Dispatching {len(messages)} waitlist promotion emails")
+    # send_mass_mail([(subject, message, settings.DEFAULT_FROM_EMAIL, [ticket.customer.user.email]) ...])
+    return f"Emails sent for {len(messages)} promoted tickets"
+
+@shared_task(acks_late=True)
+def notify_schedule_change(change_pk):
+    """
+    Async task: Fans a trip's delay, retiming or cancellation out to its ticket
+    holders, queued on commit of the edit so the admin save never waits on it.
+    """
+    recipients = fan_out(change_pk)
+    if recipients is None:
+        return f"Schedule change {change_pk} already fanned out"
+    return f"Queued schedule change {change_pk} notices for {recipients} customers"
+
+@shared_task
+def send_schedule_change_notices(change_pk, customer_ids):
+    """
+    Async task: Sends one batch of schedule change notices.
+    """
+    sent = send_notices(change_pk, customer_ids)
+    return f"Emails sent for {sent} customers"
@@ -0,0 +1,13 @@
+from django import template
+from apps.home.images import avatar_url as _avatar_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar_url(customer, size='medium'):
+    """
+    Usage: {% avatar_url customer 'small' %}
+    Falls back to the default avatar when the customer has no picture.
+    """
+    return _avatar_url(customer, size) or '/static/assets/img/avatars/avatar.jpg'
@@ -1,8 +1,53 @@
 import datetime
-from django.test import TestCase, Client
+import io
+import os
+import shutil
+import tempfile
+import time
+from unittest import skipUnless
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
 from django.urls import reverse
-from apps.home.models import Customer, Trip, Ticket
+from django.utils import timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.home.models import (
+    Customer, Trip, Ticket, Station, L_Station, I_Station, Route, L_Route, I_Route,
+    Train, S_Series, A_Series, L_Trip, I_Trip, Service_Pattern, Service_Exception,
+    Task, Maintenance_Log, Log_Task, Maintenance_Due, Train_Model, Waitlist_Entry, Booking_Request,
+    Schedule_Change, Ticket_Trip
+)
+from core.db_router import pin_to_primary
+
+
+def build_network():
+    """
+    Creates a small network: 3 local stations with a route each way between
+    neighbours, 2 inter-town stations joined both ways, and one train per series.
+    """
+    l_stations = []
+    for idx, name in enumerate(["Lantern Waste", "Beaversdam", "Beruna"]):
+        st = Station.objects.create(station_id=f"30000{idx+1}", station_name=name, station_type='L')
+        l_stations.append(L_Station.objects.create(l_station_id=st))
+    i_stations = []
+    for idx, name in enumerate(["Anvard", "Tashbaan"]):
+        st = Station.objects.create(station_id=f"40000{idx+1}", station_name=name, station_type='I')
+        i_stations.append(I_Station.objects.create(i_station_id=st))
+
+    route_id = 500001
+    for a, b in [(0, 1), (1, 0), (1, 2), (2, 1)]:
+        rt = Route.objects.create(route_id=str(route_id), route_type='L')
+        L_Route.objects.create(l_route_id=rt, l_route_origin=l_stations[a], l_route_desti=l_stations[b])
+        route_id += 1
+    for a, b, rid in [(0, 1, '600001'), (1, 0, '600002')]:
+        rt = Route.objects.create(route_id=rid, route_type='I')
+        I_Route.objects.create(i_route_id=rt, i_route_origin=i_stations[a], i_route_desti=i_stations[b])
+
+    S_Series.objects.create(train=Train.objects.create(train_id='100001', train_number='S1001', train_series='S'))
+    A_Series.objects.create(train=Train.objects.create(train_id='200001', train_number='A2001', train_series='A'))
 
 class TrainSystemTests(TestCase):
     def setUp(self):
@@ -99,4 +144,1651 @@ class TrainSystemTests(TestCase):
         # Use .get() instead of .first(). .first() returns Optional[Ticket], 
         # which Pylance complains about accessing .total_cost on.
         # .get() raises an error if missing (which fails the test correctly) or returns the object.
-        self.assertEqual(tickets.get().total_cost, 150)
\ No newline at end of file
+        self.assertEqual(tickets.get().total_cost, 150)
+
+class BookingQueueTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='0001', password='securepassword123')
+        self.customer = Customer.objects.create(
+            user=self.user,
+            last_name='Pevensie',
+            given_name='Lucy',
+            birth_date=datetime.date(2000, 5, 5),
+            customer_id='0001'
+        )
+        self.test_date = datetime.date(2024, 6, 20)
+        self.trip = Trip(
+            trip_id='20240620L003',
+            departure_time=datetime.time(9, 0),
+            arrival_time=datetime.time(9, 45),
+            schedule_day=self.test_date,
+            trip_cost=25,
+            trip_type='L'
+        )
+        self.trip.save()
+        self.client.login(username='0001', password='securepassword123')
+
+    def test_same_idempotency_key_maps_to_one_ticket(self):
+        """
+        Integration Test: Retrying a queued purchase with the same key
+        returns the original booking and only ever issues one ticket.
+        """
+        payload = {'trip_date': self.test_date, 'trips': [self.trip.trip_id]}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(reverse('booking_create'), payload, HTTP_IDEMPOTENCY_KEY='retry-me')
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.client.post(reverse('booking_create'), payload, HTTP_IDEMPOTENCY_KEY='retry-me')
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(Ticket.objects.filter(customer=self.customer).count(), 1)
+
+        status = self.client.get(reverse('booking_status', args=['retry-me'])).json()
+        self.assertEqual(status['status'], 'Completed')
+        self.assertEqual(status['ticket_id'], Ticket.objects.get().ticket_id)
+        self.assertEqual(status['total_cost'], 25)
+
+    def test_ticket_form_queues_only_when_configured(self):
+        """
+        Integration Test: By default the ticket page issues tickets in the request and
+        renders no key; with BOOKING_FORM_QUEUED it does, and a form re-rendered after
+        a failed submission keeps its key so the retry maps to the same booking.
+        """
+        page = self.client.get(reverse('ticket_sales'))
+        self.assertIsNone(page.context['idempotency_key'])
+        self.assertNotContains(page, 'name="idempotency_key"')
+
+        with self.settings(BOOKING_FORM_QUEUED=True):
+            key = self.client.get(reverse('ticket_sales')).context['idempotency_key']
+            self.assertTrue(key)
+            retry = self.client.post(reverse('ticket_sales'), {'trips': [self.trip.trip_id], 'idempotency_key': key})
+            self.assertEqual(retry.context['idempotency_key'], key)
+            with self.captureOnCommitCallbacks(execute=True):
+                queued = self.client.post(reverse('ticket_sales'), {'trip_date': self.test_date, 'trips': [self.trip.trip_id], 'idempotency_key': key})
+            self.assertEqual(queued.status_code, 202)
+            self.assertNotEqual(queued.context['idempotency_key'], key)
+        self.assertEqual(Booking_Request.objects.get().idempotency_key, key)
+
+    def test_reused_key_with_different_trips_conflicts(self):
+        """
+        Unit Test: A key cannot be replayed for a different purchase.
+        """
+        self.client.post(reverse('booking_create'), {'trip_date': self.test_date, 'trips': [self.trip.trip_id]}, HTTP_IDEMPOTENCY_KEY='k1')
+        response = self.client.post(reverse('booking_create'), {'trip_date': datetime.date(2024, 6, 21), 'trips': [self.trip.trip_id]}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 409)
+
+    def test_worker_error_fails_the_request(self):
+        """
+        Unit Test: An error while issuing the ticket rolls the sale back and marks
+        the request failed, instead of leaving the client polling a pending request.
+        """
+        from unittest import mock
+        from django.db import IntegrityError
+        from apps.home.tasks import process_booking_request
+
+        booking = Booking_Request.objects.create(customer=self.customer, idempotency_key='boom', trip_date=self.test_date)
+        booking.trips.set([self.trip])
+        with mock.patch.object(Ticket, 'save', side_effect=IntegrityError('ticket IDs exhausted')):
+            with self.assertRaises(IntegrityError):
+                process_booking_request(booking.pk)
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'Failed')
+        self.assertIn('ticket IDs exhausted', booking.error)
+        self.assertFalse(Ticket.objects.exists())
+
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+        self.client = Client()
+        self.user = User.objects.create_user(username='0002', password='securepassword123')
+        self.customer = Customer.objects.create(
+            user=self.user,
+            last_name='Pevensie',
+            given_name='Edmund',
+            birth_date=datetime.date(2000, 3, 3),
+            customer_id='0002'
+        )
+        self.client.login(username='0002', password='securepassword123')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def make_upload(self):
+        from PIL import Image
+        buf = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Telmarine Camera Co.'  # Make
+        Image.new('RGB', (600, 400), 'red').save(buf, 'JPEG', exif=exif)
+        return SimpleUploadedFile('me.jpg', buf.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_deduped_and_thumbnailed(self):
+        """
+        Integration Test: Identical uploads share one content-addressed original,
+        and the worker writes EXIF-free thumbnails for every size.
+        """
+        from PIL import Image
+        from apps.home.images import AVATAR_SIZES, variant_name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {'profile_picture': self.make_upload()})
+        first_name = Customer.objects.get(pk='0002').profile_picture.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {'profile_picture': self.make_upload()})
+        customer = Customer.objects.get(pk='0002')
+
+        self.assertEqual(customer.profile_picture.name, first_name)
+        self.assertTrue(customer.profile_picture_ready)
+
+        for size, edge in AVATAR_SIZES.items():
+            with Image.open(f"{self.media_root}/{variant_name(first_name, size)}") as thumb:
+                self.assertEqual(thumb.size, (edge, edge))
+                self.assertEqual(len(thumb.getexif()), 0)
+
+    def test_oversized_upload_is_a_form_error(self):
+        """
+        Unit Test: The size limit is checked over the streamed bytes while the form
+        validates, so an oversized picture re-renders the form instead of failing the save.
+        """
+        upload = self.make_upload()
+        with self.settings(AVATAR_MAX_UPLOAD_SIZE=upload.size - 1):
+            response = self.client.post(reverse('profile'), {'profile_picture': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('too large', str(response.context['form'].errors['profile_picture']))
+        self.assertFalse(Customer.objects.get(pk='0002').profile_picture)
+
+    def test_concurrent_identical_upload_keeps_one_original(self):
+        """
+        Unit Test: If an identical upload lands between the existence check and the
+        save, the storage's renamed copy is dropped and the content-addressed name kept.
+        """
+        from unittest import mock
+        from django.core.files.storage import default_storage
+        from apps.home.images import store_upload, content_hash_of
+
+        name = store_upload(self.make_upload())
+        # Only store_upload's own existence check misses the stored copy
+        exists = default_storage.exists
+        missed = []
+
+        def racing_exists(path):
+            if not missed:
+                missed.append(path)
+                return False
+            return exists(path)
+
+        with mock.patch.object(default_storage, 'exists', side_effect=racing_exists):
+            self.assertEqual(store_upload(self.make_upload()), name)
+        self.assertEqual(os.listdir(os.path.dirname(f"{self.media_root}/{name}")), [os.path.basename(name)])
+        self.assertEqual(len(content_hash_of(name)), 64)
+
+    def test_rejects_unsupported_extension(self):
+        """
+        Unit Test: Non-image uploads are refused without being decoded.
+        """
+        upload = SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')
+        self.client.post(reverse('profile'), {'profile_picture': upload})
+        self.assertFalse(Customer.objects.get(pk='0002').profile_picture)
+
+
+class TripFragmentCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='0003', password='securepassword123')
+        self.trip = Trip(
+            trip_id='20240620L004',
+            departure_time=datetime.time(7, 15),
+            arrival_time=datetime.time(8, 0),
+            schedule_day=datetime.date(2024, 6, 20),
+            trip_cost=15,
+            trip_type='L'
+        )
+        self.trip.save()
+        self.client.login(username='0003', password='securepassword123')
+
+    def test_trip_rows_are_cached_until_trip_is_saved(self):
+        """
+        Integration Test: Schedule rows come from the fragment cache until the
+        trip's updated_at stamp changes.
+        """
+        self.assertContains(self.client.get(reverse('home')), '07:15')
+
+        # Same version stamp, so the cached row is still served
+        Trip.objects.filter(pk=self.trip.pk).update(departure_time=datetime.time(7, 45), updated_at=self.trip.updated_at)
+        self.assertContains(self.client.get(reverse('home')), '07:15')
+
+        self.trip.refresh_from_db()
+        self.trip.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, '07:45')
+        self.assertNotContains(response, '07:15')
+
+
+class BulkScheduleTests(TestCase):
+    def setUp(self):
+        build_network()
+
+    def test_bulk_schedule_creates_subtypes_and_durations(self):
+        """
+        Unit Test: Bulk-loaded trips get their subtype rows and durations,
+        including the overnight wrap.
+        """
+        from apps.home.scheduling import bulk_schedule_trips
+
+        created = bulk_schedule_trips([
+            {'trip_id': '20240620L900', 'trip_type': 'L', 'route_id': '500001', 'train_id': '100001',
+             'schedule_day': '2024-06-20', 'departure_time': '23:30', 'arrival_time': '00:15', 'trip_cost': '20'},
+            {'trip_id': '20240620I901', 'trip_type': 'I', 'route_id': '600001', 'train_id': '200001',
+             'schedule_day': '2024-06-20', 'departure_time': '08:00', 'arrival_time': '10:00', 'trip_cost': '75'},
+        ])
+
+        self.assertEqual(created, 2)
+        self.assertEqual(Trip.objects.get(pk='20240620L900').duration, datetime.timedelta(minutes=45))
+        self.assertEqual(Trip.objects.get(pk='20240620I901').duration, datetime.timedelta(hours=2))
+        self.assertTrue(L_Trip.objects.filter(l_trip_id='20240620L900', s_train='100001', l_route='500001').exists())
+        self.assertTrue(I_Trip.objects.filter(i_trip_id='20240620I901', a_train='200001', i_route='600001').exists())
+
+    def test_bulk_schedule_rejects_mismatched_foreign_keys(self):
+        """
+        Unit Test: An inter-town route on a local trip rejects the whole load.
+        """
+        from django.core.exceptions import ValidationError
+        from apps.home.scheduling import bulk_schedule_trips
+
+        with self.assertRaises(ValidationError):
+            bulk_schedule_trips([
+                {'trip_id': '20240620L902', 'trip_type': 'L', 'route_id': '600001', 'train_id': '100001',
+                 'schedule_day': '2024-06-20', 'departure_time': '09:00', 'arrival_time': '09:45'},
+            ])
+        self.assertFalse(Trip.objects.filter(pk='20240620L902').exists())
+
+    def test_queryset_update_recomputes_duration(self):
+        """
+        Unit Test: Retiming trips with .update() keeps duration in sync.
+        """
+        Trip.objects.bulk_create([Trip(
+            trip_id='20240620L903', trip_type='L', schedule_day=datetime.date(2024, 6, 20),
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 45)
+        )])
+        self.assertEqual(Trip.objects.get(pk='20240620L903').duration, datetime.timedelta(minutes=45))
+
+        Trip.objects.filter(pk='20240620L903').update(arrival_time=datetime.time(8, 0))
+        self.assertEqual(Trip.objects.get(pk='20240620L903').duration, datetime.timedelta(hours=23))
+
+
+class ServicePatternTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.monday = datetime.date(2030, 1, 7)
+        self.pattern = Service_Pattern.objects.create(
+            route_id='500001', train_id='100001', trip_type='L', trip_cost=20,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 45),
+            days_of_week=Service_Pattern.WEEKDAYS, valid_from=self.monday
+        )
+        Service_Exception.objects.create(service_pattern=self.pattern, date=self.monday + datetime.timedelta(days=2), exception_type='Cancelled')
+        Service_Exception.objects.create(service_pattern=self.pattern, date=self.monday + datetime.timedelta(days=5), exception_type='Extra')
+
+    def test_expansion_applies_mask_and_exceptions(self):
+        """
+        Unit Test: A weekday pattern skips the weekend and the cancelled Wednesday,
+        runs on the extra Saturday, and stores no Trip rows while expanding.
+        """
+        from apps.home.patterns import expand_patterns
+
+        days = [t.schedule_day.weekday() for t in expand_patterns(self.monday, self.monday + datetime.timedelta(days=6))]
+        self.assertEqual(days, [0, 1, 3, 4, 5])
+        self.assertEqual(Trip.objects.count(), 0)
+
+    def test_booking_materializes_only_the_booked_departure(self):
+        """
+        Integration Test: Booking a pattern departure creates exactly that Trip
+        (with its L_Trip row) and the ticket that references it.
+        """
+        user = User.objects.create_user(username='0004', password='securepassword123')
+        customer = Customer.objects.create(user=user, last_name='Pevensie', given_name='Susan', birth_date=datetime.date(2000, 2, 2), customer_id='0004')
+        self.client.login(username='0004', password='securepassword123')
+        day = self.next_weekday()
+        # The train has to come back for the next day's departure, or the trip is not sellable
+        Service_Pattern.objects.create(
+            route_id='500002', train_id='100001', trip_type='L', departure_time=datetime.time(12, 0),
+            arrival_time=datetime.time(12, 45), days_of_week=Service_Pattern.WEEKDAYS, valid_from=datetime.date.today()
+        )
+
+        trip_id = self.pattern.trip_id_for(day)
+        self.client.post(reverse('ticket_sales'), {'trip_date': day, 'trips': [trip_id]})
+
+        self.assertEqual(list(Trip.objects.values_list('trip_id', flat=True)), [trip_id])
+        self.assertTrue(L_Trip.objects.filter(l_trip_id=trip_id).exists())
+        self.assertEqual(Ticket.objects.get(customer=customer).total_cost, 20)
+
+    def test_rejected_purchases_create_no_trips(self):
+        """
+        Unit Test: Departures beyond the booking horizon are refused, and a purchase
+        that fails validation or the customer check materializes nothing.
+        """
+        User.objects.create_user(username='0005', password='securepassword123')
+        self.client.login(username='0005', password='securepassword123')
+        day = self.next_weekday()
+
+        far = self.pattern.trip_id_for(datetime.date.today() + datetime.timedelta(days=400))
+        self.client.post(reverse('ticket_sales'), {'trip_date': day, 'trips': [far]})
+        self.client.post(reverse('ticket_sales'), {'trips': [self.pattern.trip_id_for(day)]})
+        # Valid departure, but the user has no customer profile
+        self.client.post(reverse('ticket_sales'), {'trip_date': day, 'trips': [self.pattern.trip_id_for(day)]})
+        self.assertEqual(Trip.objects.count(), 0)
+
+    def next_weekday(self):
+        Service_Pattern.objects.filter(pk=self.pattern.pk).update(valid_from=datetime.date.today())
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        while day.weekday() >= 5:
+            day += datetime.timedelta(days=1)
+        return day
+
+
+class TrainConflictTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.day = datetime.date(2024, 6, 20)
+
+    def make_trip(self, trip_id, route_id, dep, arr):
+        trip = Trip(trip_id=trip_id, route_id=route_id, train_id='100001', trip_type='L', schedule_day=self.day,
+                    departure_time=dep, arrival_time=arr)
+        # The sweep tests need conflicting rows in the table
+        trip.save(check_conflicts=False)
+        return trip
+
+    def test_sweep_detects_each_conflict_kind(self):
+        """
+        Unit Test: Overlaps, short turnarounds and location jumps are all reported.
+        """
+        from apps.home.conflicts import detect_conflicts, intervals_from_queryset
+
+        # 500001: Lantern Waste -> Beaversdam, 500002: Beaversdam -> Lantern Waste, 500003: Beaversdam -> Beruna
+        self.make_trip('20240620L101', '500001', datetime.time(8, 0), datetime.time(8, 45))
+        self.make_trip('20240620L102', '500002', datetime.time(8, 30), datetime.time(9, 15))   # overlaps L101
+        self.make_trip('20240620L103', '500002', datetime.time(9, 20), datetime.time(10, 5))   # 5 min turnaround
+        self.make_trip('20240620L104', '500003', datetime.time(12, 0), datetime.time(12, 45))  # train is at Lantern Waste
+
+        kinds = {c.second: c.kind for c in detect_conflicts(intervals_from_queryset(Trip.objects.all()))}
+        self.assertEqual(kinds, {'20240620L102': 'overlap', '20240620L103': 'turnaround', '20240620L104': 'discontinuity'})
+
+    def test_trip_clean_rejects_double_booking(self):
+        """
+        Unit Test: Validating a trip (as the admin does on save) rejects a train that is
+        already busy, and so does a plain save() that skips form validation.
+        """
+        from django.core.exceptions import ValidationError
+
+        self.make_trip('20240620L105', '500001', datetime.time(8, 0), datetime.time(8, 45))
+        clash = Trip(trip_id='20240620L106', route_id='500003', train_id='100001', trip_type='L', schedule_day=self.day,
+                     departure_time=datetime.time(8, 15), arrival_time=datetime.time(9, 0))
+        with self.assertRaises(ValidationError):
+            clash.full_clean()
+        with self.assertRaises(ValidationError):
+            clash.save()
+        self.assertFalse(Trip.objects.filter(pk='20240620L106').exists())
+
+    def test_pattern_clean_checks_recurring_departures(self):
+        """
+        Unit Test: A service pattern is checked against its train's trips and other
+        patterns; an out-and-back pair is valid, a one-way pattern never brings the train back.
+        """
+        from django.core.exceptions import ValidationError
+
+        day = datetime.date.today() + datetime.timedelta(days=1)
+
+        def pattern(route_id, hour):
+            return Service_Pattern(route_id=route_id, train_id='100001', trip_type='L', days_of_week=Service_Pattern.EVERY_DAY,
+                                   departure_time=datetime.time(hour, 0), arrival_time=datetime.time(hour, 45), valid_from=day)
+
+        def trip(trip_id, route_id, dep, arr):
+            return Trip(trip_id=f'{day:%Y%m%d}{trip_id}', route_id=route_id, train_id='100001', trip_type='L',
+                        schedule_day=day, departure_time=dep, arrival_time=arr)
+
+        outbound = pattern('500001', 8)
+        with self.assertRaisesMessage(ValidationError, 'Discontinuity'):
+            outbound.full_clean()
+        outbound.save()
+        pattern('500002', 10).full_clean()
+
+        # A one-off trip now clashes with the train's pattern departure...
+        with self.assertRaises(ValidationError):
+            trip('L107', '500003', datetime.time(8, 15), datetime.time(8, 50)).save()
+        # ...and a pattern over an existing trip is rejected too
+        trip('L108', '500002', datetime.time(9, 50), datetime.time(10, 30)).save(check_conflicts=False)
+        with self.assertRaisesMessage(ValidationError, 'Overlap'):
+            pattern('500002', 10).full_clean()
+
+
+class MaintenanceDueTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.task = Task.objects.create(task_name='Brake Inspection', interval_days=30)
+
+    def log(self, day):
+        log = Maintenance_Log(date=day, train_id='100001', condition='Good')
+        log.save()
+        Log_Task.objects.create(log=log, task=self.task)
+        return log
+
+    def test_index_tracks_latest_run_incrementally(self):
+        """
+        Unit Test: Logging a task moves the due date forward; an older backfilled
+        log does not, and deleting the latest run falls back to the previous one.
+        """
+        latest = self.log(datetime.date(2024, 6, 1))
+        self.log(datetime.date(2024, 5, 1))
+
+        entry = Maintenance_Due.objects.get(train_id='100001', task=self.task)
+        self.assertEqual(entry.due_date, datetime.date(2024, 7, 1))
+
+        Log_Task.objects.filter(log=latest).delete()
+        entry.refresh_from_db()
+        self.assertEqual(entry.due_date, datetime.date(2024, 5, 31))
+
+        self.task.interval_days = 10
+        self.task.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.due_date, datetime.date(2024, 5, 11))
+
+    def test_maintenance_windows_skip_scheduled_trips(self):
+        """
+        Unit Test: Free windows are the gaps between a train's trips.
+        """
+        from apps.home.maintenance import maintenance_windows
+
+        day = datetime.date(2024, 6, 20)
+        Trip(trip_id='20240620L201', route_id='500001', train_id='100001', trip_type='L', schedule_day=day,
+             departure_time=datetime.time(8, 0), arrival_time=datetime.time(20, 0)).save()
+
+        windows = maintenance_windows('100001', day, day, min_hours=4)
+        self.assertEqual(windows, [
+            (datetime.datetime(2024, 6, 20, 0, 0), datetime.datetime(2024, 6, 20, 8, 0)),
+            (datetime.datetime(2024, 6, 20, 20, 0), datetime.datetime(2024, 6, 21, 0, 0)),
+        ])
+
+        # The whole fleet costs one trip query and one pattern expansion
+        from apps.home.maintenance import fleet_maintenance_windows
+        with self.assertNumQueries(2):
+            fleet = fleet_maintenance_windows(['100001', '200001'], day, day, min_hours=4)
+        self.assertEqual(fleet['100001'], windows)
+        self.assertEqual(fleet['200001'], [(datetime.datetime(2024, 6, 20, 0, 0), datetime.datetime(2024, 6, 21, 0, 0))])
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    # SimpleTestCase: no wrapping transaction, which would pin every read to the primary
+    def setUp(self):
+        from core.db_router import PrimaryReplicaRouter
+        pin_to_primary(False)
+        self.router = PrimaryReplicaRouter()
+
+    def tearDown(self):
+        pin_to_primary(False)
+
+    def test_reads_go_to_replica_unless_pinned(self):
+        """
+        Unit Test: Plain reads use the replica; primary_db() and earlier writes
+        in the same context keep reads on the primary.
+        """
+        from unittest import mock
+        from core.db_router import primary_db
+
+        self.assertEqual(self.router.db_for_read(Trip), 'replica')
+        with primary_db():
+            self.assertEqual(self.router.db_for_read(Trip), 'default')
+        self.assertEqual(self.router.db_for_read(Trip), 'replica')
+
+        self.assertEqual(self.router.db_for_write(Trip), 'default')
+        self.assertEqual(self.router.db_for_read(Trip), 'default')
+        with mock.patch.dict(settings.DATABASES, {'replica_0': {'TEST': {'MIRROR': 'default'}}}):
+            self.assertFalse(self.router.allow_migrate('replica_0', 'home'))
+        self.assertTrue(self.router.allow_migrate('default', 'home'))
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaStickinessTests(TestCase):
+    def tearDown(self):
+        pin_to_primary(False)
+
+    def test_write_sets_sticky_cookie(self):
+        """
+        Integration Test: A POST pins the client to the primary for the stickiness window.
+        """
+        from core.db_router import STICKY_COOKIE
+
+        response = self.client.post(reverse('login'), {'username': 'nobody', 'password': 'x'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertNotIn(STICKY_COOKIE, self.client.get(reverse('login')).cookies)
+
+
+@skipUnless('replica' in settings.DATABASES, "Set DB_REPLICA_NAME to run against a second database")
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaDatabaseTests(TransactionTestCase):
+    # Two real databases holding different rows, so every read shows where it was served from
+    # (the runner sets up the databases of skipped classes too, hence the guard)
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        Station.objects.using('default').bulk_create([Station(station_id='300001', station_name='On primary', station_type='L')])
+        Station.objects.using('replica').bulk_create([Station(station_id='300001', station_name='On replica', station_type='L')])
+        pin_to_primary(False)
+
+    def tearDown(self):
+        pin_to_primary(False)
+
+    def read(self, request=None):
+        return HttpResponse(Station.objects.get(pk='300001').station_name)
+
+    def test_reads_come_from_the_replica_until_a_write(self):
+        """
+        Integration Test: Reads are served by the replica; after a write in the same
+        context they go back to the primary.
+        """
+        self.assertEqual(self.read().content, b'On replica')
+        Station.objects.filter(pk='300001').update(station_type='L')
+        self.assertEqual(self.read().content, b'On primary')
+
+    def test_sticky_cookie_reads_from_the_primary(self):
+        """
+        Integration Test: A request carrying the stickiness cookie reads from the
+        primary, and a write hands the client a fresh cookie.
+        """
+        from core.db_router import STICKY_COOKIE, ReplicaStickinessMiddleware
+
+        middleware = ReplicaStickinessMiddleware(self.read)
+        self.assertEqual(middleware(RequestFactory().get('/')).content, b'On replica')
+
+        request = RequestFactory().get('/')
+        request.COOKIES[STICKY_COOKIE] = str(time.time() + 60)
+        self.assertEqual(middleware(request).content, b'On primary')
+
+        def write_then_read(request):
+            Station.objects.filter(pk='300001').update(station_type='L')
+            return self.read()
+
+        response = ReplicaStickinessMiddleware(write_then_read)(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'On primary')
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(middleware(RequestFactory().get('/')).content, b'On replica')
+
+
+class AsyncReadApiTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.day = datetime.date(2030, 1, 7)
+        self.user = User.objects.create_user(username='0006', password='securepassword123')
+        self.customer = Customer.objects.create(user=self.user, last_name='Pevensie', given_name='Edmund', birth_date=datetime.date(2000, 6, 6), customer_id='0006')
+        self.trip = Trip.objects.create(
+            trip_id='20300107L001', route_id='500003', train_id='100001', trip_type='L', trip_cost=15,
+            departure_time=datetime.time(11, 0), arrival_time=datetime.time(11, 30), schedule_day=self.day
+        )
+        Service_Pattern.objects.create(
+            route_id='500001', train_id='100001', trip_type='L', trip_cost=20,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 45),
+            days_of_week=Service_Pattern.WEEKDAYS, valid_from=self.day
+        )
+        ticket = Ticket.objects.create(customer=self.customer, trip_date=self.day)
+        ticket.trips.set([self.trip])
+        self.async_client.force_login(self.user)
+
+    async def test_schedule_and_search_read_asynchronously(self):
+        """
+        Integration Test: The async schedule board merges pattern departures with
+        concrete trips, and trip search matches stations by name.
+        """
+        board = (await self.async_client.get(reverse('schedule_board_api'), {'date': '2030-01-07'})).json()
+        self.assertEqual([t['departure_time'] for t in board['trips']], ['08:00', '11:00'])
+
+        found = (await self.async_client.get(reverse('trip_search_api'), {'origin': 'beaversdam', 'date': '2030-01-01'})).json()
+        self.assertEqual([t['trip_id'] for t in found['trips']], ['20300107L001'])
+
+    async def test_ticket_api_lists_own_tickets_and_requires_login(self):
+        """
+        Integration Test: The async ticket API returns the customer's tickets and
+        redirects anonymous clients to the login page.
+        """
+        tickets = (await self.async_client.get(reverse('ticket_summary_api'))).json()['tickets']
+        self.assertEqual([t['trips'][0]['trip_id'] for t in tickets], ['20300107L001'])
+
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse('ticket_summary_api'))
+        self.assertEqual(response.status_code, 302)
+
+
+class TripSearchTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        build_network()
+        self.day = datetime.date(2030, 1, 7)
+        user = User.objects.create_user(username='0008', password='securepassword123')
+        Customer.objects.create(user=user, last_name='Pevensie', given_name='Lucy', birth_date=datetime.date(2000, 8, 8), customer_id='0008')
+        # No trains: these departures are not a runnable timetable, only search fixtures
+        for trip_id, route_id, hour in [('L001', '500001', 8), ('L002', '500001', 17), ('L003', '500003', 9)]:
+            Trip.objects.create(
+                trip_id=f'20300107{trip_id}', route_id=route_id, trip_type='L', trip_cost=15,
+                departure_time=datetime.time(hour, 0), arrival_time=datetime.time(hour, 30), schedule_day=self.day
+            )
+        Trip.objects.create(
+            trip_id='20300108L001', route_id='500001', trip_type='L', trip_cost=15,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 30), schedule_day=self.day + datetime.timedelta(days=1)
+        )
+        self.client.login(username='0008', password='securepassword123')
+
+    def test_search_filters_by_stations_day_and_time_and_is_cached(self):
+        """
+        Unit Test: Stations (ID or name), the day and the departure window narrow
+        the results; a repeated search is served from the cache without queries.
+        """
+        from unittest import mock
+        from apps.home.search import TripQuery, search_trips
+
+        query = TripQuery(origin='lantern waste', destination='300002', date=self.day, until=self.day, before=datetime.time(12, 0))
+        self.assertEqual([t.trip_id for t in search_trips(query)], ['20300107L001'])
+        with self.assertNumQueries(0):
+            self.assertEqual([t.trip_id for t in search_trips(query)], ['20300107L001'])
+
+        self.assertEqual(search_trips(TripQuery(origin='Beruna', destination='Lantern Waste', date=self.day)), [])
+        found = self.client.get(reverse('trip_search_api'), {'origin': '300001', 'date': '2030-01-07', 'after': '08:00'}).json()
+        self.assertEqual([t['trip_id'] for t in found['trips']], ['20300107L001', '20300107L002', '20300108L001'])
+        # A repeated API search is answered from the cache without running the search
+        with mock.patch('apps.home.search.afind_trips') as afind_trips:
+            again = self.client.get(reverse('trip_search_api'), {'origin': '300001', 'date': '2030-01-07', 'after': '08:00'}).json()
+        afind_trips.assert_not_called()
+        self.assertEqual(again, found)
+
+    def test_pages_show_only_matching_trips(self):
+        """
+        Integration Test: A search on the ticket page or the schedule replaces the
+        full trip list; without one, every trip is listed.
+        """
+        params = {'origin': '300002', 'date': '2030-01-07'}
+        response = self.client.get(reverse('ticket_sales'), params)
+        self.assertEqual([t.trip_id for t in response.context['trips']], ['20300107L003'])
+
+        response = self.client.get(reverse('home'), params)
+        self.assertEqual([t.trip_id for t in response.context['local_trips']], ['20300107L003'])
+
+        response = self.client.get(reverse('ticket_sales'))
+        self.assertEqual(len(response.context['trips']), 4)
+
+
+class TicketHistoryTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.today = datetime.date.today()
+        self.trip = Trip.objects.create(
+            trip_id='20300107L001', route_id='500001', train_id='100001', trip_type='L', trip_cost=15,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 30), schedule_day=datetime.date(2030, 1, 7)
+        )
+        self.customers = []
+        for i, count in enumerate([3, 40]):
+            user = User.objects.create_user(username=f'004{i}', password='securepassword123')
+            customer = Customer.objects.create(user=user, last_name='Pevensie', given_name='Susan', birth_date=datetime.date(2000, 4, 4), customer_id=f'004{i}')
+            tickets = Ticket.objects.bulk_create([
+                Ticket(ticket_id=f'T{i}{n:04d}', customer=customer, purchase_date=self.today, total_cost=15,
+                       trip_date=self.today + datetime.timedelta(days=n - count // 4))
+                for n in range(count)
+            ])
+            Ticket.trips.through.objects.bulk_create([Ticket.trips.through(ticket=t, trip=self.trip, price=15) for t in tickets])
+            self.customers.append(customer)
+
+    def summary(self, username, **params):
+        self.client.login(username=username, password='securepassword123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('ticket_summary'), params)
+        return response, len(queries)
+
+    def test_history_is_paginated_and_split_by_trip_date(self):
+        """
+        Integration Test: Upcoming tickets come soonest first, a page at a time,
+        past ones latest first; the counters cover the whole history.
+        """
+        response, _ = self.summary('0041')
+        page = response.context['tickets']
+        self.assertEqual((len(page), page.paginator.count), (20, 30))
+        self.assertEqual(page[0].trip_date, self.today)
+        self.assertEqual(page[0].trips.all()[0].origin_name, 'Lantern Waste')
+        self.assertEqual(response.context['stats'], {'tickets': 40, 'upcoming': 30, 'past': 10, 'spend': 600})
+
+        response, _ = self.summary('0041', when='past', page=2)
+        page = response.context['tickets']
+        self.assertEqual((page.number, len(page)), (1, 10))
+        self.assertEqual(page[0].trip_date, self.today - datetime.timedelta(days=1))
+
+    def test_page_cost_does_not_grow_with_history(self):
+        """
+        Performance Test: A customer with 3 tickets and one with 40 cost the same
+        number of queries per page.
+        """
+        _, small = self.summary('0040')
+        _, large = self.summary('0041')
+        self.assertEqual(small, large)
+
+
+class DepartureBoardTests(TestCase):
+    def setUp(self):
+        from apps.home.boards import get_board_store, rebuild_boards
+        get_board_store().flush()
+        build_network()
+        rebuild_boards()
+        self.soon = datetime.datetime.now().replace(second=0, microsecond=0) + datetime.timedelta(hours=2)
+
+    def board(self, station_id, kind='departures'):
+        # Kiosk polling must be answered without touching the database
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('station_board', args=[station_id]), {'kind': kind})
+        return [entry['trip_id'] for entry in response.json()['entries']]
+
+    def test_trip_save_archive_and_delete_update_boards(self):
+        """
+        Integration Test: A saved trip shows on its origin's departures and its
+        destination's arrivals, and leaves both once archived or deleted.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            trip = Trip.objects.create(
+                trip_id='20990101L001', route_id='500003', train_id='100001', trip_type='L', trip_cost=15,
+                departure_time=self.soon.time(), arrival_time=(self.soon + datetime.timedelta(minutes=30)).time(),
+                schedule_day=self.soon.date()
+            )
+        self.assertEqual(self.board('300002'), ['20990101L001'])
+        self.assertEqual(self.board('300003', 'arrivals'), ['20990101L001'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trip.is_archived = True
+            trip.save()
+        self.assertEqual(self.board('300002'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trip.is_archived = False
+            trip.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            trip.delete()
+        self.assertEqual(self.board('300003', 'arrivals'), [])
+        self.assertEqual(self.client.get(reverse('station_board', args=['999999'])).status_code, 404)
+
+    def test_pattern_departures_follow_exceptions(self):
+        """
+        Integration Test: Upcoming pattern departures appear on the board and a
+        cancellation takes them off again.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            pattern = Service_Pattern.objects.create(
+                route_id='500001', train_id='100001', trip_type='L', trip_cost=20,
+                departure_time=self.soon.time(), arrival_time=(self.soon + datetime.timedelta(minutes=45)).time(),
+                days_of_week=Service_Pattern.EVERY_DAY, valid_from=self.soon.date() - datetime.timedelta(days=1)
+            )
+        trip_id = pattern.trip_id_for(self.soon.date())
+        self.assertIn(trip_id, self.board('300001'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Service_Exception.objects.create(service_pattern=pattern, date=self.soon.date(), exception_type='Cancelled')
+        self.assertNotIn(trip_id, self.board('300001'))
+
+    def test_network_edits_queue_one_rebuild(self):
+        """
+        Integration Test: A burst of station and train edits queues a single board
+        rebuild on a worker instead of rebuilding inside each save.
+        """
+        from unittest import mock
+        from django.core.cache import cache
+        from apps.home.boards import REBUILD_PENDING_KEY
+
+        cache.delete(REBUILD_PENDING_KEY)
+        with mock.patch('apps.home.tasks.refresh_departure_boards.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                for station in Station.objects.all():
+                    station.save()
+                Train.objects.get(pk='100001').save()
+        delay.assert_called_once_with()
+        cache.delete(REBUILD_PENDING_KEY)
+
+    def test_bulk_retime_and_repricing_update_boards(self):
+        """
+        Integration Test: Queryset retimes and repricing, which send no post_save,
+        still move the trip and its fare on the boards.
+        """
+        import json
+        from apps.home.boards import get_board_store, TRIPS_KEY
+        from apps.home.pricing import reprice_trips
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.create(
+                trip_id='20990101L001', route_id='500003', train_id='100001', trip_type='L', trip_cost=15,
+                departure_time=self.soon.time(), arrival_time=(self.soon + datetime.timedelta(minutes=30)).time(),
+                schedule_day=self.soon.date()
+            )
+        later = self.soon + datetime.timedelta(minutes=20)
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.filter(pk='20990101L001').update(
+                departure_time=later.time(), arrival_time=(later + datetime.timedelta(minutes=30)).time()
+            )
+        entry = json.loads(get_board_store().hget(TRIPS_KEY, '20990101L001'))
+        self.assertEqual(entry['departs'], later.timestamp())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = reprice_trips(days=2)
+        entry = json.loads(get_board_store().hget(TRIPS_KEY, '20990101L001'))
+        self.assertEqual(result.changed, 1)
+        self.assertEqual(entry['fare'], Trip.objects.get(pk='20990101L001').trip_cost)
+
+
+class IndexAdvisorTests(TestCase):
+    def test_suggests_partial_composite_index_from_workload(self):
+        """
+        Unit Test: A recorded Trip query that scans and sorts yields one index:
+        equality column, then the range/sort columns, partial on the boolean filter.
+        """
+        from apps.home.index_advisor import record_workload, analyse
+
+        with record_workload() as recorder:
+            list(Trip.objects.filter(
+                is_archived=False, trip_type='L', trip_cost__gte=20
+            ).order_by('trip_cost', 'departure_time'))
+
+        findings, suggestions = analyse(recorder.shapes.values(), min_rows=0)
+        self.assertTrue(any(f.table == 'home_trip' and f.kind == 'seq_scan' for f in findings))
+        self.assertEqual(
+            [(s.fields, s.condition) for s in suggestions],
+            [(['trip_type', 'trip_cost', 'departure_time'], (('is_archived', False),))]
+        )
+
+
+    def test_test_runs_are_analysed_on_their_own_databases(self):
+        """
+        Unit Test: A recorded test run can't be mixed with a workload from another
+        database, since its shapes are EXPLAINed inside the run.
+        """
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            call_command('advise_indexes', run=['test apps.home'], workload='workload.jsonl')
+
+class TicketTotalTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='0007', password='securepassword123')
+        self.customer = Customer.objects.create(user=user, last_name='Pevensie', given_name='Peter', birth_date=datetime.date(2000, 7, 7), customer_id='0007')
+        self.trips = [
+            Trip.objects.create(
+                trip_id=f'20300107L00{i}', trip_type='L', trip_cost=10 * i, schedule_day=datetime.date(2030, 1, 7),
+                departure_time=datetime.time(8 + i, 0), arrival_time=datetime.time(8 + i, 30)
+            )
+            for i in (1, 2)
+        ]
+        self.ticket = Ticket.objects.create(customer=self.customer, trip_date=datetime.date(2030, 1, 7))
+        self.ticket.trips.set(self.trips)
+
+    def total(self):
+        return Ticket.objects.values_list('total_cost', flat=True).get(pk=self.ticket.pk)
+
+    def test_repricing_keeps_sold_fares_and_links_keep_totals_consistent(self):
+        """
+        Integration Test: Repricing a trip (save or queryset update) leaves tickets
+        already sold at their fares; new tickets pay the new fares, and removing
+        trips from the trip side updates the total in the database.
+        """
+        self.assertEqual(self.total(), 30)
+
+        self.trips[0].trip_cost = 15
+        self.trips[0].save()
+        Trip.objects.filter(pk=self.trips[1].pk).update(trip_cost=25)
+        self.assertEqual(self.total(), 30)
+
+        later = Ticket.objects.create(customer=self.customer, trip_date=datetime.date(2030, 1, 7))
+        later.trips.set(self.trips)
+        self.assertEqual(Ticket.objects.get(pk=later.pk).total_cost, 40)
+        self.assertEqual(sorted(later.ticket_trip_set.values_list('price', flat=True)), [15, 25])
+
+        self.trips[1].tickets.remove(self.ticket)
+        self.assertEqual(self.total(), 10)
+
+    def test_reconcile_fixes_drifted_totals(self):
+        """
+        Integration Test: Totals broken behind the ORM's back (bulk through rows) are
+        found by a dry run and repaired chunk by chunk.
+        """
+        from apps.home.ticket_totals import reconcile_totals, totals_maintained_by_database
+
+        extra = Ticket.objects.create(customer=self.customer, trip_date=datetime.date(2030, 1, 7))
+        Ticket.trips.through.objects.bulk_create([Ticket.trips.through(ticket_id=extra.pk, trip_id=self.trips[0].pk)])
+        Ticket.objects.filter(pk=self.ticket.pk).update(total_cost=999)
+
+        # The PostgreSQL triggers already priced the bulk link; only the direct overwrite drifted
+        drifted = 1 if totals_maintained_by_database() else 2
+        self.assertEqual(reconcile_totals(chunk_size=1, dry_run=True), (2, drifted))
+        self.assertEqual(reconcile_totals(chunk_size=1), (2, drifted))
+        self.assertEqual(sorted(Ticket.objects.values_list('total_cost', flat=True)), [10, 30])
+
+
+@skipUnless(connection.vendor == 'postgresql', "The ticket total triggers (migrations 0010 and 0013) are PostgreSQL only")
+class TicketTotalTriggerTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='0008', password='securepassword123')
+        customer = Customer.objects.create(user=user, last_name='Pevensie', given_name='Susan', birth_date=datetime.date(2000, 8, 8), customer_id='0008')
+        self.trips = [
+            Trip.objects.create(
+                trip_id=f'20300108L00{i}', trip_type='L', trip_cost=10 * i, schedule_day=datetime.date(2030, 1, 8),
+                departure_time=datetime.time(8 + i, 0), arrival_time=datetime.time(8 + i, 30)
+            )
+            for i in (1, 2, 3)
+        ]
+        self.ticket = Ticket.objects.create(customer=customer, trip_date=datetime.date(2030, 1, 8))
+
+    def total(self):
+        return Ticket.objects.values_list('total_cost', flat=True).get(pk=self.ticket.pk)
+
+    def execute(self, sql, params):
+        # Raw SQL: nothing on the app side knows these rows changed
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def test_triggers_price_links_and_keep_totals(self):
+        """
+        Integration Test: On PostgreSQL, links inserted or deleted by any statement
+        are priced and totalled by the database, and repricing a trip leaves the
+        tickets already sold at their fares.
+        """
+        self.execute(
+            "INSERT INTO home_ticket_trips (ticket_id, trip_id) VALUES (%s, %s), (%s, %s)",
+            [self.ticket.pk, self.trips[0].pk, self.ticket.pk, self.trips[1].pk]
+        )
+        self.assertEqual(self.total(), 30)
+        self.assertEqual(sorted(Ticket_Trip.objects.filter(ticket=self.ticket).values_list('price', flat=True)), [10, 20])
+
+        self.execute("UPDATE home_trip SET trip_cost = trip_cost * 2", [])
+        Trip.objects.filter(pk=self.trips[2].pk).update(trip_cost=35)
+        self.assertEqual(self.total(), 30)
+
+        Ticket_Trip.objects.bulk_create([Ticket_Trip(ticket=self.ticket, trip=self.trips[2])])
+        self.assertEqual(self.total(), 65)
+
+        self.execute("DELETE FROM home_ticket_trips WHERE ticket_id = %s AND trip_id = %s", [self.ticket.pk, self.trips[0].pk])
+        self.assertEqual(self.total(), 55)
+        Ticket_Trip.objects.filter(ticket=self.ticket).delete()
+        self.assertEqual(self.total(), 0)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        model = Train_Model.objects.create(model_name='P-001', seat_capacity=4)
+        train = Train.objects.create(train_id='100008', train_number='S1008', train_series='S', train_model=model)
+        user = User.objects.create_user(username='0030', password='securepassword123')
+        self.customer = Customer.objects.create(user=user, last_name='Archenland', given_name='Cor', birth_date=datetime.date(2000, 1, 1), customer_id='0030')
+        self.today = datetime.date.today()
+        self.day = self.today + datetime.timedelta(days=10)
+        self.full, self.empty = [
+            Trip.objects.create(
+                trip_id=f'{self.day:%Y%m%d}L00{i}', train=train, trip_type='L', trip_cost=20, schedule_day=self.day,
+                departure_time=datetime.time(8 + i, 0), arrival_time=datetime.time(8 + i, 30)
+            )
+            for i in (1, 2)
+        ]
+        later = self.today + datetime.timedelta(days=60)
+        self.early = Trip.objects.create(
+            trip_id=f'{later:%Y%m%d}L001', trip_type='L', trip_cost=20, schedule_day=later,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 30)
+        )
+        self.tickets = []
+        for _ in range(4):
+            ticket = Ticket.objects.create(customer=self.customer, trip_date=self.day)
+            ticket.trips.add(self.full)
+            self.tickets.append(ticket)
+
+    def test_fares_follow_demand_and_history_is_recorded(self):
+        """
+        Integration Test: A sold-out trip gets dearer, an empty one cheaper (down to
+        the floor), a distant one gets the early-bird rate; tickets already sold keep
+        their fares, changes are logged, and an unchanged market reprices nothing.
+        """
+        from apps.home.pricing import reprice_trips
+        from apps.home.models import Trip_Price
+        from apps.home.caching import get_schedule_version
+
+        self.assertEqual(reprice_trips(today=self.today, dry_run=True).changed, 3)
+        self.assertEqual(Trip.objects.get(pk=self.full.pk).trip_cost, 20)
+
+        version = get_schedule_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            result = reprice_trips(today=self.today)
+        self.assertEqual((result.priced, result.changed, result.history), (3, 3, 3))
+        # Fares are not topology: network-wide caches keyed on the schedule version survive
+        self.assertEqual(get_schedule_version(), version)
+        fares = dict(Trip.objects.values_list('pk', 'trip_cost'))
+        self.assertEqual([fares[self.full.pk], fares[self.empty.pk], fares[self.early.pk]], [24, 16, 18])
+        self.assertEqual(Trip.objects.get(pk=self.full.pk).base_cost, 20)
+        self.assertEqual(set(Ticket.objects.values_list('total_cost', flat=True)), {20})
+
+        entry = Trip_Price.objects.get(trip=self.full)
+        self.assertEqual((entry.price, entry.base_cost, entry.load_factor, entry.days_to_departure), (24, 20, 1.0, 10))
+
+        self.assertEqual(reprice_trips(today=self.today).changed, 0)
+        self.assertEqual(Trip_Price.objects.count(), 3)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='0008', password='securepassword123')
+        customer = Customer.objects.create(user=user, last_name='Pevensie', given_name='Susan', birth_date=datetime.date(2001, 8, 8), customer_id='0008')
+        self.trip = Trip.objects.create(
+            trip_id='20300108L001', trip_type='L', trip_cost=12, schedule_day=datetime.date(2030, 1, 8),
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        self.ticket = Ticket.objects.create(customer=customer, trip_date=datetime.date(2030, 1, 8))
+        self.ticket.trips.add(self.trip)
+
+    def test_dump_and_load_round_trip(self):
+        """
+        Integration Test: A JSONL dump loaded into emptied tables restores every row,
+        M2M link and stored total, and dumps back to the same lines.
+        """
+        from apps.home.snapshots import dump, load, snapshot_models
+
+        models = snapshot_models()
+        first = io.StringIO()
+        counts = dump(first, models, chunk_size=1)
+        self.assertEqual(counts['home.Ticket'], 1)
+        self.assertEqual(counts['auth.User'], 1)
+
+        for model in reversed(models):
+            model._base_manager.all().delete()
+        first.seek(0)
+        loaded = load(first, batch_size=1)
+        self.assertEqual(loaded, counts)
+
+        ticket = Ticket.objects.get(pk=self.ticket.pk)
+        self.assertEqual(list(ticket.trips.values_list('pk', flat=True)), [self.trip.pk])
+        self.assertEqual(ticket.total_cost, 12)
+        self.assertTrue(User.objects.get(username='0008').check_password('securepassword123'))
+
+        second = io.StringIO()
+        dump(second, models)
+        self.assertEqual(second.getvalue(), first.getvalue())
+
+
+class TicketTokenTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.home.ticket_tokens import reset_revocations
+        cache.clear()
+        reset_revocations()
+
+        self.user = User.objects.create_user(username='0009', password='securepassword123')
+        customer = Customer.objects.create(user=self.user, last_name='Pevensie', given_name='Edmund', birth_date=datetime.date(2002, 9, 9), customer_id='0009')
+        self.today = datetime.date.today()
+        self.trip = Trip.objects.create(
+            trip_id=f'{self.today:%Y%m%d}L001', trip_type='L', trip_cost=12, schedule_day=self.today,
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        self.ticket = Ticket.objects.create(customer=customer, trip_date=self.today)
+        self.ticket.trips.add(self.trip)
+
+    def scan(self, token, **params):
+        # Gate scans must be answered without touching the database
+        with self.assertNumQueries(0):
+            return self.client.get(reverse('validate_ticket'), {'token': token, **params}).json()
+
+    def test_gate_validates_tokens_statelessly(self):
+        """
+        Integration Test: A ticket's token passes at the gate on its travel date and
+        for its trips; tampered, other-day and other-trip scans are rejected.
+        """
+        from apps.home.ticket_tokens import get_revocations
+        get_revocations()
+        token = self.ticket.token
+
+        result = self.scan(token, trip=self.trip.trip_id)
+        self.assertTrue(result['valid'])
+        self.assertEqual(result['ticket_id'], self.ticket.ticket_id)
+        self.assertEqual(result['trips'], [self.trip.trip_id])
+
+        self.assertEqual(self.scan(token.replace('L001', 'L002', 1))['reason'], 'bad_signature')
+        self.assertEqual(self.scan(token, date=(self.today + datetime.timedelta(days=1)).isoformat())['reason'], 'wrong_date')
+        self.assertEqual(self.scan(token, trip='20990101L009')['reason'], 'wrong_trip')
+
+        response = self.client.post(reverse('validate_ticket'), {'token': [token, 'garbage']})
+        self.assertEqual([r['valid'] for r in response.json()['results']], [True, False])
+
+    def test_cancelled_ticket_is_revoked(self):
+        """
+        Integration Test: Cancelling a ticket republishes the revocation filter, and
+        gate processes pick it up on their next refresh.
+        """
+        from apps.home.ticket_tokens import get_revocations, reset_revocations
+        token = self.ticket.token
+        get_revocations()
+        self.assertTrue(self.scan(token)['valid'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ticket.cancel()
+        reset_revocations()
+        self.assertEqual(self.scan(token)['reason'], 'revoked')
+        self.assertEqual(len(get_revocations()), 1)
+
+    def test_pass_is_a_qr_code_for_the_owner_only(self):
+        """
+        Integration Test: The owner gets an SVG QR code; other users get a 404.
+        """
+        self.client.login(username='0009', password='securepassword123')
+        response = self.client.get(reverse('ticket_pass', args=[self.ticket.ticket_id]))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+        User.objects.create_user(username='0010', password='securepassword123')
+        self.client.login(username='0010', password='securepassword123')
+        self.assertEqual(self.client.get(reverse('ticket_pass', args=[self.ticket.ticket_id])).status_code, 404)
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        model = Train_Model.objects.create(model_name='W-001', seat_capacity=1)
+        train = Train.objects.create(train_id='100009', train_number='S1009', train_series='S', train_model=model)
+        self.day = datetime.date.today() + datetime.timedelta(days=2)
+        self.trip = Trip.objects.create(
+            trip_id=f'{self.day:%Y%m%d}L001', train=train, trip_type='L', trip_cost=20, schedule_day=self.day,
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        self.customers = []
+        for i, name in enumerate(['Caspian', 'Rilian', 'Tirian']):
+            user = User.objects.create_user(username=f'002{i}', password='securepassword123')
+            self.customers.append(Customer.objects.create(user=user, last_name='Telmar', given_name=name, birth_date=datetime.date(2000, 1, 1), customer_id=f'002{i}'))
+
+    def buy(self, username):
+        self.client.login(username=username, password='securepassword123')
+        return self.client.post(reverse('ticket_sales'), {'trip_date': self.day, 'trips': [self.trip.trip_id]})
+
+    def test_sold_out_trip_waitlist_is_promoted_in_order(self):
+        """
+        Integration Test: A full trip refuses the sale and offers the waitlist; a
+        cancellation issues the seat to the first customer in the queue.
+        """
+        self.assertEqual(self.buy('0020').status_code, 200)
+        response = self.buy('0021')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.context['sold_out_trips'], [self.trip.trip_id])
+
+        for username in ('0021', '0022'):
+            self.client.login(username=username, password='securepassword123')
+            self.client.post(reverse('waitlist_join'), {'trips': [self.trip.trip_id]})
+        self.client.post(reverse('waitlist_join'), {'trips': [self.trip.trip_id]})
+        self.assertEqual(Waitlist_Entry.objects.filter(status='Waiting').count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.get(customer=self.customers[0]).cancel()
+
+        promoted = Waitlist_Entry.objects.get(status='Promoted')
+        self.assertEqual(promoted.customer, self.customers[1])
+        self.assertEqual(promoted.ticket.total_cost, 20)
+        self.assertEqual(list(promoted.ticket.trips.all()), [self.trip])
+
+        response = self.client.get(reverse('ticket_summary'))
+        self.assertEqual([entry.position for entry in response.context['waitlist']], [1])
+
+    def test_only_upcoming_sold_out_trips_can_be_waitlisted(self):
+        """
+        Integration Test: A trip with free seats sends the customer back to buy it,
+        and a departed trip can't be waitlisted at all.
+        """
+        self.client.login(username='0021', password='securepassword123')
+        response = self.client.post(reverse('waitlist_join'), {'trips': [self.trip.trip_id]})
+        self.assertRedirects(response, reverse('ticket_sales'), fetch_redirect_response=False)
+
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        past = Trip.objects.create(
+            trip_id=f'{yesterday:%Y%m%d}L001', train=self.trip.train, trip_type='L', trip_cost=20, schedule_day=yesterday,
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        self.buy('0020')
+        self.client.login(username='0021', password='securepassword123')
+        response = self.client.post(reverse('waitlist_join'), {'trips': [past.trip_id]})
+        self.assertRedirects(response, reverse('ticket_summary'), fetch_redirect_response=False)
+        self.assertFalse(Waitlist_Entry.objects.exists())
+
+    def test_expired_entries_and_queued_bookings(self):
+        """
+        Unit Test: Lapsed entries are expired instead of promoted, and the booking
+        worker refuses sold-out trips as well.
+        """
+        from apps.home.waitlist import join_waitlist, promote_waitlists
+
+        entry, _ = join_waitlist(self.customers[2], self.trip)
+        self.assertLessEqual(entry.expires_at, timezone.make_aware(datetime.datetime.combine(self.day, self.trip.departure_time)))
+        Waitlist_Entry.objects.filter(pk=entry.pk).update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(promote_waitlists(), (1, []))
+
+        self.buy('0020')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('booking_create'), {'trip_date': self.day, 'trips': [self.trip.trip_id]}, HTTP_IDEMPOTENCY_KEY='late')
+        booking = Booking_Request.objects.get(idempotency_key='late')
+        self.assertEqual(booking.status, 'Failed')
+        self.assertIn('Sold out', booking.error)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        from apps.home import metrics
+        metrics.reset()
+        model = Train_Model.objects.create(model_name='M-001', seat_capacity=1)
+        train = Train.objects.create(train_id='100010', train_number='S1010', train_series='S', train_model=model)
+        self.day = datetime.date.today() + datetime.timedelta(days=2)
+        self.trip = Trip.objects.create(
+            trip_id=f'{self.day:%Y%m%d}L002', train=train, trip_type='L', trip_cost=20, schedule_day=self.day,
+            departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        for i, name in enumerate(['Shasta', 'Aravis']):
+            user = User.objects.create_user(username=f'003{i}', password='securepassword123')
+            Customer.objects.create(user=user, last_name='Archenland', given_name=name, birth_date=datetime.date(2000, 1, 1), customer_id=f'003{i}')
+
+    def test_bookings_are_exposed(self):
+        """
+        Integration Test: Sales and sold-out refusals are counted, the sale is
+        timed, and /metrics serves them in the text format, only with METRICS_TOKEN.
+        """
+        for username in ('0030', '0031'):
+            self.client.login(username=username, password='securepassword123')
+            self.client.post(reverse('ticket_sales'), {'trip_date': self.day, 'trips': [self.trip.trip_id]})
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrapf').status_code, 401)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version='))
+        body = response.content.decode()
+        self.assertIn('tirian_bookings_total{outcome="issued",path="sync"} 1.0', body)
+        self.assertIn('tirian_bookings_total{outcome="sold_out",path="sync"} 1.0', body)
+        self.assertIn('tirian_booking_seconds_bucket{le="+Inf",path="sync"} 1.0', body)
+        self.assertIn('# TYPE tirian_queue_depth gauge', body)
+
+    def test_multiprocess_mode_merges_processes(self):
+        """
+        Unit Test: With METRICS_DIR set, a forked process writes its own
+        prometheus_client files and a scrape sums counters and histograms over both.
+        """
+        import os
+        from unittest import mock
+        from prometheus_client import values
+        from apps.home import metrics
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.addCleanup(metrics.reset)
+        # What core/settings.py sets up before prometheus_client is first imported
+        with override_settings(METRICS_DIR=directory), \
+                mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}), \
+                mock.patch.object(values, 'ValueClass', values.MultiProcessValue()):
+            metrics.reset()
+            metrics.ID_ALLOCATION_RETRIES.labels('Ticket').inc()
+            pid = os.fork()
+            if pid == 0:
+                metrics.ID_ALLOCATION_RETRIES.labels('Ticket').inc(2)
+                metrics.TASK_SECONDS.labels('apps.home.tasks.archive_past_trips').observe(0.2)
+                os._exit(0)
+            os.waitpid(pid, 0)
+
+            self.assertEqual(len({name.rsplit('_', 1)[-1] for name in os.listdir(directory)}), 2)
+            body = metrics.exposition().decode()
+        self.assertIn('tirian_id_allocation_retries_total{model="Ticket"} 3.0', body)
+        self.assertIn('tirian_task_duration_seconds_bucket{le="0.5",task="apps.home.tasks.archive_past_trips"} 1.0', body)
+        self.assertIn('tirian_task_duration_seconds_count{task="apps.home.tasks.archive_past_trips"} 1.0', body)
+
+
+class JobRunTests(TestCase):
+    def setUp(self):
+        train = Train.objects.create(train_id='100011', train_number='S1011', train_series='S')
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        for i in range(3):
+            Trip.objects.create(
+                trip_id=f'{yesterday:%Y%m%d}L00{i + 3}', train=train, trip_type='L', trip_cost=20, schedule_day=yesterday,
+                departure_time=datetime.time(9 + i, 0), arrival_time=datetime.time(9 + i, 30)
+            )
+
+    def test_task_runs_are_recorded(self):
+        """
+        Integration Test: A task run is stored with its queries and rows written;
+        the cProfile report is kept only for runs over TASK_PROFILE_SECONDS.
+        """
+        from apps.home.models import Job_Run
+        from apps.home.tasks import archive_past_trips, prune_job_runs
+
+        with override_settings(TASK_PROFILE_SECONDS=60):
+            archive_past_trips.delay()
+        run = Job_Run.objects.get()
+        self.assertEqual((run.task_name, run.state), ('apps.home.tasks.archive_past_trips', 'SUCCESS'))
+        self.assertEqual(run.result, 'Archived 3 past trips.')
+        self.assertEqual(run.rows_affected, 3)
+        self.assertGreaterEqual(run.query_count, 2)
+        self.assertEqual(run.profile, '')
+
+        with override_settings(TASK_PROFILE_SECONDS=1e-9):
+            archive_past_trips.delay()
+        self.assertIn('archive_past_trips', Job_Run.objects.latest('pk').profile)
+
+        Job_Run.objects.filter(pk=run.pk).update(started_at=timezone.now() - datetime.timedelta(days=31))
+        prune_job_runs.delay()
+        self.assertFalse(Job_Run.objects.filter(pk=run.pk).exists())
+
+
+class RequestProfileTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        User.objects.create_user(username='staff', password='securepassword123', is_staff=True)
+        User.objects.create_user(username='rider', password='securepassword123')
+
+    def test_staff_trigger(self):
+        """
+        Integration Test: Staff requests with X-Profile or ?_profile= are captured to
+        disk; the same header from other users is ignored.
+        """
+        import os
+        from apps.home.models import Request_Profile
+
+        with override_settings(REQUEST_PROFILE_DIR=self.directory):
+            self.client.login(username='rider', password='securepassword123')
+            self.client.get(reverse('home'), HTTP_X_PROFILE='1')
+            self.assertFalse(Request_Profile.objects.exists())
+
+            self.client.login(username='staff', password='securepassword123')
+            self.client.get(reverse('home'), HTTP_X_PROFILE='1')
+            self.client.get(reverse('home'), {'_profile': 'sample'})
+
+        full, sampled = Request_Profile.objects.order_by('pk')
+        self.assertEqual((full.trigger, full.mode, full.path), ('header', 'cprofile', '/'))
+        self.assertTrue(os.path.exists(full.profile_file))
+        self.assertTrue(os.path.exists(full.stacks_file))
+        self.assertIn('function calls', full.summary)
+        self.assertEqual((sampled.trigger, sampled.mode, sampled.profile_file), ('param', 'sample', ''))
+        self.assertIn('samples every', sampled.summary)
+
+    def test_random_sampling_keeps_recent_captures(self):
+        """
+        Unit Test: REQUEST_PROFILE_SAMPLE_RATE samples anonymous requests, and only
+        the newest REQUEST_PROFILE_KEEP captures (and files) are kept.
+        """
+        import os
+        from apps.home.models import Request_Profile
+
+        with override_settings(REQUEST_PROFILE_DIR=self.directory, REQUEST_PROFILE_SAMPLE_RATE=1.0, REQUEST_PROFILE_KEEP=1):
+            self.client.get(reverse('login'))
+            self.client.get(reverse('register'))
+
+        capture = Request_Profile.objects.get()
+        self.assertEqual((capture.trigger, capture.path), ('sample', reverse('register')))
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(capture.stacks_file)])
+
+
+class NetworkSnapshotTests(TestCase):
+    def setUp(self):
+        build_network()
+        Service_Pattern.objects.create(
+            route_id='500001', train_id='100001', trip_type='L', trip_cost=20,
+            departure_time=datetime.time(8, 0), arrival_time=datetime.time(8, 45),
+            days_of_week=Service_Pattern.WEEKDAYS, valid_from=datetime.date(2030, 1, 7)
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.settings_override = override_settings(NETWORK_SNAPSHOT_PATH=f'{directory}/network.snapshot')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_topology_is_read_from_the_mapped_file(self):
+        """
+        Unit Test: Stations resolve by ID or name, adjacency and route trains come
+        from the arrays, and all of it is answered without queries.
+        """
+        from apps.home.network import get_network
+
+        network = get_network()
+        with self.assertNumQueries(0):
+            beaversdam = network.station_index('300002')
+            self.assertEqual(network.station(beaversdam), ('300002', 'Beaversdam', 'L'))
+            self.assertEqual(network.find_stations('beaversDAM'), [beaversdam])
+            self.assertEqual(sorted(network.station(i)[1] for i in network.neighbours(beaversdam)), ['Beruna', 'Lantern Waste'])
+            self.assertEqual(network.station_route_ids('Anvard', 'origin'), {'600001'})
+            self.assertEqual(network.station_route_ids('400001', 'destination'), {'600002'})
+            self.assertEqual(network.route_trains(network.routes_from(network.station_index('300001'))[0]), ['S1001'])
+            self.assertIsNone(network.station_index('999999'))
+
+    def test_topology_edits_publish_a_new_version(self):
+        """
+        Integration Test: Renaming a station bumps the version; the next read
+        rewrites the shared file and every process remaps it.
+        """
+        from apps.home.network import get_network, load_network_snapshot
+
+        first = get_network()
+        station = Station.objects.get(pk='400002')
+        station.station_name = 'Tashbaan City'
+        station.save()
+
+        network = get_network()
+        self.assertNotEqual(network.version, first.version)
+        self.assertEqual(network.find_stations('tashbaan city'), [network.station_index('400002')])
+        self.assertEqual(load_network_snapshot().version, network.version)
+
+
+class TravelMatrixTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.day = datetime.date.today()
+        for route_id, minutes, cost in (('500001', 30, 20), ('500003', 15, 10), ('500002', 30, 20)):
+            Trip.objects.create(
+                trip_id=f'{self.day:%Y%m%d}L{route_id[-3:]}', route_id=route_id, trip_type='L', trip_cost=cost,
+                schedule_day=self.day, departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, minutes)
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(TRAVEL_MATRIX_DIR=f'{directory}/matrix', NETWORK_SNAPSHOT_PATH=f'{directory}/network.snapshot')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_lookups_and_incremental_refresh(self):
+        """
+        Integration Test: Multi-leg journeys sum the typical leg times and fares; a
+        route change recomputes only the rows that can reach it.
+        """
+        from apps.home.travel_matrix import refresh_travel_matrix, travel_between
+
+        result = refresh_travel_matrix()
+        self.assertEqual((result.stations, result.recomputed_rows), (5, 5))
+        self.assertEqual(travel_between('Lantern Waste', 'beruna')[2], (45, 30, 2))
+        self.assertEqual(travel_between('300002', '300001')[2], (30, 20, 1))
+        # Inter-town links without trips or patterns count as hops only
+        self.assertEqual(travel_between('400001', '400002')[2], (None, None, 1))
+        self.assertIsNone(travel_between('300001', '400001')[2])
+
+        Trip.objects.create(
+            trip_id=f'{self.day:%Y%m%d}I601', route_id='600001', train_id='200001', trip_type='I', trip_cost=90,
+            schedule_day=self.day, departure_time=datetime.time(10, 0), arrival_time=datetime.time(12, 0)
+        )
+        result = refresh_travel_matrix()
+        self.assertEqual(result.recomputed_rows, 2)
+        self.assertEqual(travel_between('Anvard', 'Tashbaan')[2], (120, 90, 1))
+        self.assertEqual(travel_between('300001', '300003')[2], (45, 30, 2))
+
+        response = self.client.get(reverse('travel_between'), {'from': 'Lantern Waste', 'to': '300003'})
+        self.assertEqual(response.json()['to']['station_name'], 'Beruna')
+        self.assertEqual((response.json()['minutes'], response.json()['hops']), (45, 2))
+        self.assertEqual(self.client.get(reverse('travel_between'), {'from': 'Narnia', 'to': '300003'}).status_code, 404)
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        build_network()
+        Station.objects.create(station_id='300004', station_name='Cair Paravel', station_type='L')
+        Station.objects.create(station_id='400003', station_name='Cair Paravel', station_type='I')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(NETWORK_SNAPSHOT_PATH=f'{directory}/network.snapshot')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_ranked_suggestions(self):
+        """
+        Unit Test: Name prefixes come before later-word prefixes, typos still match,
+        same-named stations are told apart by type, and lookups need no queries.
+        """
+        from apps.home.autocomplete import get_station_index
+
+        index = get_station_index()
+        with self.assertNumQueries(0):
+            self.assertEqual([s.label for s in index.suggest('cair')], ['Cair Paravel (Local)', 'Cair Paravel (Inter-town)'])
+            self.assertEqual([s.station_name for s in index.suggest('be')], ['Beaversdam', 'Beruna'])
+            self.assertEqual([s.station_id for s in index.suggest('PARA')], ['300004', '400003'])
+            self.assertEqual([s.station_name for s in index.suggest('wa')], ['Lantern Waste'])
+            self.assertEqual([s.station_name for s in index.suggest('tashban')], ['Tashbaan'])
+            self.assertEqual([s.station_name for s in index.suggest('40000')], ['Anvard', 'Tashbaan', 'Cair Paravel'])
+            self.assertEqual(len(index.suggest('a', limit=1)), 1)
+            self.assertEqual(index.suggest('  '), [])
+
+    def test_station_edits_refresh_the_index(self):
+        """
+        Integration Test: A renamed station is suggested under its new name on the
+        next request.
+        """
+        url = reverse('station_autocomplete')
+        self.assertEqual(self.client.get(url, {'q': 'anv'}).json()['suggestions'][0]['label'], 'Anvard (Inter-town)')
+
+        station = Station.objects.get(pk='400001')
+        station.station_name = 'Archenland Anvard'
+        station.save()
+
+        suggestions = self.client.get(url, {'q': 'arch'}).json()['suggestions']
+        self.assertEqual([s['station_id'] for s in suggestions], ['400001'])
+        self.assertEqual(self.client.get(url, {'q': 'anv'}).json()['suggestions'][0]['station_name'], 'Archenland Anvard')
+        self.assertEqual(self.client.get(url, {'q': 'anv', 'limit': 'x'}).status_code, 400)
+
+    def test_warming_survives_an_unreachable_cache(self):
+        """
+        Unit Test: Process start-up warming logs and skips when the cache holding the
+        schedule version is down, and the first request builds the index instead.
+        """
+        from unittest import mock
+        from apps.home import autocomplete
+
+        with mock.patch('apps.home.autocomplete.get_schedule_version', side_effect=ConnectionError('redis down')), \
+                self.assertLogs('apps.home.autocomplete', 'WARNING'):
+            self.assertIsNone(autocomplete.warm_station_index())
+        self.assertEqual(autocomplete.suggest_stations('anv')[0].station_id, '400001')
+
+
+class ScheduleChangeTests(TestCase):
+    def setUp(self):
+        build_network()
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+        self.trip = Trip.objects.create(
+            trip_id=f'{self.day:%Y%m%d}L001', route_id='500001', train_id='100001', trip_type='L', trip_cost=20,
+            schedule_day=self.day, departure_time=datetime.time(9, 0), arrival_time=datetime.time(9, 30)
+        )
+        self.customers = [
+            Customer.objects.create(given_name=name, last_name='Pevensie', birth_date=datetime.date(1990, 1, 1))
+            for name in ('Peter', 'Susan', 'Edmund')
+        ]
+        # Peter holds two tickets; Edmund's is cancelled
+        for customer in (self.customers[0], self.customers[0], self.customers[1], self.customers[2]):
+            ticket = Ticket(customer=customer, trip_date=self.day)
+            ticket.save()
+            ticket.trips.add(self.trip)
+        ticket.cancel()
+
+    def test_delay_notifies_each_holder_once(self):
+        """
+        Integration Test: A later departure is recorded as a delay and, on commit,
+        every live ticket holder gets one notice; a redelivered fan-out sends nothing.
+        """
+        from apps.home.notifications import fan_out
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.departure_time, self.trip.arrival_time = datetime.time(9, 20), datetime.time(9, 50)
+            self.trip.save()
+
+        change = Schedule_Change.objects.get()
+        self.assertEqual((change.kind, change.old_departure_time, change.new_departure_time), ('Delayed', datetime.time(9, 0), datetime.time(9, 20)))
+        self.assertEqual((change.recipients, change.notified), (2, 2))
+        self.assertIsNone(fan_out(change.pk))
+
+        # Saves that leave the day and times alone, or edit past trips, record nothing
+        self.trip.trip_cost = 25
+        self.trip.save()
+        self.trip.departure_time = datetime.time(8, 0)
+        self.trip.save(update_fields=['trip_cost'])
+        self.assertEqual(Schedule_Change.objects.count(), 1)
+
+    def test_retiming_and_cancellation(self):
+        """
+        Integration Test: An earlier departure is a retiming; deleting the trip keeps
+        its holders on the record before the ticket links go, and notifies them.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.departure_time = datetime.time(8, 45)
+            self.trip.save()
+        self.assertEqual(Schedule_Change.objects.get().kind, 'Retimed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.get(pk=self.trip.pk).delete()
+
+        change = Schedule_Change.objects.get(kind='Cancelled')
+        self.assertEqual(list(change.notice_recipients.order_by('customer').values_list('customer', flat=True)), sorted(c.customer_id for c in self.customers[:2]))
+        self.assertEqual((change.recipients, change.notified), (2, 2))
+
+    def test_fan_out_batches(self):
+        """
+        Unit Test: Recipients are streamed into batches of the requested size.
+        """
+        from apps.home.notifications import fan_out
+
+        change = Schedule_Change.objects.create(
+            trip_id=self.trip.pk, kind='Delayed', old_schedule_day=self.day, old_departure_time=datetime.time(9, 0),
+            old_arrival_time=datetime.time(9, 30), new_schedule_day=self.day, new_departure_time=datetime.time(9, 5),
+            new_arrival_time=datetime.time(9, 35),
+        )
+        from apps.home.models import Job_Run
+
+        self.assertEqual(fan_out(change.pk, batch_size=1), 2)
+        change.refresh_from_db()
+        self.assertEqual(change.notified, 2)
+        self.assertEqual(Job_Run.objects.filter(task_name='apps.home.tasks.send_schedule_change_notices').count(), 2)
+
+    def test_fan_out_resumes_after_a_crash(self):
+        """
+        Unit Test: A fan-out that dies after queueing some batches leaves its cursor
+        behind; the redelivered task queues only the rest, and nobody is skipped.
+        """
+        from unittest import mock
+        from apps.home.notifications import fan_out
+        from apps.home.tasks import send_schedule_change_notices
+
+        change = Schedule_Change.objects.create(
+            trip_id=self.trip.pk, kind='Delayed', old_schedule_day=self.day, old_departure_time=datetime.time(9, 0),
+            old_arrival_time=datetime.time(9, 30), new_schedule_day=self.day, new_departure_time=datetime.time(9, 5),
+            new_arrival_time=datetime.time(9, 35),
+        )
+        queued = []
+
+        def queue_one_then_fail(change_pk, batch):
+            if queued:
+                raise ConnectionError('broker down')
+            queued.append(batch)
+
+        with mock.patch.object(send_schedule_change_notices, 'delay', side_effect=queue_one_then_fail):
+            with self.assertRaises(ConnectionError):
+                fan_out(change.pk, batch_size=1)
+        change.refresh_from_db()
+        self.assertEqual((change.queued_through, change.recipients, change.fanned_out_at), (queued[0][0], 1, None))
+
+        self.assertEqual(fan_out(change.pk, batch_size=1), 2)
+        change.refresh_from_db()
+        self.assertEqual(change.notified, 1)
+        self.assertIsNone(fan_out(change.pk))
@@ -0,0 +1,163 @@
+import base64
+import datetime
+import hashlib
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import BadSignature
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+# Token layout: TICKETID.YYYYMMDD.TRIPID-TRIPID.SIGNATURE
+# Every character is in the QR alphanumeric set (digits, A-Z, '.', '-'), so the
+# code stays small and scans fast; the signature is a 128-bit HMAC in base32.
+TOKEN_SALT = 'home.ticket-token'
+SIGNATURE_BYTES = 16
+
+# Scans per request from a gate flushing its offline buffer
+MAX_GATE_BATCH = 500
+
+REVOCATIONS_KEY = 'home:ticket_revocations'
+REVOCATIONS_VERSION_KEY = 'home:ticket_revocations_version'
+
+TokenClaims = namedtuple('TokenClaims', 'ticket_id trip_date trip_ids')
+
+
+def _signature(payload, secret=None):
+    digest = salted_hmac(TOKEN_SALT, payload, secret=secret, algorithm='sha256').digest()[:SIGNATURE_BYTES]
+    return base64.b32encode(digest).decode().rstrip('=')
+
+
+def issue_token(ticket, trip_ids=None):
+    """
+    The signed token printed on a ticket's QR code. It carries everything a gate
+    checks, so validation needs no database. Uses prefetched trips when available.
+    """
+    if trip_ids is None:
+        trip_ids = [trip.pk for trip in ticket.trips.all()]
+    payload = f"{ticket.ticket_id}.{ticket.trip_date:%Y%m%d}.{'-'.join(sorted(trip_ids))}".upper()
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify_token(token):
+    """
+    Returns the token's claims, or raises BadSignature. Tokens signed with a key in
+    SECRET_KEY_FALLBACKS stay valid while the secret is rotated.
+    """
+    payload, _, signature = token.strip().upper().rpartition('.')
+    for secret in [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]:
+        if constant_time_compare(signature, _signature(payload, secret)):
+            break
+    else:
+        raise BadSignature('Ticket token signature does not match')
+
+    ticket_id, trip_date, trip_ids = payload.split('.')
+    return TokenClaims(ticket_id, datetime.datetime.strptime(trip_date, '%Y%m%d').date(), trip_ids.split('-') if trip_ids else [])
+
+
+def _ticket_hash(ticket_id):
+    return int.from_bytes(hashlib.blake2b(ticket_id.upper().encode(), digest_size=8).digest(), 'big')
+
+
+class RevocationFilter:
+    """
+    Cancelled ticket IDs as a sorted array of 64-bit hashes: 8 bytes per ticket and a
+    binary search per scan. A false positive needs a 64-bit hash collision.
+    """
+    def __init__(self, hashes=(), version=0):
+        self.hashes = array('Q', sorted(set(hashes)))
+        self.version = version
+
+    @classmethod
+    def from_ticket_ids(cls, ticket_ids, version=0):
+        return cls((_ticket_hash(ticket_id) for ticket_id in ticket_ids), version)
+
+    @classmethod
+    def from_bytes(cls, data, version=0):
+        revocations = cls(version=version)
+        revocations.hashes.frombytes(data)
+        return revocations
+
+    def to_bytes(self):
+        return self.hashes.tobytes()
+
+    def __contains__(self, ticket_id):
+        value = _ticket_hash(ticket_id)
+        i = bisect_left(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def publish_revocations():
+    """
+    Rebuilds the filter from the cancelled tickets that can still be presented
+    (tokens expire after their trip date) and shares it with every gate process
+    through the cache. Returns the filter.
+    """
+    from .models import Ticket
+
+    cutoff = datetime.date.today() - datetime.timedelta(days=1)
+    ticket_ids = Ticket.objects.filter(cancelled_at__isnull=False, trip_date__gte=cutoff).values_list('pk', flat=True)
+    revocations = RevocationFilter.from_ticket_ids(ticket_ids, version=time.time_ns())
+    cache.set_many({REVOCATIONS_KEY: revocations.to_bytes(), REVOCATIONS_VERSION_KEY: revocations.version}, None)
+    return revocations
+
+
+_revocations = None
+_checked_at = 0.0
+
+
+def get_revocations():
+    """
+    The process-local filter. Every TICKET_REVOCATION_REFRESH_SECONDS it checks the
+    shared version stamp and downloads the filter only when it changed; the database
+    is read only when the cache has nothing at all.
+    """
+    global _revocations, _checked_at
+    now = time.monotonic()
+    if _revocations is not None and now - _checked_at < settings.TICKET_REVOCATION_REFRESH_SECONDS:
+        return _revocations
+
+    version = cache.get(REVOCATIONS_VERSION_KEY)
+    if version is None:
+        _revocations = publish_revocations()
+    elif _revocations is None or version != _revocations.version:
+        data = cache.get(REVOCATIONS_KEY)
+        _revocations = publish_revocations() if data is None else RevocationFilter.from_bytes(data, version)
+    _checked_at = now
+    return _revocations
+
+
+def reset_revocations():
+    """
+    Drops the process-local copy so the next scan re-reads the shared filter.
+    """
+    global _revocations
+    _revocations = None
+
+
+def validate_token(token, on=None, trip_id=None):
+    """
+    Gate check for one scanned token: signature, travel date (today unless given),
+    optionally that it covers trip_id, and that the ticket is not cancelled.
+    """
+    try:
+        claims = verify_token(token)
+    except (BadSignature, ValueError):
+        return {'valid': False, 'reason': 'bad_signature'}
+
+    result = {'ticket_id': claims.ticket_id, 'trip_date': claims.trip_date.isoformat(), 'trips': claims.trip_ids}
+    if claims.trip_date != (on or datetime.date.today()):
+        reason = 'wrong_date'
+    elif trip_id and trip_id.upper() not in claims.trip_ids:
+        reason = 'wrong_trip'
+    elif claims.ticket_id in get_revocations():
+        reason = 'revoked'
+    else:
+        reason = None
+    result.update(valid=reason is None, reason=reason)
+    return result
@@ -0,0 +1,71 @@
+from django.db import connections
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Ticket, Ticket_Trip, Trip
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def totals_maintained_by_database(using='default'):
+    """
+    On PostgreSQL, triggers (migrations 0010 and 0013) price new ticket/trip links
+    and keep totals current for every write path (raw SQL and bulk through-row
+    inserts included), so the app-side updates below are skipped there.
+    """
+    return connections[using].vendor == 'postgresql'
+
+
+def price_links(links):
+    """
+    Stamps each unpriced Ticket_Trip in the queryset with its trip's current fare,
+    in one UPDATE. Returns the number of links priced.
+    """
+    trip_cost = Trip.objects.filter(pk=OuterRef('trip_id')).values('trip_cost')[:1]
+    return links.filter(price__isnull=True).update(price=Subquery(trip_cost))
+
+
+def expected_total():
+    """
+    Sum of the prices a ticket's trips were sold at, as a correlated subquery for
+    use in UPDATE ... SET. Links not yet priced count at the trip's current fare.
+    """
+    prices = Ticket_Trip.objects.filter(ticket=OuterRef('pk')).order_by().values('ticket').annotate(
+        total=Sum(Coalesce(F('price'), F('trip__trip_cost')))
+    ).values('total')
+    return Coalesce(Subquery(prices, output_field=IntegerField()), Value(0))
+
+
+def refresh_totals(tickets):
+    """
+    Recomputes total_cost for a Ticket queryset in one aggregate UPDATE, only
+    writing the rows whose stored total is wrong. Returns the number fixed.
+    """
+    return tickets.filter(~Q(total_cost=expected_total())).update(total_cost=expected_total())
+
+
+def reconcile_totals(chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Walks every ticket in primary key order, one keyset chunk per statement, and
+    fixes drifted totals with one UPDATE per chunk. Returns (checked, drifted).
+    """
+    checked = drifted = 0
+    last_pk = None
+    while True:
+        chunk = Ticket.objects.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+
+        tickets = Ticket.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        if dry_run:
+            drifted += tickets.filter(~Q(total_cost=expected_total())).count()
+        else:
+            price_links(Ticket_Trip.objects.filter(ticket__in=tickets))
+            drifted += refresh_totals(tickets)
+        checked += len(pks)
+        last_pk = pks[-1]
+        if progress:
+            progress(checked, drifted)
+    return checked, drifted
@@ -0,0 +1,276 @@
+import datetime
+import json
+import os
+import time
+from collections import namedtuple
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from .models import Service_Pattern, Trip, compute_durations
+from .network import get_network
+
+# Layers of the stored (3, stations, stations) matrix
+MINUTES, FARE, HOPS = 0, 1, 2
+
+# Trips departing from this many days ago onwards set a route's typical time and fare
+HISTORY_DAYS = 90
+
+# csgraph drops zero-weight entries, so free or instant legs weigh this much instead
+MIN_WEIGHT = 1e-6
+
+# Above this share of stations needing new rows, recompute every row
+FULL_RECOMPUTE_SHARE = 0.5
+
+META_FILE = 'meta.json'
+
+# Debounces topology edits: one queued refresh covers every edit made before it starts
+REFRESH_PENDING_KEY = 'home:travel_matrix_pending'
+
+MatrixResult = namedtuple('MatrixResult', 'stations edges recomputed_rows seconds')
+Travel = namedtuple('Travel', 'minutes fare hops')
+
+
+def route_weights(today=None):
+    """
+    Typical (mean) minutes and fare per route ID from its recent and upcoming
+    trips, falling back to its service patterns for routes without trips.
+    """
+    today = today or datetime.date.today()
+    weights = {}
+    patterns = Service_Pattern.objects.values_list('route_id', 'departure_time', 'arrival_time', 'trip_cost')
+    by_route = {}
+    for route_id, departure, arrival, fare in patterns:
+        by_route.setdefault(route_id, []).append((departure, arrival, fare))
+    for route_id, rows in by_route.items():
+        durations = compute_durations([r[0] for r in rows], [r[1] for r in rows])
+        weights[route_id] = (
+            sum(d.total_seconds() for d in durations) / 60 / len(rows), sum(r[2] for r in rows) / len(rows)
+        )
+
+    trips = (
+        Trip.objects.filter(schedule_day__gte=today - datetime.timedelta(days=HISTORY_DAYS), duration__isnull=False)
+        .order_by().values('route_id').annotate(minutes=Avg('duration'), fare=Avg('trip_cost'))
+    )
+    for row in trips:
+        weights[row['route_id']] = (row['minutes'].total_seconds() / 60, float(row['fare']))
+    return weights
+
+
+def network_edges(network, weights):
+    """
+    {(origin, destination) station IDs: (minutes, fare)} over the network's
+    routes; parallel routes keep the lowest of each, and routes with no trips or
+    patterns get (None, None), so they count as hops only.
+    """
+    edges = {}
+    for route in range(network.route_count):
+        route_id, _, origin, desti = network.route(route)
+        if origin < 0:
+            continue
+        key = (network.station(origin)[0], network.station(desti)[0])
+        minutes, fare = weights.get(route_id, (None, None))
+        if key in edges:
+            old_minutes, old_fare = edges[key]
+            minutes = minutes if old_minutes is None else old_minutes if minutes is None else min(minutes, old_minutes)
+            fare = fare if old_fare is None else old_fare if fare is None else min(fare, old_fare)
+        edges[key] = (minutes, fare)
+    return edges
+
+
+def _graphs(station_ids, edges):
+    index = {station_id: i for i, station_id in enumerate(station_ids)}
+    n = len(station_ids)
+    graphs = []
+    for layer in (MINUTES, FARE, HOPS):
+        rows, cols, data = [], [], []
+        for (origin, desti), values in edges.items():
+            weight = 1.0 if layer == HOPS else values[layer]
+            if weight is not None:
+                rows.append(index[origin])
+                cols.append(index[desti])
+                data.append(max(weight, MIN_WEIGHT))
+        graphs.append(csr_matrix((data, (rows, cols)), shape=(n, n)))
+    return graphs
+
+
+def _remap(matrix, old_ids, new_ids):
+    """
+    The old matrix laid out on the new station order: shared stations keep their
+    values, new ones start unreachable.
+    """
+    n = len(new_ids)
+    remapped = np.full((3, n, n), np.inf, dtype=np.float32)
+    old_index = {station_id: i for i, station_id in enumerate(old_ids)}
+    pairs = [(i, old_index[station_id]) for i, station_id in enumerate(new_ids) if station_id in old_index]
+    if pairs:
+        new, old = (np.array(side) for side in zip(*pairs))
+        remapped[:, new[:, None], new[None, :]] = matrix[:, old[:, None], old[None, :]]
+    return remapped
+
+
+def _dirty_sources(previous, station_ids, edges):
+    """
+    Rows that may have changed. A changed shortest path from i must use a changed
+    edge, and the first one on it starts at a station i already reached over
+    unchanged edges, so only sources that reached a changed edge's origin (plus
+    new stations) need recomputing.
+    """
+    old_ids, old_edges, old_matrix = previous
+    index = {station_id: i for i, station_id in enumerate(station_ids)}
+    old_index = {station_id: i for i, station_id in enumerate(old_ids)}
+    changed = {key for key in set(edges) | set(old_edges) if edges.get(key) != old_edges.get(key)}
+
+    dirty = np.zeros(len(station_ids), dtype=bool)
+    dirty[[i for station_id, i in index.items() if station_id not in old_index]] = True
+    origins = [old_index[origin] for origin, _ in changed if origin in old_index]
+    if origins:
+        reached = np.isfinite(old_matrix[HOPS][:, origins]).any(axis=1)
+        dirty[[index[old_ids[i]] for i in np.flatnonzero(reached) if old_ids[i] in index]] = True
+    return np.flatnonzero(dirty)
+
+
+def compute_matrix(station_ids, edges, previous=None):
+    """
+    Minimum minutes, minimum fare and fewest hops between every pair of stations,
+    as a float32 (3, n, n) array (inf = unreachable). Rows come from csgraph's
+    Dijkstra run from each source in C; given the previous (station_ids, edges,
+    matrix), only the rows a changed edge can affect are recomputed.
+    Returns (matrix, rows recomputed).
+    """
+    n = len(station_ids)
+    if previous is None:
+        rows = np.arange(n)
+        matrix = np.empty((3, n, n), dtype=np.float32)
+    else:
+        rows = _dirty_sources(previous, station_ids, edges)
+        matrix = _remap(previous[2], previous[0], station_ids)
+        if len(rows) > FULL_RECOMPUTE_SHARE * n:
+            rows = np.arange(n)
+
+    if len(rows):
+        for layer, graph in enumerate(_graphs(station_ids, edges)):
+            matrix[layer, rows] = dijkstra(graph, indices=rows, unweighted=layer == HOPS)
+    return matrix, len(rows)
+
+
+def matrix_dir():
+    return settings.TRAVEL_MATRIX_DIR
+
+
+def _read_previous(directory):
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        matrix = np.load(os.path.join(directory, meta['matrix_file']), mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    edges = {(origin, desti): (minutes, fare) for origin, desti, minutes, fare in meta['edges']}
+    return meta['stations'], edges, matrix
+
+
+def refresh_travel_matrix(full=False, today=None):
+    """
+    Recomputes the matrix for the current network and trip weights (incrementally
+    unless full=True) and publishes it in TRAVEL_MATRIX_DIR: a new matrix file,
+    then meta.json pointing at it, so readers switch over atomically.
+    """
+    started_at = time.monotonic()
+    directory = matrix_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    network = get_network()
+    station_ids = [network.station(i)[0] for i in range(network.station_count)]
+    edges = network_edges(network, route_weights(today))
+    previous = None if full else _read_previous(directory)
+    matrix, recomputed = compute_matrix(station_ids, edges, previous)
+
+    matrix_file = f'matrix-{time.time_ns()}.npy'
+    np.save(os.path.join(directory, matrix_file), matrix)
+    meta = {
+        'stations': station_ids, 'matrix_file': matrix_file,
+        'edges': [[origin, desti, minutes, fare] for (origin, desti), (minutes, fare) in sorted(edges.items())],
+    }
+    temp_path = os.path.join(directory, f'{META_FILE}.{os.getpid()}.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temp_path, os.path.join(directory, META_FILE))
+
+    # Processes still mapping an older matrix keep reading it until they reload
+    for name in os.listdir(directory):
+        if name.startswith('matrix-') and name != matrix_file:
+            os.remove(os.path.join(directory, name))
+    return MatrixResult(len(station_ids), len(edges), recomputed, time.monotonic() - started_at)
+
+
+def queue_refresh():
+    """
+    Queues one refresh for a burst of topology edits (call on commit).
+    """
+    from .tasks import update_travel_matrix
+
+    if cache.add(REFRESH_PENDING_KEY, True, 60 * 60):
+        update_travel_matrix.delay()  # type: ignore
+
+
+class TravelMatrix:
+    """
+    A published matrix, memory-mapped read-only, with station ID -> row index.
+    """
+    def __init__(self, directory, stamp):
+        previous = _read_previous(directory)
+        if previous is None:
+            raise FileNotFoundError(f"No travel matrix in {directory}")
+        station_ids, _, self.matrix = previous
+        self.index = {station_id: i for i, station_id in enumerate(station_ids)}
+        self.stamp = stamp
+
+    def between(self, origin_id, destination_id):
+        i, j = self.index.get(origin_id), self.index.get(destination_id)
+        if i is None or j is None or not np.isfinite(self.matrix[HOPS, i, j]):
+            return None
+        minutes, fare, hops = (float(value) for value in self.matrix[:, i, j])
+        return Travel(
+            round(minutes) if np.isfinite(minutes) else None, round(fare) if np.isfinite(fare) else None, int(hops)
+        )
+
+
+_matrix = None
+
+
+def get_travel_matrix():
+    """
+    This process's mapped matrix, reloaded when meta.json is replaced. None until
+    the first refresh has run.
+    """
+    global _matrix
+    try:
+        stamp = os.stat(os.path.join(matrix_dir(), META_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    if _matrix is None or _matrix.stamp != stamp:
+        try:
+            _matrix = TravelMatrix(matrix_dir(), stamp)
+        except FileNotFoundError:
+            return None
+    return _matrix
+
+
+def travel_between(origin, destination):
+    """
+    (origin station, destination station, Travel) for two station IDs or names:
+    minimum minutes, minimum fare and fewest changes of route, each an array read.
+    Travel is None when the destination cannot be reached; stations are None
+    when they do not exist.
+    """
+    network = get_network()
+    ends = []
+    for value in (origin, destination):
+        found = network.find_stations(value)
+        ends.append(network.station(found[0]) if found else None)
+    matrix = get_travel_matrix()
+    if None in ends or matrix is None:
+        return ends[0], ends[1], None
+    return ends[0], ends[1], matrix.between(ends[0][0], ends[1][0])
@@ -11,6 +11,10 @@ urlpatterns = [
 
     path('pages-summary.html', views.ticket_summary, name='ticket_summary'),
 
+    path('waitlist/join/', views.waitlist_join, name='waitlist_join'),
+
+    path('waitlist/<int:entry_id>/leave/', views.waitlist_leave, name='waitlist_leave'),
+
     path('pages-profile.html', views.profile, name='profile'),
 
     path('logout/', views.logout_view, name='logout'),
@@ -18,4 +22,30 @@ urlpatterns = [
     path('register/', views.register, name='register'),
 
     path('login/', views.login_view, name='login'),
+
+    # Async booking queue
+    path('api/bookings/', views.booking_create, name='booking_create'),
+
+    path('api/bookings/<str:idempotency_key>/', views.booking_status_view, name='booking_status'),
+
+    # Async read APIs (served natively under ASGI)
+    path('api/schedule/', views.schedule_board_api, name='schedule_board_api'),
+
+    path('api/trips/search/', views.trip_search_api, name='trip_search_api'),
+
+    path('api/tickets/', views.ticket_summary_api, name='ticket_summary_api'),
+
+    # Station kiosks (no login, no database)
+    path('api/stations/<str:station_id>/board/', views.station_board_view, name='station_board'),
+
+    path('api/stations/autocomplete/', views.station_autocomplete_view, name='station_autocomplete'),
+    path('api/travel/', views.travel_between_view, name='travel_between'),
+
+    # Ticket gates (no login, no database)
+    path('api/gate/validate/', views.validate_ticket_view, name='validate_ticket'),
+
+    path('tickets/<str:ticket_id>/pass.svg', views.ticket_pass_view, name='ticket_pass'),
+
+    # Prometheus scrape target
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,14 +1,40 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.urls import reverse
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
 from django.template import loader
+from django.db import transaction
 from django.db.models import Q
 from django.contrib import messages 
-from .forms import TicketForm, SignUpForm, ProfileUpdateForm
-from .models import Trip, Ticket
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
+from .forms import TicketForm, SignUpForm, ProfileUpdateForm, TripSearchForm
+from .models import Trip, Ticket, Customer, Booking_Request, Waitlist_Entry
+from .bookings import submit_booking, booking_status, IdempotencyConflict
+from .waitlist import join_waitlist, leave_waitlist, lock_trips, queue_position, sold_out
 import datetime
+import time
+import uuid
+from functools import wraps
+from asgiref.sync import sync_to_async
 from .tasks import send_ticket_confirmation_email
+from .boards import station_board, BOARD_KINDS
+from .ticket_tokens import validate_token, MAX_GATE_BATCH
+from .caching import get_schedule_version, aget_schedule_version, TRIP_FRAGMENT_TIMEOUT, READ_API_TIMEOUT
+from .patterns import materialize_trips, with_pattern_trips, expand_patterns, PATTERN_TRIP_SELECT_RELATED
+from .search import search_trips, asearch_trips, TripQuery
+from .history import customer_tickets, ticket_page, ticket_stats, HISTORY_VIEWS
+from .metrics import exposition, observe_booking, CONTENT_TYPE_LATEST
+from .travel_matrix import travel_between
+from .autocomplete import suggest_stations, MAX_SUGGESTIONS
+from core.db_router import use_primary_db
+
+UNAVAILABLE_TRIPS = "A selected departure is no longer running. Please choose another."
 
 
 def register(request):
@@ -103,12 +129,16 @@ def profile(request):
 def ticket_sales(request):
     msg = None
     success = False
+    booking = None
+    sold_out_trips = []
+    status = 200
+    key_conflict = False
 
     if request.method == "POST":
         form = TicketForm(request.POST)
         if form.is_valid():
             trip_date = form.cleaned_data['trip_date']
-            selected_trips = form.cleaned_data['trips']
+            trip_ids = form.cleaned_data['trips']
 
             try:
                 current_customer = request.user.customer_profile
@@ -116,79 +146,133 @@ def ticket_sales(request):
                 msg = "Error: Users must have a Customer Profile to buy tickets."
                 return render(request, 'home/pages-tickets.html', {'msg': msg, 'form': form})
 
-            new_ticket = Ticket(
-                customer=current_customer, 
-                trip_date=trip_date
-            )
-            
-            new_ticket.save() 
-            new_ticket.trips.set(selected_trips)
-            new_ticket.calculate_total_cost()
+            # Async mode: an idempotency key (BOOKING_FORM_QUEUED, or a client's own) routes the purchase through the booking queue
+            idempotency_key = request.POST.get('idempotency_key')
+            if idempotency_key:
+                try:
+                    with transaction.atomic():
+                        # Pattern departures only become real Trip rows once someone books them
+                        selected_trips = materialize_trips(trip_ids)
+                        if selected_trips is None:
+                            transaction.set_rollback(True)
+                        else:
+                            booking, _ = submit_booking(current_customer, idempotency_key, trip_date, selected_trips)
+                    if selected_trips is None:
+                        msg = UNAVAILABLE_TRIPS
+                        status = 409
+                    else:
+                        msg = f'Booking request {booking.idempotency_key} received. Your ticket is being issued.'
+                        success = True
+                        status = 202
+                        form = TicketForm()
+                except IdempotencyConflict as e:
+                    msg = str(e)
+                    status = 409
+                    key_conflict = True
+            else:
+                started_at = time.perf_counter()
+                with transaction.atomic():
+                    selected_trips = materialize_trips(trip_ids)
+                    if selected_trips is None:
+                        transaction.set_rollback(True)
+                    else:
+                        # Seats are counted under the trips' row locks, so two buyers cannot take the last one
+                        lock_trips([trip.pk for trip in selected_trips])
+                        sold_out_trips = sold_out(selected_trips)
+                        if sold_out_trips:
+                            # Drop any departures materialized for this purchase
+                            transaction.set_rollback(True)
+                        else:
+                            new_ticket = Ticket(
+                                customer=current_customer, 
+                                trip_date=trip_date
+                            )
+                            
+                            new_ticket.save() 
+                            new_ticket.trips.set(selected_trips)
+                            new_ticket.calculate_total_cost()
 
-            send_ticket_confirmation_email.delay(new_ticket.ticket_id) # type: ignore
+                if selected_trips is None:
+                    msg = UNAVAILABLE_TRIPS
+                    status = 409
+                elif sold_out_trips:
+                    observe_booking('sync', 'sold_out')
+                    msg = f"Sold out: {', '.join(sold_out_trips)}. Join the waitlist to be issued a seat when one frees up."
+                    status = 409
+                else:
+                    observe_booking('sync', 'issued', time.perf_counter() - started_at)
+                    send_ticket_confirmation_email.delay(new_ticket.ticket_id) # type: ignore
 
-            msg = f'Ticket {new_ticket.ticket_id} successfully created with {len(selected_trips)} trip(s)!'
-            success = True
-            form = TicketForm() 
+                    msg = f'Ticket {new_ticket.ticket_id} successfully created with {len(selected_trips)} trip(s)!'
+                    success = True
+                    form = TicketForm() 
         else:
             msg = 'Form is not valid'
     else:
         form = TicketForm()
 
-    trips = Trip.objects.select_related(
-        'train',
-        'route',
-        'route__local_route_info__l_route_origin__l_station_id',
-        'route__local_route_info__l_route_desti__l_station_id',
-        'route__intertown_route_info__i_route_origin__i_station_id',
-        'route__intertown_route_info__i_route_desti__i_station_id',
-    ).all().order_by('schedule_day', 'departure_time')
+    # Customers who know where they're going search; otherwise list every trip
+    search_form = TripSearchForm(request.GET or None)
+    if search_form.is_bound and search_form.is_valid():
+        trips = search_trips(search_form.query())
+    else:
+        trips = Trip.objects.select_related(
+            'train',
+            'route',
+            'route__local_route_info__l_route_origin__l_station_id',
+            'route__local_route_info__l_route_desti__l_station_id',
+            'route__intertown_route_info__i_route_origin__i_station_id',
+            'route__intertown_route_info__i_route_desti__i_station_id',
+        ).all().order_by('schedule_day', 'departure_time')
+        trips = with_pattern_trips(trips)
 
     context = {
         'segment': 'pages-tickets',
         'form': form,
+        'search_form': search_form,
         'trips': trips,
         'msg': msg,
-        'success': success
+        'success': success,
+        'booking': booking,
+        'sold_out_trips': sold_out_trips,
+        'schedule_version': get_schedule_version(),
+        'fragment_timeout': TRIP_FRAGMENT_TIMEOUT,
+        'idempotency_key': None,
     }
+    if settings.BOOKING_FORM_QUEUED:
+        # A form re-rendered after a failed submission keeps its key, so retrying the same
+        # purchase maps to the same booking; a new purchase (or a clashing key) gets a fresh one
+        retry_key = request.POST.get('idempotency_key') if request.method == "POST" and not success and not key_conflict else None
+        context['idempotency_key'] = retry_key or uuid.uuid4().hex
 
     html_template = loader.get_template('home/pages-tickets.html')
-    return HttpResponse(html_template.render(context, request))
-
+    return HttpResponse(html_template.render(context, request), status=status)
 
 @login_required(login_url="/login/")
 def ticket_summary(request):
     query = request.GET.get('q', '') 
+    when = request.GET.get('when') if request.GET.get('when') in HISTORY_VIEWS else 'upcoming'
 
     try:
         current_customer = request.user.customer_profile
     except AttributeError:
         current_customer = None
 
-    if current_customer:
-        tickets = Ticket.objects.filter(customer=current_customer)
-    else:
-        tickets = Ticket.objects.none()
-
-    tickets = tickets.prefetch_related(
-        'trips__train',
-        'trips__route',
-        'trips__route__local_route_info__l_route_origin__l_station_id',
-        'trips__route__local_route_info__l_route_desti__l_station_id',
-        'trips__route__intertown_route_info__i_route_origin__i_station_id',
-        'trips__route__intertown_route_info__i_route_desti__i_station_id',
-    ).order_by('-purchase_date')
-
-    if query:
-        tickets = tickets.filter(
-            Q(ticket_id__icontains=query) | 
-            Q(trips__route__local_route_info__l_route_origin__l_station_id__station_name__icontains=query) |
-            Q(trips__route__intertown_route_info__i_route_origin__i_station_id__station_name__icontains=query)
-        ).distinct()
+    # One page of upcoming or past tickets; the counters cover the whole history
+    tickets = ticket_page(customer_tickets(current_customer, query, when), request.GET.get('page'))
+
+    waitlist = []
+    if current_customer is not None:
+        waitlist = list(current_customer.waitlist_entries.filter(status='Waiting').select_related('trip').order_by('trip__schedule_day', 'trip__departure_time'))
+        for entry in waitlist:
+            entry.position = queue_position(entry)
 
     context = {
         'segment': 'pages-summary',
         'tickets': tickets,
+        'stats': ticket_stats(current_customer),
+        'when': when,
+        'waitlist': waitlist,
         'query': query
     }
 
@@ -196,24 +280,367 @@ def ticket_summary(request):
     return HttpResponse(html_template.render(context, request))
 
 
+@login_required(login_url="/login/")
+@require_POST
+def waitlist_join(request):
+    """
+    Queues the customer on the waitlist of each posted trip that is upcoming and
+    sold out; trips that still have seats send the customer back to buy them.
+    """
+    try:
+        customer = request.user.customer_profile
+    except AttributeError:
+        messages.error(request, "Users must have a Customer Profile to join a waitlist.")
+        return redirect('ticket_sales')
+
+    trips = list(Trip.objects.filter(
+        pk__in=request.POST.getlist('trips'), is_archived=False, schedule_day__gte=datetime.date.today()
+    ))
+    full = set(sold_out(trips))
+    for trip in trips:
+        if trip.pk in full:
+            entry, created = join_waitlist(customer, trip)
+            position = queue_position(entry)
+            messages.success(request, f"{'Joined' if created else 'Already on'} the waitlist for {trip.trip_id} (position {position}).")
+
+    available = [trip.trip_id for trip in trips if trip.pk not in full]
+    if available:
+        messages.info(request, f"Seats are still available on {', '.join(available)}. Book them instead.")
+        return redirect('ticket_sales')
+    return redirect('ticket_summary')
+
+
+@login_required(login_url="/login/")
+@require_POST
+def waitlist_leave(request, entry_id):
+    entry = Waitlist_Entry.objects.filter(pk=entry_id, customer__user=request.user).first()
+    if entry is None or not leave_waitlist(entry):
+        raise Http404("Waitlist entry not found")
+    messages.success(request, f"Left the waitlist for {entry.trip_id}.")
+    return redirect('ticket_summary')
+
+
 @login_required(login_url="/login/")
 def index(request):
-    local_trips = Trip.objects.filter(trip_type='L').select_related(
-        'train',
-        'route__local_route_info__l_route_origin__l_station_id',
-        'route__local_route_info__l_route_desti__l_station_id'
-    ).order_by('schedule_day', 'departure_time')
-
-    inter_trips = Trip.objects.filter(trip_type='I').select_related(
-        'train',
-        'route__intertown_route_info__i_route_origin__i_station_id',
-        'route__intertown_route_info__i_route_desti__i_station_id'
-    ).order_by('schedule_day', 'departure_time')
+    search_form = TripSearchForm(request.GET or None)
+    if search_form.is_bound and search_form.is_valid():
+        trips = search_trips(search_form.query())
+        local_trips = [trip for trip in trips if trip.trip_type == 'L']
+        inter_trips = [trip for trip in trips if trip.trip_type == 'I']
+    else:
+        local_trips = Trip.objects.filter(trip_type='L').select_related(
+            'train',
+            'route__local_route_info__l_route_origin__l_station_id',
+            'route__local_route_info__l_route_desti__l_station_id'
+        ).order_by('schedule_day', 'departure_time')
+
+        inter_trips = Trip.objects.filter(trip_type='I').select_related(
+            'train',
+            'route__intertown_route_info__i_route_origin__i_station_id',
+            'route__intertown_route_info__i_route_desti__i_station_id'
+        ).order_by('schedule_day', 'departure_time')
+
+        local_trips = with_pattern_trips(local_trips, trip_type='L')
+        inter_trips = with_pattern_trips(inter_trips, trip_type='I')
 
     context = {
         'segment': 'index',
+        'search_form': search_form,
         'local_trips': local_trips,
-        'inter_trips': inter_trips
+        'inter_trips': inter_trips,
+        'schedule_version': get_schedule_version(),
+        'fragment_timeout': TRIP_FRAGMENT_TIMEOUT,
     }
     html_template = loader.get_template('home/index.html')
-    return HttpResponse(html_template.render(context, request))
\ No newline at end of file
+    return HttpResponse(html_template.render(context, request))
+
+
+@login_required(login_url="/login/")
+@require_POST
+def booking_create(request):
+    """
+    API: Accepts a purchase with an Idempotency-Key header (or form field) and queues it.
+    Returns 202 with the polling URL; repeating the same key returns the same booking.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+    if not idempotency_key:
+        return JsonResponse({'error': 'An idempotency key is required.'}, status=400)
+
+    try:
+        current_customer = request.user.customer_profile
+    except AttributeError:
+        return JsonResponse({'error': 'Users must have a Customer Profile to buy tickets.'}, status=403)
+
+    form = TicketForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Form is not valid', 'fields': form.errors}, status=400)
+
+    try:
+        with transaction.atomic():
+            # Pattern departures only become Trip rows for a booking that is accepted
+            selected_trips = materialize_trips(form.cleaned_data['trips'])
+            if selected_trips is None:
+                transaction.set_rollback(True)
+                return JsonResponse({'error': UNAVAILABLE_TRIPS}, status=409)
+            booking, created = submit_booking(current_customer, idempotency_key, form.cleaned_data['trip_date'], selected_trips)
+    except IdempotencyConflict as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    payload = booking_status(booking)
+    payload['status_url'] = reverse('booking_status', args=[booking.idempotency_key])
+    return JsonResponse(payload, status=202 if created else 200)
+
+
+@require_GET
+def station_board_view(request, station_id):
+    """
+    API (station kiosks): Next departures or arrivals at a station.
+    Served from the board store alone, so polling never reaches the database.
+    ?kind=departures|arrivals&limit=10
+    """
+    kind = request.GET.get('kind', 'departures')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+    if kind not in BOARD_KINDS:
+        return JsonResponse({'error': 'kind must be departures or arrivals'}, status=400)
+
+    board = station_board(station_id, kind, limit)
+    if board is None:
+        return JsonResponse({'error': 'Station not found'}, status=404)
+    response = JsonResponse(board)
+    response['Cache-Control'] = 'public, max-age=5'
+    return response
+
+
+@require_GET
+def travel_between_view(request):
+    """
+    API: Shortest travel time, cheapest fare and fewest route changes between two
+    stations, read from the network snapshot and the precomputed travel matrix.
+    ?from=<station ID or name>&to=<station ID or name>
+    """
+    origin, destination = request.GET.get('from', ''), request.GET.get('to', '')
+    if not origin or not destination:
+        return JsonResponse({'error': 'from and to are required'}, status=400)
+
+    origin_station, destination_station, travel = travel_between(origin, destination)
+    if origin_station is None or destination_station is None:
+        return JsonResponse({'error': 'Station not found'}, status=404)
+    payload = {
+        'from': {'station_id': origin_station[0], 'station_name': origin_station[1]},
+        'to': {'station_id': destination_station[0], 'station_name': destination_station[1]},
+        'reachable': travel is not None,
+    }
+    if travel is not None:
+        payload.update(travel._asdict())
+    response = JsonResponse(payload)
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
+@require_GET
+def station_autocomplete_view(request):
+    """
+    API: Stations whose name (or any later word of it) or ID starts with q, then
+    close misspellings, from the in-memory station index.
+    ?q=<partial name>&limit=<1-10>
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', MAX_SUGGESTIONS)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
+    suggestions = suggest_stations(request.GET.get('q', ''), limit)
+    response = JsonResponse({'suggestions': [s._asdict() for s in suggestions]})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def validate_ticket_view(request):
+    """
+    API (gates and on-board staff): Checks scanned ticket tokens without touching the
+    database. GET ?token=...&trip=... checks one scan; POST token=...&token=... checks a
+    batch buffered by an offline gate and returns {'results': [...]}.
+    ?date=YYYY-MM-DD checks against another travel day (defaults to today).
+    """
+    params = request.POST if request.method == 'POST' else request.GET
+    tokens = params.getlist('token')[:MAX_GATE_BATCH]
+    if not tokens:
+        return JsonResponse({'error': 'token is required'}, status=400)
+    on = _parse_date(params.get('date'), datetime.date.today())
+    if on is None:
+        return JsonResponse({'error': 'date must be YYYY-MM-DD'}, status=400)
+    results = [validate_token(token, on, params.get('trip')) for token in tokens]
+    if request.method == 'POST':
+        return JsonResponse({'results': results})
+    return JsonResponse(results[0])
+
+
+@login_required(login_url="/login/")
+def ticket_pass_view(request, ticket_id):
+    """
+    The ticket's signed token as a QR code (SVG), for the gates to scan.
+    """
+    import segno
+
+    ticket = Ticket.objects.filter(pk=ticket_id, customer__user=request.user).prefetch_related('trips').first()
+    if ticket is None:
+        raise Http404("Ticket not found")
+    svg = segno.make(ticket.token, error='m').svg_inline(scale=6)
+    response = HttpResponse(svg, content_type='image/svg+xml')
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def async_read_view(view):
+    """
+    login_required + require_GET for async views (Django 4.2's decorators only wrap sync views).
+    The session/user lookup is the one blocking step and runs on a worker thread.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path(), '/login/')
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def trip_payload(trip):
+    """
+    JSON shape of a trip for the read APIs (related objects must already be loaded).
+    """
+    return {
+        'trip_id': trip.trip_id,
+        'trip_type': trip.trip_type,
+        'schedule_day': trip.schedule_day.isoformat(),
+        'departure_time': trip.departure_time.strftime('%H:%M'),
+        'arrival_time': trip.arrival_time.strftime('%H:%M'),
+        'duration': trip.formatted_duration,
+        'origin': trip.origin_name,
+        'destination': trip.destination_name,
+        'train': trip.train.train_number if trip.train else None,
+        'trip_cost': trip.trip_cost,
+    }
+
+
+def _parse_date(value, default):
+    try:
+        return datetime.date.fromisoformat(value) if value else default
+    except ValueError:
+        return None
+
+
+def _parse_time(value):
+    try:
+        return datetime.time.fromisoformat(value) if value else None
+    except ValueError:
+        return False
+
+
+@async_read_view
+async def schedule_board_api(request):
+    """
+    API (async): Departures for one day, concrete trips plus pattern departures.
+    ?date=YYYY-MM-DD (default today), ?type=L|I.
+    """
+    day = _parse_date(request.GET.get('date'), datetime.date.today())
+    trip_type = request.GET.get('type') or None
+    if day is None or trip_type not in (None, 'L', 'I'):
+        return JsonResponse({'error': 'Invalid date or type'}, status=400)
+
+    key = f'home:api:schedule:{day.isoformat()}:{trip_type}:{await aget_schedule_version()}'
+    payload = await cache.aget(key)
+    if payload is None:
+        trips = Trip.objects.filter(schedule_day=day).select_related(*PATTERN_TRIP_SELECT_RELATED).order_by('departure_time')
+        if trip_type:
+            trips = trips.filter(trip_type=trip_type)
+        trips = [trip async for trip in trips]
+        virtual = await sync_to_async(lambda: list(expand_patterns(day, day, trip_type=trip_type)))()
+        trips = sorted(trips + virtual, key=lambda t: t.departure_time)
+        payload = {'date': day.isoformat(), 'trips': [trip_payload(t) for t in trips]}
+        await cache.aset(key, payload, READ_API_TIMEOUT)
+    return JsonResponse(payload)
+
+
+@async_read_view
+async def trip_search_api(request):
+    """
+    API (async): Trips between two stations (ID or name, any case) from a given
+    day, earliest first, including pattern departures. Results are cached briefly.
+    ?origin=...&destination=...&date=YYYY-MM-DD&until=YYYY-MM-DD&after=HH:MM&before=HH:MM&type=L|I
+    """
+    day = _parse_date(request.GET.get('date'), datetime.date.today())
+    until = _parse_date(request.GET.get('until'), None)
+    after, before = _parse_time(request.GET.get('after')), _parse_time(request.GET.get('before'))
+    trip_type = request.GET.get('type') or None
+    if day is None or (request.GET.get('until') and until is None):
+        return JsonResponse({'error': 'Invalid date'}, status=400)
+    if after is False or before is False or trip_type not in (None, 'L', 'I'):
+        return JsonResponse({'error': 'Invalid time or type'}, status=400)
+
+    query = TripQuery(
+        origin=request.GET.get('origin', '').strip() or None, destination=request.GET.get('destination', '').strip() or None,
+        date=day, until=until, after=after, before=before, trip_type=trip_type,
+    )
+    trips = await asearch_trips(query)
+    return JsonResponse({'trips': [trip_payload(t) for t in trips]})
+
+
+@async_read_view
+async def ticket_summary_api(request):
+    """
+    API (async): The signed-in customer's tickets, a page at a time; ?q= filters
+    like the summary page, ?when=upcoming|past splits by trip date, ?page=N.
+    """
+    customer = await Customer.objects.filter(user_id=request.user.pk).afirst()
+    when = request.GET.get('when') if request.GET.get('when') in HISTORY_VIEWS else None
+    tickets = customer_tickets(customer, request.GET.get('q', ''), when)
+    page = await sync_to_async(ticket_page)(tickets, request.GET.get('page'))
+    return JsonResponse({'page': page.number, 'pages': page.paginator.num_pages, 'count': page.paginator.count, 'tickets': [
+        {
+            'ticket_id': ticket.ticket_id,
+            'purchase_date': ticket.purchase_date.isoformat(),
+            'trip_date': ticket.trip_date.isoformat(),
+            'total_cost': ticket.total_cost,
+            'cancelled': ticket.cancelled_at is not None,
+            'token': ticket.token,
+            'trips': [trip_payload(t) for t in ticket.trips.all()],
+        }
+        for ticket in page
+    ]})
+
+
+@async_read_view
+@use_primary_db
+async def booking_status_view(request, idempotency_key):
+    """
+    API (async): Polling endpoint for a queued booking.
+    """
+    booking = await Booking_Request.objects.select_related('ticket').filter(
+        customer__user_id=request.user.pk, idempotency_key=idempotency_key
+    ).afirst()
+    if booking is None:
+        return JsonResponse({'error': 'Booking not found'}, status=404)
+    return JsonResponse(booking_status(booking))
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint: bookings, ID retries, Celery task runs and queue
+    depths in the text exposition format. Needs METRICS_TOKEN as a bearer token;
+    without one configured it is only served with DEBUG on.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse('Forbidden: set METRICS_TOKEN to enable /metrics', status=403)
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401)
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,211 @@
+import datetime
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+from .metrics import ID_ALLOCATION_RETRIES
+from .models import Ticket, Ticket_Trip, Trip, Waitlist_Entry
+from .ticket_totals import refresh_totals, totals_maintained_by_database
+
+# Trips promoted per transaction; each run walks every queue in chunks of this size
+DEFAULT_BATCH_SIZE = 200
+
+# Ticket ID collisions with concurrent purchases are retried with fresh IDs
+TICKET_ID_ATTEMPTS = 5
+
+# IDs per UPDATE, well inside every backend's bound parameter limit
+UPDATE_CHUNK_SIZE = 500
+
+
+def seats_sold():
+    """
+    Number of tickets (not cancelled) that include the outer trip, as a subquery.
+    """
+    sold = Ticket_Trip.objects.filter(trip_id=OuterRef('pk'), ticket__cancelled_at__isnull=True).order_by().values('trip_id').annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(sold, output_field=IntegerField()), Value(0))
+
+
+def with_seats(trips):
+    """
+    Annotates capacity (the train model's seat_capacity) and sold. Trips without a
+    train model, or with a capacity of 0, are not limited.
+    """
+    return trips.annotate(capacity=F('train__train_model__seat_capacity'), sold=seats_sold())
+
+
+def lock_trips(trip_ids):
+    """
+    Row-locks trips in primary key order (a fixed order, so concurrent bookings of
+    overlapping trips cannot deadlock) until the surrounding transaction ends.
+    """
+    list(Trip.objects.select_for_update().filter(pk__in=trip_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def sold_out(trips):
+    """
+    The IDs of the given trips that have no free seat, in one query. Call inside a
+    transaction after lock_trips() to make the check and the sale atomic.
+    """
+    return list(
+        with_seats(Trip.objects.filter(pk__in=[trip.pk for trip in trips], train__train_model__seat_capacity__gt=0))
+        .filter(sold__gte=F('capacity')).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def _expiry(trip, now):
+    expires_at = now + datetime.timedelta(hours=settings.WAITLIST_EXPIRY_HOURS)
+    departs_at = timezone.make_aware(datetime.datetime.combine(trip.schedule_day, trip.departure_time))
+    return min(expires_at, departs_at)
+
+
+def join_waitlist(customer, trip):
+    """
+    Queues the customer for the trip. Returns (entry, created); joining twice
+    returns the existing entry and keeps its place in the queue.
+    """
+    try:
+        with transaction.atomic():
+            return Waitlist_Entry.objects.get_or_create(
+                trip=trip, customer=customer, status='Waiting', defaults={'expires_at': _expiry(trip, timezone.now())}
+            )
+    except IntegrityError:
+        # A concurrent request created the entry first
+        return Waitlist_Entry.objects.get(trip=trip, customer=customer, status='Waiting'), False
+
+
+def leave_waitlist(entry):
+    return Waitlist_Entry.objects.filter(pk=entry.pk, status='Waiting').update(status='Left') == 1
+
+
+def queue_position(entry):
+    """
+    1-based place in the trip's queue, counted on the partial queue index.
+    """
+    return Waitlist_Entry.objects.filter(trip_id=entry.trip_id, status='Waiting', pk__lte=entry.pk).count()
+
+
+def expire_entries(now=None):
+    return Waitlist_Entry.objects.filter(status='Waiting', expires_at__lte=now or timezone.now()).update(status='Expired')
+
+
+def _issue_tickets(entries, today):
+    """
+    Creates one ticket per (customer_id, trip_id, trip_date) entry with bulk INSERTs:
+    tickets, their trip links at the current fares, then one aggregate UPDATE for the totals. IDs
+    continue the day's sequence. Returns the ticket IDs.
+    """
+    for attempt in range(TICKET_ID_ATTEMPTS):
+        first = Ticket.next_sequence(today)
+        tickets = [
+            Ticket(ticket_id=f"{today:%Y%m%d}{first + i:04d}", customer_id=customer_id, purchase_date=today, trip_date=trip_date)
+            for i, (customer_id, _, trip_date) in enumerate(entries)
+        ]
+        try:
+            with transaction.atomic():
+                Ticket.objects.bulk_create(tickets)
+            break
+        except IntegrityError:
+            if attempt == TICKET_ID_ATTEMPTS - 1:
+                raise
+            ID_ALLOCATION_RETRIES.labels('Ticket').inc()
+
+    ticket_ids = [ticket.ticket_id for ticket in tickets]
+    fares = dict(Trip.objects.filter(pk__in={trip_id for _, trip_id, _ in entries}).values_list('pk', 'trip_cost'))
+    Ticket_Trip.objects.bulk_create([
+        Ticket_Trip(ticket_id=ticket_id, trip_id=trip_id, price=fares[trip_id]) for ticket_id, (_, trip_id, _) in zip(ticket_ids, entries)
+    ])
+    if not totals_maintained_by_database():
+        for ids in _chunks(ticket_ids):
+            refresh_totals(Ticket.objects.filter(pk__in=ids))
+    return ticket_ids
+
+
+def _chunks(items, size=UPDATE_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _promote_chunk(trip_ids, now):
+    with transaction.atomic():
+        lock_trips(trip_ids)
+        # Recounted under the lock, so concurrent sales cannot oversell; None = not limited
+        free = {
+            trip['pk']: (max(trip['capacity'] - trip['sold'], 0) if trip['capacity'] and trip['capacity'] > 0 else None, trip['schedule_day'])
+            for trip in with_seats(Trip.objects.filter(pk__in=trip_ids)).values('pk', 'capacity', 'sold', 'schedule_day')
+        }
+
+        # The front of every queue in the chunk in one query, ranked per trip
+        queues = Waitlist_Entry.objects.filter(trip_id__in=trip_ids, status='Waiting', expires_at__gt=now).annotate(
+            place=Window(RowNumber(), partition_by=[F('trip_id')], order_by=F('pk').asc())
+        )
+        seats = [seats for seats, _ in free.values()]
+        if None not in seats:
+            queues = queues.filter(place__lte=max(seats, default=0))
+        selected = [
+            (pk, customer_id, trip_id) for pk, customer_id, trip_id, place in queues.values_list('pk', 'customer_id', 'trip_id', 'place')
+            if free[trip_id][0] is None or place <= free[trip_id][0]
+        ]
+        if not selected:
+            return []
+
+        # Claiming the entries row-locks them; ones left meanwhile are no longer 'Waiting'
+        entry_ids = [pk for pk, _, _ in selected]
+        claimed = sum(
+            Waitlist_Entry.objects.filter(pk__in=ids, status='Waiting').update(status='Promoted', promoted_at=now)
+            for ids in _chunks(entry_ids)
+        )
+        if claimed != len(selected):
+            kept = set()
+            for ids in _chunks(entry_ids):
+                kept.update(Waitlist_Entry.objects.filter(pk__in=ids, status='Promoted', promoted_at=now).values_list('pk', flat=True))
+            selected = [entry for entry in selected if entry[0] in kept]
+            entry_ids = [pk for pk, _, _ in selected]
+            if not selected:
+                return []
+
+        ticket_ids = _issue_tickets([(customer_id, trip_id, free[trip_id][1]) for _, customer_id, trip_id in selected], timezone.localdate(now))
+
+        # Links each entry to its new ticket (the customer's newest for the trip, which is
+        # locked) with one correlated UPDATE per chunk
+        issued = Ticket_Trip.objects.filter(
+            trip_id=OuterRef('trip_id'), ticket__customer_id=OuterRef('customer_id')
+        ).order_by('-ticket_id').values('ticket_id')[:1]
+        for ids in _chunks(entry_ids):
+            Waitlist_Entry.objects.filter(pk__in=ids).update(ticket=Subquery(issued))
+
+        transaction.on_commit(lambda: _notify(ticket_ids))
+    return ticket_ids
+
+
+def _notify(ticket_ids):
+    from .tasks import send_waitlist_promotion_emails
+    send_waitlist_promotion_emails.delay(ticket_ids)  # type: ignore
+
+
+def promote_waitlists(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Expires lapsed entries, then walks the trips that have a queue and free seats
+    in primary key order, batch_size trips per transaction, issuing tickets to the
+    front of each queue. Only waiting entries are read, through the partial
+    indexes, so a run costs O(queues with free seats), not O(waitlist history).
+    Returns (expired, ticket_ids).
+    """
+    now = now or timezone.now()
+    expired = expire_entries(now)
+
+    queued = Waitlist_Entry.objects.filter(status='Waiting').values('trip_id')
+    candidates = with_seats(Trip.objects.filter(pk__in=queued)).filter(
+        Q(capacity__isnull=True) | Q(capacity__lte=0) | Q(sold__lt=F('capacity'))
+    ).order_by('pk')
+
+    ticket_ids = []
+    last_pk = None
+    while True:
+        chunk = candidates.filter(pk__gt=last_pk) if last_pk is not None else candidates
+        trip_ids = list(chunk.values_list('pk', flat=True)[:batch_size])
+        if not trip_ids:
+            break
+        ticket_ids += _promote_chunk(trip_ids, now)
+        last_pk = trip_ids[-1]
+    return expired, ticket_ids
@@ -6,7 +6,15 @@ Copyright (c) 2019 - present AppSeed.us
 import os
 
 from django.core.asgi import get_asgi_application
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('DJANGO_ASGI_MODE', 'True')
 
-application = get_asgi_application()
+# e.g. uvicorn core.asgi:application --workers 2
+# Put a reverse proxy in front for static files in production; the handler below is a fallback
+application = ASGIStaticFilesHandler(get_asgi_application())
+
+# Build the station autocomplete index before the first request needs it
+from apps.home.autocomplete import warm_station_index  # noqa: E402
+warm_station_index()
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -11,4 +12,45 @@ app = Celery('core')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@task_prerun.connect
+def route_task_reads(task=None, **kwargs):
+    """
+    Most tasks run right after the write that queued them, so their reads go to the
+    primary. Read-only reporting tasks opt into replicas with replica_reads=True.
+    """
+    from core.db_router import pin_to_primary
+    pin_to_primary(not getattr(task, 'replica_reads', False))
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    from apps.home.metrics import task_started
+    task_started(task_id)
+
+
+@task_postrun.connect
+def record_task_run(task_id=None, task=None, state=None, **kwargs):
+    """
+    Counts every run by its final state and records how long it took, for /metrics.
+    """
+    from apps.home.metrics import task_finished
+    task_finished(task_id, getattr(task, 'name', 'unknown'), state)
+
+
+@task_prerun.connect
+def start_job_run(task_id=None, **kwargs):
+    from apps.home.profiling import start_job
+    start_job(task_id)
+
+
+@task_postrun.connect
+def record_job_run(task_id=None, task=None, state=None, retval=None, **kwargs):
+    """
+    Stores the run's duration, queries, rows written and memory as a Job_Run,
+    with a cProfile report for slow runs (see TASK_PROFILE_SECONDS).
+    """
+    from apps.home.profiling import finish_job
+    finish_job(task_id, getattr(task, 'name', 'unknown'), state, retval)
@@ -0,0 +1,146 @@
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.db import connections
+
+# Per-request (or per-task) routing state
+_force_primary = ContextVar('force_primary', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+STICKY_COOKIE = 'db_primary_until'
+
+
+def replica_aliases():
+    return list(getattr(settings, 'REPLICA_DATABASES', []))
+
+
+@contextmanager
+def primary_db():
+    """
+    Escape hatch: every read inside the block goes to the primary.
+    """
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def pin_to_primary(value=True):
+    """
+    Pins (or unpins) every read in the current context, e.g. for a Celery task run.
+    """
+    _force_primary.set(value)
+    _wrote.set(False)
+
+
+def use_primary_db(view):
+    """
+    View decorator for pages that must never see replica lag. Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            with primary_db():
+                return await view(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with primary_db():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a random replica and writes to 'default' (the primary).
+    Reads stay on the primary when pinned (primary_db(), a recent write by the
+    same client, or a write earlier in the same request) or inside a transaction.
+    """
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas or _force_primary.get() or _wrote.get():
+            return 'default'
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        aliases = {'default', *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Streaming replicas get the schema from the primary (their test databases
+        # mirror it); a standalone replica alias (DB_REPLICA_NAME) needs its own
+        if db == 'default':
+            return True
+        return db in settings.DATABASES and not settings.DATABASES[db].get('TEST', {}).get('MIRROR')
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Keeps a client on the primary for DB_STICKINESS_SECONDS after it writes,
+    so it always reads its own writes even if replicas are lagging.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Native async under ASGI, so async views are not pushed onto a worker thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self._pin(request)
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            self._unpin(tokens)
+        return self._stick(request, response, wrote)
+
+    async def __acall__(self, request):
+        tokens = self._pin(request)
+        try:
+            response = await self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            self._unpin(tokens)
+        return self._stick(request, response, wrote)
+
+    def _pin(self, request):
+        sticky = False
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            pass
+        return _force_primary.set(sticky or self._unsafe(request)), _wrote.set(False)
+
+    def _unpin(self, tokens):
+        force_token, wrote_token = tokens
+        _force_primary.reset(force_token)
+        _wrote.reset(wrote_token)
+
+    def _unsafe(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS')
+
+    def _stick(self, request, response, wrote):
+        if (wrote or self._unsafe(request)) and replica_aliases():
+            window = getattr(settings, 'DB_STICKINESS_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + window), max_age=window, httponly=True, samesite='Lax')
+        return response
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.db_router.ReplicaStickinessMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -43,8 +44,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.home.profiling.RequestProfilerMiddleware',
 ]
 
+# ASGI mode (set by core/asgi.py): WhiteNoise's middleware is sync-only and would push
+# every async view back onto a thread, so static files are served by core/asgi.py instead
+ASGI_MODE = config('DJANGO_ASGI_MODE', default=False, cast=bool)
+if ASGI_MODE:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'core.urls'
 LOGIN_REDIRECT_URL = "home"  # Route defined in home/urls.py
 LOGOUT_REDIRECT_URL = "home"  # Route defined in home/urls.py
@@ -67,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
 
 # Database
 # Swapped from sqlite3 to postgresql
@@ -82,6 +91,101 @@ DATABASES = {
     }
 }
 
+# Read replicas: comma-separated hosts, same credentials as the primary.
+# Read-only traffic is spread across them by core.db_router; leave empty to use the primary only.
+REPLICA_DATABASES = []
+for index, host in enumerate(h.strip() for h in str(config('DB_REPLICA_HOSTS', default='')).split(',') if h.strip()):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(alias)
+
+# Or one standalone replica alias with its own engine and name, e.g. a second SQLite file
+# (DB_REPLICA_ENGINE=django.db.backends.sqlite3 DB_REPLICA_NAME=replica.sqlite3) or another
+# PostgreSQL database, to exercise replica routing locally and in the test suite
+if config('DB_REPLICA_NAME', default=''):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        ENGINE=config('DB_REPLICA_ENGINE', default=DATABASES['default']['ENGINE']),
+        NAME=config('DB_REPLICA_NAME'),
+        HOST=config('DB_REPLICA_HOST', default=DATABASES['default']['HOST']),
+        PORT=config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+    )
+    REPLICA_DATABASES.append('replica')
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+
+# After a write, the same client reads from the primary for this long (read-your-writes)
+DB_STICKINESS_SECONDS = config('DB_STICKINESS_SECONDS', default=5, cast=int)
+
+# Cache
+# Redis in production (shared by all workers); per-process memory cache otherwise
+REDIS_CACHE_URL = config('REDIS_CACHE_URL', default='')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tiriantrains',
+        }
+    }
+
+# Station departure boards: sorted sets in Redis (falls back to an in-process stand-in)
+DEPARTURE_BOARD_REDIS_URL = config('DEPARTURE_BOARD_REDIS_URL', default=REDIS_CACHE_URL)
+DEPARTURE_BOARD_HOURS = config('DEPARTURE_BOARD_HOURS', default=24, cast=int)
+
+# Gate validation: how often each process re-checks the shared ticket revocation filter
+TICKET_REVOCATION_REFRESH_SECONDS = config('TICKET_REVOCATION_REFRESH_SECONDS', default=30, cast=int)
+
+# Send the ticket page's purchases through the booking queue; needs a worker on the `bookings` queue
+BOOKING_FORM_QUEUED = config('BOOKING_FORM_QUEUED', default=False, cast=bool)
+
+# Waitlist entries for sold-out trips lapse after this long (or at departure)
+WAITLIST_EXPIRY_HOURS = config('WAITLIST_EXPIRY_HOURS', default=48, cast=int)
+
+# Demand-based pricing reprices trips departing within this many days
+PRICING_HORIZON_DAYS = config('PRICING_HORIZON_DAYS', default=365, cast=int)
+
+# Station/route topology snapshot, memory-mapped by every process on the host and
+# rebuilt when the schedule version changes (use a path all workers can read and write)
+NETWORK_SNAPSHOT_PATH = config('NETWORK_SNAPSHOT_PATH', default=os.path.join(CORE_DIR, 'network.snapshot'))
+
+# All-pairs travel time / fare / hop matrix, written by Celery and memory-mapped by the
+# web processes, so (like MEDIA_ROOT) it must be on storage both can reach
+TRAVEL_MATRIX_DIR = config('TRAVEL_MATRIX_DIR', default=os.path.join(CORE_DIR, 'travel_matrix'))
+
+# How many days ahead recurring service patterns are offered for booking
+SERVICE_PATTERN_HORIZON_DAYS = config('SERVICE_PATTERN_HORIZON_DAYS', default=14, cast=int)
+
+# Minimum time a train needs between arriving and departing again
+TRAIN_MIN_TURNAROUND_MINUTES = config('TRAIN_MIN_TURNAROUND_MINUTES', default=10, cast=int)
+
+# /metrics: with several gunicorn workers or Celery children, point METRICS_DIR at a
+# directory shared by them (emptied before each start) so a scrape sees every process.
+# prometheus_client reads it from the environment when first imported, so export it here.
+# The endpoint is refused unless METRICS_TOKEN is set (sent as a bearer token) or DEBUG is on
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+if METRICS_DIR:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_DIR)
+
+# Every Celery task run is recorded as a Job_Run. With TASK_PROFILE_SECONDS > 0 runs are
+# profiled too, and runs at least that slow keep their cProfile report
+TASK_PROFILE_SECONDS = config('TASK_PROFILE_SECONDS', default=0, cast=float)
+JOB_RUN_RETENTION_DAYS = config('JOB_RUN_RETENTION_DAYS', default=30, cast=int)
+
+# Request profiling (apps.home.profiling.RequestProfilerMiddleware) is off unless
+# REQUEST_PROFILE_DIR is set; staff then profile a request with an X-Profile header or
+# ?_profile=1, and REQUEST_PROFILE_SAMPLE_RATE of all requests are stack-sampled
+REQUEST_PROFILE_DIR = config('REQUEST_PROFILE_DIR', default='')
+REQUEST_PROFILE_SAMPLE_RATE = config('REQUEST_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+REQUEST_PROFILE_KEEP = config('REQUEST_PROFILE_KEEP', default=200, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -116,6 +220,12 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Ticket purchases in async mode go to their own queue so a flash sale is drained
+# at a fixed rate by a dedicated worker (see README) instead of piling onto the web tier
+CELERY_TASK_ROUTES = {
+    'apps.home.tasks.process_booking_request': {'queue': 'bookings'},
+}
+
 # Celery Beat Schedule (Cron Jobs)
 from celery.schedules import crontab
 
@@ -128,6 +238,30 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.home.tasks.archive_past_trips',
         'schedule': crontab(minute=0),  # Runs at the top of every hour
     },
+    'refresh-departure-boards': {
+        'task': 'apps.home.tasks.refresh_departure_boards',
+        'schedule': crontab(minute='*/15'),  # Keeps pattern departures DEPARTURE_BOARD_HOURS ahead
+    },
+    'publish-ticket-revocations': {
+        'task': 'apps.home.tasks.publish_ticket_revocations',
+        'schedule': crontab(minute='*/5'),  # Cancellations also publish immediately on commit
+    },
+    'promote-waitlisted-customers': {
+        'task': 'apps.home.tasks.promote_waitlisted_customers',
+        'schedule': crontab(),  # Every minute; cancellations also trigger a run
+    },
+    'reprice-upcoming-trips': {
+        'task': 'apps.home.tasks.reprice_upcoming_trips',
+        'schedule': crontab(minute=30),  # Hourly, off the archiving run at the top of the hour
+    },
+    'update-travel-matrix': {
+        'task': 'apps.home.tasks.update_travel_matrix',
+        'schedule': crontab(hour=1, minute=30),  # Nightly, as typical trip times and fares drift
+    },
+    'prune-job-runs': {
+        'task': 'apps.home.tasks.prune_job_runs',
+        'schedule': crontab(hour=3, minute=15),  # Daily, clear of the midnight jobs
+    },
 }
 
 # Default primary key field type
@@ -148,4 +282,7 @@ STATICFILES_DIRS = (
 )
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(CORE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(CORE_DIR, 'media')
+
+# Profile picture uploads above this size are rejected while streaming to disk
+AVATAR_MAX_UPLOAD_SIZE = config('AVATAR_MAX_UPLOAD_SIZE', default=5 * 1024 * 1024, cast=int)
\ No newline at end of file
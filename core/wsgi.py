@@ -10,3 +10,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Build the station autocomplete index before the first request needs it
+from apps.home.autocomplete import warm_station_index  # noqa: E402
+warm_station_index()